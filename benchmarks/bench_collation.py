@@ -0,0 +1,121 @@
+"""
+Padding and compute per step of the fine-tuning collation modes:
+
+  max_length   every row padded to max_length (tokenize_and_mask_batched, current notebook)
+  dynamic      shuffled batches padded to their longest row
+  bucket       length-bucketed batches padded to their longest row
+  packed       examples packed into max_length rows with block-diagonal attention
+
+Uses the synthetic ALQAC corpus and local BPE tokenizer of bench_tokenize. With
+--model-steps N, a small random Llama runs forward+backward on N batches of each mode
+and the trained-token throughput is reported.
+
+    python -m benchmarks.bench_collation [--samples 5000] [--max-length 384] [--batch-size 8]
+"""
+import argparse
+import random
+import time
+
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from benchmarks.bench_tokenize import load_pairs, make_corpus, make_tokenizer
+from src.utils.collation import (
+    DynamicPaddingCollator, LengthBucketBatchSampler, PackedCollator, pack_examples, padding_stats
+)
+from src.utils.data_prep import tokenize_and_mask_batched
+
+
+def batches_of(dataset, index_batches):
+    for indices in index_batches:
+        rows = dataset[indices]
+        yield [dict(zip(rows, values)) for values in zip(*rows.values())]
+
+
+def sequential(n: int, batch_size: int, seed: int = 0):
+    indices = list(range(n))
+    random.Random(seed).shuffle(indices)
+    return [indices[i:i + batch_size] for i in range(0, n, batch_size)]
+
+
+def train_throughput(model, feature_batches, collate, steps: int) -> float:
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-4)
+    trained = 0
+    start = None
+    for step, features in enumerate(feature_batches):
+        if step == steps + 1:
+            break
+        if step == 1:
+            start = time.perf_counter()
+        batch = collate(features)
+        loss = model(**batch).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        if step >= 1:
+            trained += int((batch["labels"] != -100).sum())
+    return trained / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default="ALQAC.csv")
+    parser.add_argument("--samples", type=int, default=5000)
+    parser.add_argument("--max-length", type=int, default=384)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--model-steps", type=int, default=0)
+    args = parser.parse_args()
+
+    questions, answers = load_pairs(args.csv)
+    tokenizer = make_tokenizer(questions + answers)
+    dataset = make_corpus(questions, answers, args.samples)
+    map_kwargs = dict(batched=True, batch_size=1000, remove_columns=["messages"], load_from_cache_file=False)
+    tok_kwargs = {"tokenizer": tokenizer, "max_length": args.max_length}
+
+    padded = dataset.map(tokenize_and_mask_batched, fn_kwargs=tok_kwargs, **map_kwargs)
+    ragged = dataset.map(tokenize_and_mask_batched, fn_kwargs=dict(tok_kwargs, pad=False), **map_kwargs)
+    packed = ragged.map(
+        pack_examples, fn_kwargs={"max_length": args.max_length}, batched=True, batch_size=1000,
+        remove_columns=ragged.column_names, load_from_cache_file=False
+    )
+
+    def full_width(features):
+        return {
+            "input_ids": torch.tensor([f["input_ids"] for f in features]),
+            "attention_mask": torch.tensor([f["attention_mask"] for f in features]),
+            "labels": torch.tensor([f["labels"] for f in features]),
+        }
+
+    pad_id = tokenizer.pad_token_id
+    modes = {
+        "max_length": (padded, sequential(len(padded), args.batch_size), full_width),
+        "dynamic": (ragged, sequential(len(ragged), args.batch_size), DynamicPaddingCollator(pad_id)),
+        "bucket": (ragged, list(LengthBucketBatchSampler(ragged["length"], args.batch_size)), DynamicPaddingCollator(pad_id)),
+        "packed": (packed, sequential(len(packed), args.batch_size), PackedCollator(pad_id)),
+    }
+
+    model = None
+    if args.model_steps:
+        torch.manual_seed(0)
+        model = LlamaForCausalLM(LlamaConfig(
+            vocab_size=len(tokenizer), hidden_size=256, intermediate_size=688,
+            num_hidden_layers=4, num_attention_heads=4, num_key_value_heads=4,
+            max_position_embeddings=args.max_length, attn_implementation="sdpa",
+        ))
+
+    print(f"{args.samples} examples, max_length {args.max_length}, batch size {args.batch_size}")
+    for name, (data, index_batches, collate) in modes.items():
+        stats = padding_stats(batches_of(data, index_batches), collate)
+        line = (
+            f"{name:>10} | {stats['steps']:5d} steps | padding {stats['padding_ratio']:6.1%} | "
+            f"computed {stats['computed_tokens_per_step']:7.0f} tok/step | "
+            f"real {stats['real_tokens_per_step']:7.0f} | trained {stats['trained_tokens_per_step']:7.0f}"
+        )
+        if model is not None:
+            rate = train_throughput(model, batches_of(data, index_batches), collate, args.model_steps)
+            line += f" | {rate:7.0f} trained tok/s"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Build time of get_dataset against the previous row-by-row implementation, on a local
+fixture shaped like thangvip/vietnamese-legal-qa (documents with a `generated_qa_pairs`
+list of {question, answer}) generated from ALQAC.csv.
+
+Reports the legacy loop, a cold columnar build and a warm (cached) load, and checks
+that the splits hold the same rows as before minus the val rows that used to leak
+into train.
+
+    python -m benchmarks.bench_get_dataset [--documents 20000] [--pairs 5] [--samples 30000]
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+from datasets import Dataset
+from sklearn.model_selection import train_test_split
+from tqdm.auto import tqdm
+
+from src.utils.data_prep import get_dataset, preprocess_function
+
+
+def make_fixture(path: str, csv_path: str, documents: int, pairs: int, seed: int = 0):
+    with open(csv_path, encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.DictReader(f))
+    rng = random.Random(seed)
+    # Contexts stand in for long answers so the 256-word filter drops some pairs
+    answers = [r["answer"] for r in rows] + [r["context"] for r in rows]
+    Dataset.from_dict({
+        "generated_qa_pairs": [
+            [{"question": rng.choice(rows)["question"], "answer": rng.choice(answers)} for _ in range(rng.randint(1, 2 * pairs))]
+            for _ in range(documents)
+        ]
+    }).to_parquet(path)
+
+
+def legacy_get_dataset(ds, n_samples):
+    """get_dataset before the columnar rewrite, minus load_dataset (val rows leak into train)"""
+    rows = []
+    for i in tqdm(range(len(ds))):
+        qa_pairs = ds[i]["generated_qa_pairs"]
+        for qa_pair in qa_pairs:
+            rows.append({"question": qa_pair["question"], "answer": qa_pair["answer"]})
+
+    df = pd.DataFrame(rows)
+    df = df.assign(num_tokens=df["answer"].apply(lambda text: len(str(text).split())))
+    df = df.loc[df["num_tokens"] < 256]
+    if len(df) > n_samples:
+        df = df.sample(n_samples, random_state=42).reset_index(drop=True)
+
+    df_train, df_val = train_test_split(df, test_size=0.1, random_state=42)
+    ds_train = Dataset.from_pandas(df).map(preprocess_function).select_columns(["messages"])
+    ds_val = Dataset.from_pandas(df_val).map(preprocess_function).select_columns(["messages"])
+    return ds_train, ds_val
+
+
+def as_pairs(ds):
+    return sorted((m[1]["content"], m[2]["content"]) for m in ds["messages"])
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f"{label:>14} | {time.perf_counter() - start:7.2f}s | train {len(result[0])}, val {len(result[1])}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default="ALQAC.csv")
+    parser.add_argument("--documents", type=int, default=20000)
+    parser.add_argument("--pairs", type=int, default=5, help="Average QA pairs per document")
+    parser.add_argument("--samples", type=int, default=30000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fixture = os.path.join(tmp, "legal-qa.parquet")
+        make_fixture(fixture, args.csv, args.documents, args.pairs)
+        cache_dir = os.path.join(tmp, "cache")
+
+        legacy_train, legacy_val = timed("legacy", lambda: legacy_get_dataset(Dataset.from_parquet(fixture), args.samples))
+        train, val = timed("columnar cold", lambda: get_dataset(args.samples, source=fixture, cache_dir=cache_dir))
+        timed("columnar warm", lambda: get_dataset(args.samples, source=fixture, cache_dir=cache_dir))
+
+        val_pairs, train_pairs = as_pairs(val), as_pairs(train)
+        print(f"val identical to legacy: {val_pairs == as_pairs(legacy_val)}")
+        print(f"train == legacy train minus val: {sorted(train_pairs + val_pairs) == as_pairs(legacy_train)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Cost of serving several LoRA adapters on one set of base weights with the transformers backend:
+memory per extra adapter and what switching adapters between requests costs, on CPU.
+
+The base is a randomly initialised Llama saved with the ALQAC-trained BPE tokenizer of
+bench_tokenize (see bench_precision); the adapters are random peft LoRAs on the attention
+projections, so nothing is downloaded. Reported:
+
+- per adapter: parameter MB and resident memory added when it is registered, against the
+  size of a full model copy (what serving one fine-tuned checkpoint per adapter would cost)
+- single requests: latency of the base model, the same adapter every time, and a different
+  adapter every time (switching is per call, so the last two should match)
+- micro-batches of --batch rows: all rows on one adapter (one `generate` call) against rows
+  spread over every adapter (one call per adapter, as generate_batch groups them)
+
+Generation is greedy with a fixed length so every variant does the same work.
+
+    python -m benchmarks.bench_lora [--adapters 4] [--rank 16] [--requests 12] [--batch 8]
+"""
+import argparse
+import tempfile
+import time
+
+import psutil
+import torch
+from peft import LoraConfig, get_peft_model
+from transformers import LlamaForCausalLM
+
+from benchmarks.bench_precision import make_model
+from src.backends.transformers_backend import TransformersBackend
+
+
+def make_adapters(base_path: str, root: str, count: int, rank: int) -> list:
+    paths = []
+    for i in range(count):
+        torch.manual_seed(100 + i)
+        model = get_peft_model(
+            LlamaForCausalLM.from_pretrained(base_path),
+            LoraConfig(
+                r=rank,
+                lora_alpha=2 * rank,
+                target_modules=["q_proj", "k_proj", "v_proj", "o_proj"],
+                init_lora_weights=False,
+            ),
+        )
+        paths.append(f"{root}/adapter{i}")
+        model.save_pretrained(paths[-1])
+    return paths
+
+
+def timed_generate(backend: TransformersBackend, questions, adapter, new_tokens: int) -> float:
+    inputs = backend._prepare_inputs(questions, adapter=adapter)
+    start = time.perf_counter()
+    with torch.inference_mode():
+        backend.model.generate(
+            **inputs,
+            max_new_tokens=new_tokens,
+            min_new_tokens=new_tokens,
+            do_sample=False,
+            pad_token_id=backend.tokenizer.pad_token_id,
+        )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default="ALQAC.csv")
+    parser.add_argument("--hidden", type=int, default=1024, help="TinyLlama is 2048")
+    parser.add_argument("--layers", type=int, default=8, help="TinyLlama has 22")
+    parser.add_argument("--adapters", type=int, default=4)
+    parser.add_argument("--rank", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=12, help="single requests per variant")
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--new-tokens", type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        questions = make_model(path, args.csv, args.hidden, args.layers)
+        adapter_paths = make_adapters(path, path, args.adapters, args.rank)
+        print(
+            f"Llama hidden={args.hidden} layers={args.layers}, {args.adapters} LoRA adapters r={args.rank} on q/k/v/o, "
+            f"{args.new_tokens} greedy tokens, {torch.get_num_threads()} threads"
+        )
+
+        process = psutil.Process()
+        rss_before = process.memory_info().rss
+        backend = TransformersBackend("Bạn là trợ lý pháp luật.", precision="float32")
+        backend.load(path)
+        base_rss = (process.memory_info().rss - rss_before) / 2**20
+        base_params = sum(p.numel() * p.element_size() for p in backend.model.parameters()) / 2**20
+
+        names = [f"adapter{i}" for i in range(args.adapters)]
+        stats = [backend.load_adapter(name, adapter_path) for name, adapter_path in zip(names, adapter_paths)]
+
+        print(f"\nbase model: {base_params:.0f}MB parameters, +{base_rss:.0f}MB RSS")
+        print(f"{'adapter':>9} | {'params':>8} | {'+RSS':>8} | {'load':>6} | {'vs full copy':>12}")
+        for name, stat in zip(names, stats):
+            print(
+                f"{name:>9} | {stat['params_mb']:6.2f}MB | {stat['rss_mb']:6.2f}MB | {stat['load_s']:5.2f}s | "
+                f"{stat['params_mb'] / base_params:12.2%}"
+            )
+
+        # Warm every adapter's code path once
+        for adapter in [None] + names:
+            timed_generate(backend, questions[:1], adapter, 2)
+
+        singles = {
+            "base": [None] * args.requests,
+            "same adapter": [names[0]] * args.requests,
+            "switch each request": [names[i % len(names)] for i in range(args.requests)],
+        }
+        print(f"\n{'single requests':>20} | {'mean':>8}")
+        for label, sequence in singles.items():
+            seconds = [timed_generate(backend, [q], a, args.new_tokens) for q, a in zip(questions, sequence)]
+            print(f"{label:>20} | {sum(seconds) / len(seconds) * 1000:6.1f}ms")
+
+        batch = questions[:args.batch]
+        one_group = timed_generate(backend, batch, names[0], args.new_tokens)
+        groups = [batch[i::len(names)] for i in range(len(names))]
+        spread = sum(timed_generate(backend, group, name, args.new_tokens) for name, group in zip(names, groups) if group)
+        print(f"\n{f'batch of {args.batch}':>20} | {'total':>8} | {'per row':>8}")
+        for label, seconds in [("one adapter", one_group), (f"{len(names)} adapters", spread)]:
+            print(f"{label:>20} | {seconds * 1000:6.0f}ms | {seconds / len(batch) * 1000:6.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
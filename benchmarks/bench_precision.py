@@ -0,0 +1,144 @@
+"""
+Load time, resident memory, decode speed and answer agreement of the transformers backend's
+MODEL_PRECISION options against the float32 baseline, on CPU.
+
+The model is a randomly initialised Llama (TinyLlama's shape scaled down by default) saved to
+a temp dir with the ALQAC-trained BPE tokenizer of bench_tokenize, so nothing is downloaded.
+Each precision is loaded through TransformersBackend in its own process, so RSS is not shared.
+Answers are greedy with a fixed length; agreement with float32 is reported as the share of
+teacher-forced next-token predictions over the prompts that match, and the mean share of each
+greedy answer generated before it first differs. Random weights give flat logits, so these
+are a lower bound on what a trained checkpoint keeps.
+
+    python -m benchmarks.bench_precision [--questions 16] [--new-tokens 32] [--precisions float32 bfloat16 int8]
+"""
+import argparse
+import multiprocessing as mp
+import tempfile
+import time
+
+import psutil
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from benchmarks.bench_tokenize import load_pairs, make_tokenizer
+from src.backends.transformers_backend import TransformersBackend
+from src.utils.precision import cpu_has_native_bf16
+
+
+def make_model(path: str, csv_path: str, hidden: int, layers: int, seed: int = 0):
+    questions, answers = load_pairs(csv_path)
+    tokenizer = make_tokenizer(questions + answers)
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden,
+        intermediate_size=int(hidden * 2.75),
+        num_hidden_layers=layers,
+        num_attention_heads=hidden // 64,
+        num_key_value_heads=max(1, hidden // 256),
+        max_position_embeddings=2048,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    LlamaForCausalLM(config).save_pretrained(path, safe_serialization=True)
+    return questions
+
+
+def measure(path: str, precision: str, questions, new_tokens: int, queue: mp.Queue):
+    """Runs in a fresh process: load, generate greedily, report timings and outputs"""
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+
+    backend = TransformersBackend("Bạn là trợ lý pháp luật.", precision=precision)
+    start = time.perf_counter()
+    backend.load(path)
+    load_seconds = time.perf_counter() - start
+    rss = process.memory_info().rss
+
+    answers, predictions = [], []
+    generate_seconds = 0.0
+    with torch.inference_mode():
+        for question in questions:
+            inputs = backend._prepare_inputs([question])
+            start = time.perf_counter()
+            output = backend.model.generate(
+                **inputs,
+                max_new_tokens=new_tokens,
+                min_new_tokens=new_tokens,
+                do_sample=False,
+                pad_token_id=backend.tokenizer.pad_token_id,
+            )
+            generate_seconds += time.perf_counter() - start
+            answers.append(output[0, inputs["input_ids"].shape[1]:].tolist())
+
+            # Teacher-forced next-token predictions over the whole templated prompt
+            ids = backend.tokenizer(backend.build_prompt(question), return_tensors="pt")["input_ids"]
+            predictions.append(backend.model(input_ids=ids).logits[0].argmax(-1).tolist())
+
+    queue.put({
+        "precision": backend.precision,
+        "load_s": load_seconds,
+        "rss_mb": rss / 2**20,
+        "rss_delta_mb": (rss - rss_before) / 2**20,
+        "tokens_per_s": len(questions) * new_tokens / generate_seconds,
+        "answers": answers,
+        "predictions": predictions,
+    })
+
+
+def agreement(result: dict, baseline: dict) -> tuple:
+    matched = total = 0
+    for ours, theirs in zip(result["predictions"], baseline["predictions"]):
+        matched += sum(a == b for a, b in zip(ours, theirs))
+        total += len(theirs)
+
+    prefixes = []
+    for ours, theirs in zip(result["answers"], baseline["answers"]):
+        same = next((i for i, (a, b) in enumerate(zip(ours, theirs)) if a != b), len(theirs))
+        prefixes.append(same / len(theirs))
+    return matched / total, sum(prefixes) / len(prefixes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default="ALQAC.csv")
+    parser.add_argument("--hidden", type=int, default=1024, help="TinyLlama is 2048")
+    parser.add_argument("--layers", type=int, default=8, help="TinyLlama has 22")
+    parser.add_argument("--questions", type=int, default=16)
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--precisions", nargs="+", default=["float32", "bfloat16", "float16", "int8"])
+    args = parser.parse_args()
+
+    context = mp.get_context("spawn")
+    with tempfile.TemporaryDirectory() as path:
+        questions = make_model(path, args.csv, args.hidden, args.layers)[:args.questions]
+        print(
+            f"Llama hidden={args.hidden} layers={args.layers}, {args.questions} questions x {args.new_tokens} tokens, "
+            f"{torch.get_num_threads()} threads, native bf16: {cpu_has_native_bf16()}"
+        )
+
+        results = {}
+        for precision in ["float32"] + [p for p in args.precisions if p != "float32"]:
+            queue = context.Queue()
+            worker = context.Process(target=measure, args=(path, precision, questions, args.new_tokens, queue))
+            worker.start()
+            results[precision] = queue.get()
+            worker.join()
+
+    baseline = results["float32"]
+    print(f"{'precision':>10} | {'load':>6} | {'RSS':>8} | {'+RSS':>8} | {'tok/s':>7} | {'speedup':>7} | {'top-1 agree':>11} | {'answer prefix':>13}")
+    for precision, result in results.items():
+        top1, prefix = agreement(result, baseline)
+        print(
+            f"{precision:>10} | {result['load_s']:5.2f}s | {result['rss_mb']:6.0f}MB | {result['rss_delta_mb']:6.0f}MB | "
+            f"{result['tokens_per_s']:7.1f} | {result['tokens_per_s'] / baseline['tokens_per_s']:6.2f}x | "
+            f"{top1:11.1%} | {prefix:13.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
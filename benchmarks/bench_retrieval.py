@@ -0,0 +1,76 @@
+"""
+Query latency of the BM25 retrieval index on the ALQAC corpus and on a synthetic
+corpus scaled 100x (passages rebuilt from shuffled lines of the originals).
+
+    python -m benchmarks.bench_retrieval [--csv ALQAC.csv] [--scale 100] [--k 3]
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from src.retrieval import BM25Index, load_passages
+
+
+def synthetic_corpus(passages, scale: int, seed: int = 0):
+    rng = random.Random(seed)
+    lines = [line for p in passages for line in p.split("\n") if line.strip()]
+    sizes = [p.count("\n") + 1 for p in passages]
+    corpus = list(passages)
+    for _ in range(len(passages) * (scale - 1)):
+        corpus.append("\n".join(rng.choices(lines, k=rng.choice(sizes))))
+    return corpus
+
+
+def bench(name, passages, questions, k):
+    start = time.perf_counter()
+    index = BM25Index.build(passages)
+    build_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.bm25")
+        index.save(path)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+
+        start = time.perf_counter()
+        index = BM25Index.load(path)
+        load_time = time.perf_counter() - start
+
+        for q in questions[:20]:
+            index.search(q, k)
+        latencies = []
+        for q in questions:
+            start = time.perf_counter()
+            index.search(q, k)
+            latencies.append(time.perf_counter() - start)
+        del index
+
+    lat = np.array(latencies) * 1000
+    print(
+        f"{name:>10} | docs={len(passages):>7} | build={build_time:6.2f}s | file={size_mb:7.1f}MB | "
+        f"load={load_time * 1000:6.2f}ms | query p50={np.percentile(lat, 50):6.3f}ms "
+        f"p95={np.percentile(lat, 95):6.3f}ms p99={np.percentile(lat, 99):6.3f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default="ALQAC.csv")
+    parser.add_argument("--scale", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    passages = load_passages(args.csv)
+    with open(args.csv, encoding="utf-8-sig", newline="") as f:
+        questions = [row["question"] for row in csv.DictReader(f)]
+
+    bench("ALQAC", passages, questions, args.k)
+    bench(f"ALQAC x{args.scale}", synthetic_corpus(passages, args.scale), questions, args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Lookup cost of the semantic cache at 10k and 100k cached entries.
+
+Entries are ALQAC questions with random word insertions; lookups are a mix of
+cached paraphrases and unseen questions, issued in batches as the batcher does.
+
+    python -m benchmarks.bench_semantic_cache [--sizes 10000 100000] [--batch-sizes 1 8 32]
+"""
+import argparse
+import csv
+import random
+import time
+
+import numpy as np
+
+from src.semantic_cache import HashedNgramEmbedder, SemanticCache
+
+FILLERS = ["cho hỏi", "xin hỏi", "vậy", "ạ", "theo luật", "hiện nay", "thì", "như thế nào"]
+
+
+def perturb(question: str, rng: random.Random) -> str:
+    words = question.split()
+    words.insert(rng.randrange(len(words) + 1), rng.choice(FILLERS))
+    return " ".join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default="ALQAC.csv")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with open(args.csv, encoding="utf-8-sig", newline="") as f:
+        questions = [row["question"] for row in csv.DictReader(f)]
+
+    embedder = HashedNgramEmbedder(dim=args.dim)
+    start = time.perf_counter()
+    for q in questions:
+        embedder.embed(q)
+    embed_us = (time.perf_counter() - start) / len(questions) * 1e6
+    print(f"embed: {embed_us:.1f}us/question (dim={args.dim})")
+
+    for size in args.sizes:
+        cache = SemanticCache(capacity=size, threshold=0.9, embedder=embedder)
+        start = time.perf_counter()
+        for i in range(size):
+            cache.put(perturb(questions[i % len(questions)], rng), None, f"answer {i}")
+        fill = time.perf_counter() - start
+        matrix_mb = cache._matrix.nbytes / 1024 / 1024
+
+        for batch_size in args.batch_sizes:
+            latencies = []
+            for _ in range(args.rounds):
+                batch = [(perturb(rng.choice(questions), rng), None) for _ in range(batch_size)]
+                start = time.perf_counter()
+                cache.lookup_batch(batch)
+                latencies.append(time.perf_counter() - start)
+            lat = np.array(latencies) * 1000
+            print(
+                f"entries={size:>7} matrix={matrix_mb:6.1f}MB fill={fill:5.1f}s | batch={batch_size:>3} "
+                f"p50={np.percentile(lat, 50):7.3f}ms p95={np.percentile(lat, 95):7.3f}ms "
+                f"per-query={np.percentile(lat, 50) / batch_size:7.3f}ms"
+            )
+        print(f"entries={size:>7} hit rate on paraphrases: {cache.hits / max(cache.hits + cache.misses, 1):.0%}")
+
+
+if __name__ == "__main__":
+    main()
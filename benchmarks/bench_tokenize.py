@@ -0,0 +1,128 @@
+"""
+Preprocessing cost of tokenize_and_mask (one example per call, prompt tokenized twice)
+against tokenize_and_mask_batched (Dataset.map(batched=True), one pass, vectorized labels).
+
+The corpus is synthetic: ALQAC questions and answers shuffled into chat examples like the
+fine-tuning set. The tokenizer is a byte-level BPE trained on that corpus with the
+notebook's chat template and special tokens, so no download is needed.
+
+    python -m benchmarks.bench_tokenize [--samples 30000] [--max-length 1024] [--num-proc 1 4]
+"""
+import argparse
+import csv
+import os
+import random
+import time
+
+import numpy as np
+from datasets import Dataset
+from tokenizers import Tokenizer, models, pre_tokenizers, decoders, trainers
+from transformers import PreTrainedTokenizerFast
+
+from src.utils.data_prep import preprocess_function, tokenize_and_mask, tokenize_and_mask_batched
+
+CHAT_TEMPLATE = """{% for message in messages %}
+{% if message['role'] == 'system' %}
+<|system|>
+{{ message['content'].strip() }}
+{{ eos_token }}
+{% elif message['role'] == 'user' %}
+<|user|>
+{{ message['content'].strip() }}
+{{ eos_token }}
+{% elif message['role'] == 'assistant' %}
+<|assistant|>
+{{ message['content'].strip() }}
+{{ eos_token }}
+{% endif %}
+{% endfor %}
+{% if add_generation_prompt %}
+<|assistant|>
+{% endif %}"""
+
+
+def load_pairs(path: str):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.DictReader(f))
+    return [r["question"] for r in rows], [r["answer"] for r in rows] + [r["context"][:600] for r in rows]
+
+
+def make_corpus(questions, answers, samples: int, seed: int = 0) -> Dataset:
+    rng = random.Random(seed)
+    rows = [{"question": rng.choice(questions), "answer": rng.choice(answers)} for _ in range(samples)]
+    return Dataset.from_list(rows).map(preprocess_function).select_columns(["messages"])
+
+
+def make_tokenizer(texts, vocab_size: int = 8000) -> PreTrainedTokenizerFast:
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=["<s>", "</s>", "<unk>"])
+    tokenizer.train_from_iterator(texts, trainer)
+
+    fast = PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", unk_token="<unk>")
+    fast.add_special_tokens({"additional_special_tokens": ["<|system|>", "<|user|>", "<|assistant|>"]})
+    fast.pad_token = fast.eos_token
+    fast.padding_side = "right"
+    fast.chat_template = CHAT_TEMPLATE
+    return fast
+
+
+def timed(label: str, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:>28} | {elapsed:7.2f}s | {len(result) / elapsed:8.0f} examples/s")
+    return result, elapsed
+
+
+def compare(reference, batched) -> str:
+    ids_ref, ids_new = np.asarray(reference["input_ids"]), np.asarray(batched["input_ids"])
+    labels_ref, labels_new = np.asarray(reference["labels"]), np.asarray(batched["labels"])
+    mask = np.asarray(batched["attention_mask"]) == 1
+
+    same_ids = (ids_ref == ids_new).all()
+    # The batched variant also masks padding; compare labels on real tokens only
+    differing = ((labels_ref != labels_new) & mask).any(axis=1)
+    return f"input_ids identical: {same_ids}, label rows differing on real tokens: {differing.sum()}/{len(differing)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default="ALQAC.csv")
+    parser.add_argument("--samples", type=int, default=30000)
+    parser.add_argument("--max-length", type=int, default=1024)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--num-proc", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    questions, answers = load_pairs(args.csv)
+    tokenizer = make_tokenizer(questions + answers)
+    dataset = make_corpus(questions, answers, args.samples)
+    print(f"{args.samples} examples, max_length {args.max_length}, vocab {len(tokenizer)}")
+
+    reference, base = timed(
+        "tokenize_and_mask",
+        lambda: dataset.map(
+            lambda example: tokenize_and_mask(example, tokenizer, args.max_length),
+            remove_columns=["messages"], load_from_cache_file=False
+        )
+    )
+    reference.set_format("numpy")
+
+    for num_proc in sorted(set(args.num_proc)):
+        batched, elapsed = timed(
+            f"batched, num_proc={num_proc}",
+            lambda: dataset.map(
+                tokenize_and_mask_batched,
+                fn_kwargs={"tokenizer": tokenizer, "max_length": args.max_length},
+                batched=True, batch_size=args.batch_size, num_proc=num_proc if num_proc > 1 else None,
+                remove_columns=["messages"], load_from_cache_file=False
+            )
+        )
+        batched.set_format("numpy")
+        print(f"{'':>28} | {base / elapsed:.1f}x, {compare(reference, batched)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Throughput and latency of serving layouts: worker processes x inference executor threads x
+torch intra-op threads, each run as a real `python -m src.server` on its own port and
+driven over HTTP with the monitor.client request sender.
+
+A layout is written WORKERSxEXECUTORxTHREADS (e.g. 2x1x2); `auto` is what topology.py
+derives from this machine's CPU limit, and `torch-default` is the layout before it existed
+(one process, one executor thread per core, torch's default of one thread per host core).
+Caches and admission control are off so every request generates. Without --model-path the
+simulated backend runs with --sim-cpu-fraction of its time busy on a core; with one (e.g. a
+tiny Llama) the transformers backend generates for real.
+
+Each layout reports, per concurrency level (that many clients sending back to back for
+--duration seconds): successful requests per second, p50/p95 latency, and the torch threads
+the worker actually ran with (GET /topology).
+
+    python -m benchmarks.bench_topology [--model-path /models/tiny] [--layouts auto torch-default 1x1x1 2x1x1]
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import httpx
+
+from monitor.client import DEFAULT_DATASET, load_questions, percentiles, send
+from src.topology import plan_topology
+from src.utils.cpu_limits import get_cpu_limit
+
+
+def parse_layout(name: str) -> dict:
+    """Layout name -> WEB_WORKERS, INFERENCE_WORKERS, TORCH_THREADS"""
+    if name == "auto":
+        topology = plan_topology()
+        return {"WEB_WORKERS": topology.web_workers, "INFERENCE_WORKERS": topology.inference_workers,
+                "TORCH_THREADS": topology.intra_op_threads}
+    if name == "torch-default":
+        return {"WEB_WORKERS": 1, "INFERENCE_WORKERS": max(1, math.floor(get_cpu_limit())),
+                "TORCH_THREADS": os.cpu_count() or 1}
+    workers, executor, threads = (int(part) for part in name.split("x"))
+    return {"WEB_WORKERS": workers, "INFERENCE_WORKERS": executor, "TORCH_THREADS": threads}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(layout: dict, port: int, args) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        **{key: str(value) for key, value in layout.items()},
+        "PORT": str(port),
+        "TORCH_INTEROP_THREADS": "1",
+        "RESPONSE_CACHE_MAX_ENTRIES": "0",
+        "SEMANTIC_CACHE_CAPACITY": "0",
+        "ADMISSION_MAX_INFLIGHT_TOKENS": "0",
+        "RETRIEVAL_INDEX_PATH": "",
+        "LOG_LEVEL": "WARNING",
+    }
+    if args.model_path:
+        env.update(INFERENCE_BACKEND="transformers", MODEL_PATH=args.model_path)
+    else:
+        env.update(INFERENCE_BACKEND="simulated", SIM_CPU_FRACTION=str(args.sim_cpu_fraction))
+    return subprocess.Popen(
+        [sys.executable, "-m", "src.server"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, workers: int, timeout: float):
+    """Until enough consecutive /ready probes pass that every worker has most likely answered one"""
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while streak < 4 * workers:
+        if time.monotonic() > deadline:
+            raise TimeoutError("server did not become ready")
+        try:
+            streak = streak + 1 if (await client.get("/ready")).status_code == 200 else 0
+        except httpx.HTTPError:
+            streak = 0
+        await asyncio.sleep(0.05 if streak else 0.5)
+
+
+async def run_closed(client: httpx.AsyncClient, questions, concurrency: int, args) -> dict:
+    """`concurrency` clients, each sending its next request as soon as the previous one returns"""
+    rng = random.Random(0)
+    request_args = SimpleNamespace(stream=False, max_tokens=args.max_tokens)
+    results = []
+    start = time.perf_counter()
+
+    async def client_loop():
+        while time.perf_counter() - start < args.duration:
+            results.append(await send(client, rng.choice(questions), request_args, time.perf_counter()))
+
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    ok = [r for r in results if r.ok]
+    return {
+        "throughput_rps": len(ok) / elapsed,
+        "error_rate": 1 - len(ok) / len(results) if results else 0.0,
+        "latency_ms": percentiles([r.latency for r in ok]),
+    }
+
+
+async def bench_layout(name: str, questions, args) -> list:
+    layout = parse_layout(name)
+    port = free_port()
+    server = start_server(layout, port, args)
+    rows = []
+    try:
+        max_concurrency = max(args.concurrency)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}",
+            timeout=args.timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        ) as client:
+            await wait_ready(client, layout["WEB_WORKERS"], args.startup_timeout)
+            torch_threads = (await client.get("/topology")).json().get("torch")
+            for concurrency in args.concurrency:
+                level = await run_closed(client, questions, concurrency, args)
+                rows.append((name, layout, torch_threads, concurrency, level))
+    finally:
+        server.terminate()
+        server.wait()
+    return rows
+
+
+async def run(args):
+    questions = load_questions(args.dataset, 200)
+    topology = plan_topology()
+    print(f"CPU limit {topology.cpu_limit:g}, {topology.host_cpus} host CPUs; auto layout: {topology.summary()}")
+    print(f"{'simulated, cpu fraction ' + str(args.sim_cpu_fraction) if not args.model_path else args.model_path}, "
+          f"{args.max_tokens} max tokens, {args.duration:g}s per level")
+
+    print(f"\n{'layout':>14} | {'WxExT':>7} | {'torch':>6} | {'conc':>4} | {'req/s':>6} | {'p50':>8} | {'p95':>8} | {'errors':>6}")
+    for name in args.layouts:
+        for name, layout, torch_threads, concurrency, level in await bench_layout(name, questions, args):
+            shape = f"{layout['WEB_WORKERS']}x{layout['INFERENCE_WORKERS']}x{layout['TORCH_THREADS']}"
+            threads = f"{torch_threads['intra_op']}+{torch_threads['interop']}" if torch_threads else "-"
+            latency = level["latency_ms"]
+            print(
+                f"{name:>14} | {shape:>7} | {threads:>6} | {concurrency:>4} | {level['throughput_rps']:6.2f} | "
+                f"{latency.get('p50', float('nan')):6.0f}ms | {latency.get('p95', float('nan')):6.0f}ms | "
+                f"{level['error_rate']:6.1%}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layouts", nargs="+", default=["auto", "torch-default", "1x1x1", "1x2x1", "2x1x1"])
+    parser.add_argument("--model-path", help="transformers model to serve (simulated backend when omitted)")
+    parser.add_argument("--sim-cpu-fraction", type=float, default=0.5)
+    parser.add_argument("--dataset", default=DEFAULT_DATASET)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per concurrency level")
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Load time and memory per worker for the weight loading modes:
+
+  copy        each worker runs from_pretrained to float16 (the default ChatService path)
+  mmap        each worker memory-maps the safetensors shards (WEIGHTS_MMAP=true)
+  fork        parent runs from_pretrained, then forks the workers (python -m src.server)
+  mmap+fork   parent memory-maps, then forks
+
+Every worker runs one forward pass (touching every weight), then reports its RSS and
+PSS. PSS splits shared pages between the processes mapping them, so the PSS sum is
+the memory the workers really cost together. A random Llama checkpoint is generated
+unless --model-path is given.
+
+    python -m benchmarks.bench_weight_sharing [--workers 3] [--hidden-size 1024 --layers 8]
+"""
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+import time
+
+import psutil
+import torch
+from transformers import AutoModelForCausalLM, LlamaConfig, LlamaForCausalLM
+
+from src.utils.mmap_weights import load_mmap_model
+
+
+def make_checkpoint(path: str, hidden_size: int, layers: int):
+    config = LlamaConfig(
+        vocab_size=32000,
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 11 // 4,
+        num_hidden_layers=layers,
+        num_attention_heads=max(1, hidden_size // 64),
+        num_key_value_heads=max(1, hidden_size // 256),
+    )
+    # bf16 on disk like the TinyLlama release, so the default path (float16) has to convert
+    LlamaForCausalLM(config).to(torch.bfloat16).save_pretrained(path, safe_serialization=True)
+
+
+def load(model_path: str, mmap: bool):
+    if mmap:
+        return load_mmap_model(model_path)[0]
+    return AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float16, low_cpu_mem_usage=True).eval()
+
+
+def memory_mb():
+    info = psutil.Process().memory_full_info()
+    return info.rss / 1024 / 1024, info.pss / 1024 / 1024
+
+
+def run_worker(model, model_path, mmap, results, release):
+    start = time.perf_counter()
+    if model is None:
+        model = load(model_path, mmap)
+    load_time = time.perf_counter() - start
+    with torch.inference_mode():
+        model(torch.tensor([[1, 2, 3, 4]]))
+    results.put((os.getpid(), load_time) + memory_mb())
+    release.wait()
+
+
+def _spawned_worker(model_path, mmap, results, release):
+    torch.set_num_threads(1)
+    run_worker(None, model_path, mmap, results, release)
+
+
+def bench(mode: str, model_path: str, workers: int):
+    mmap = mode.startswith("mmap")
+    ctx = mp.get_context("fork" if mode.endswith("fork") else "spawn")
+    results, release = ctx.Queue(), ctx.Event()
+
+    processes, parent_load = [], 0.0
+    if mode.endswith("fork"):
+        torch.set_num_threads(1)
+        start = time.perf_counter()
+        model = load(model_path, mmap)
+        parent_load = time.perf_counter() - start
+        target, args = run_worker, (model, model_path, mmap, results, release)
+    else:
+        target, args = _spawned_worker, (model_path, mmap, results, release)
+
+    for _ in range(workers):
+        p = ctx.Process(target=target, args=args)
+        p.start()
+        processes.append(p)
+
+    rows = [results.get() for _ in range(workers)]
+    release.set()
+    for p in processes:
+        p.join()
+    if mode.endswith("fork"):
+        del model
+
+    load_times = [r[1] + parent_load for r in rows]
+    print(
+        f"{mode:>10} | load {max(load_times):6.2f}s | RSS/worker {sum(r[2] for r in rows) / workers:8.1f}MB | "
+        f"PSS/worker {sum(r[3] for r in rows) / workers:8.1f}MB | PSS total {sum(r[3] for r in rows):8.1f}MB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-path")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--hidden-size", type=int, default=1024)
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--modes", nargs="+", default=["copy", "mmap", "fork", "mmap+fork"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model_path
+        if model_path is None:
+            model_path = tmp
+            make_checkpoint(model_path, args.hidden_size, args.layers)
+        size_mb = sum(
+            os.path.getsize(os.path.join(model_path, f)) for f in os.listdir(model_path) if f.endswith(".safetensors")
+        ) / 1024 / 1024
+        print(f"checkpoint {size_mb:.0f}MB, {args.workers} workers")
+
+        for mode in args.modes:
+            bench(mode, model_path, args.workers)
+
+
+if __name__ == "__main__":
+    main()
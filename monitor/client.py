@@ -1,18 +1,250 @@
-from time import sleep
-import requests
+"""
+Open-loop load generator for the chat service.
+
+Questions from ALQAC.csv (or any JSONL file with a "message"/"question" field) are sent
+to /generate or /generate/stream with Poisson arrivals at a target rate. Arrivals never
+wait for earlier responses; each concurrency level caps the requests in flight, and latency
+is measured from the scheduled arrival, so time spent queued behind the cap counts
+(no coordinated omission). Each (rps, concurrency) level reports p50/p95/p99 latency,
+throughput, error rate and, when streaming, time to first token, and the whole sweep is
+written as a JSON report that can be diffed between releases.
+
+    # against a running service
+    python -m monitor.client --url http://localhost:8000 --rps 2 4 --concurrency 1 4 16 --duration 30
+
+    # in-process against the FastAPI app on the simulated backend (no weights, no network)
+    python -m monitor.client --in-process --stream --rps 20 --concurrency 4 16 --sim-cpu-fraction 0.5
+
+In-process, httpx's ASGITransport buffers the streamed body, so TTFT equals the full latency there.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+import httpx
+import numpy as np
 from loguru import logger
 
-def predict():
-    logger.info("Sending GET requests!")
-    response = requests.get(
-        "http://localhost:8000/",
-        headers={
-            "accept": "application/json",
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ALQAC.csv")
+
+
+@dataclass
+class Result:
+    ok: bool
+    latency: float
+    ttft: Optional[float] = None
+    status: int = 0
+
+
+def load_questions(path: str, limit: Optional[int] = None) -> List[str]:
+    """Questions from a CSV with a `question` column or a JSONL file"""
+    questions = []
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                text = row.get("message") or row.get("question") or row.get("title")
+                if text:
+                    questions.append(text[:1000])
+    else:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            questions = [row["question"] for row in csv.DictReader(f) if row.get("question")]
+
+    if not questions:
+        raise ValueError(f"No questions found in {path}")
+    return questions[:limit] if limit else questions
+
+
+def in_process_client(args) -> httpx.AsyncClient:
+    from src.backends import SimulatedBackend
+    from src.chat_service import chatService
+    from src.main import app
+
+    # Deterministic model costs, so runs are comparable across machines and revisions
+    chatService.use_backend(SimulatedBackend(
+        prefill_ms=args.sim_prefill_ms,
+        token_ms=args.sim_token_ms,
+        prefill_ms_per_token=args.sim_prefill_ms_per_token,
+        cpu_fraction=args.sim_cpu_fraction,
+    ))
+    chatService.preload()
+    chatService.ready = True
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://chat-service", timeout=args.timeout)
+
+
+def in_process_backend() -> dict:
+    from src.chat_service import chatService
+    return chatService.backend.describe()
+
+
+async def send(client: httpx.AsyncClient, question: str, args, scheduled: float) -> Result:
+    payload = {"message": question, "max_tokens": args.max_tokens}
+    try:
+        if not args.stream:
+            response = await client.post("/generate", json=payload)
+            return Result(response.status_code == 200, time.perf_counter() - scheduled, status=response.status_code)
+
+        ttft = None
+        ok = False
+        async with client.stream("POST", "/generate/stream", json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return Result(False, time.perf_counter() - scheduled, status=response.status_code)
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if ttft is None and chunk.get("token"):
+                    ttft = time.perf_counter() - scheduled
+                if chunk.get("done"):
+                    ok = not chunk.get("error")
+        return Result(ok, time.perf_counter() - scheduled, ttft, response.status_code)
+    except (httpx.HTTPError, ValueError) as e:
+        logger.debug(f"Request failed: {e}")
+        return Result(False, time.perf_counter() - scheduled)
+
+
+async def run_level(client: httpx.AsyncClient, questions: List[str], rps: float, concurrency: int, args) -> dict:
+    """Open-loop run: Poisson arrivals at `rps` for `duration` seconds, at most `concurrency` in flight"""
+    rng = random.Random(args.seed)
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def one(question: str, scheduled: float) -> Result:
+        async with limiter:
+            return await send(client, question, args, scheduled)
+
+    tasks = []
+    start = time.perf_counter()
+    next_arrival = start
+    while next_arrival - start < args.duration:
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(rng.choice(questions), next_arrival)))
+        next_arrival += rng.expovariate(rps)
+
+    results: List[Result] = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r.ok]
+    statuses = {}
+    for r in results:
+        statuses[str(r.status)] = statuses.get(str(r.status), 0) + 1
+
+    level = {
+        "target_rps": rps,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "succeeded": len(ok),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "throughput_rps": round(len(ok) / elapsed, 3),
+        "elapsed_s": round(elapsed, 3),
+        "status_codes": statuses,
+        "latency_ms": percentiles([r.latency for r in ok]),
+    }
+    if args.stream:
+        level["ttft_ms"] = percentiles([r.ttft for r in ok if r.ttft is not None])
+    return level
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {}
+    ms = np.asarray(values) * 1000
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 2),
+        "p95": round(float(np.percentile(ms, 95)), 2),
+        "p99": round(float(np.percentile(ms, 99)), 2),
+        "mean": round(float(ms.mean()), 2),
+        "max": round(float(ms.max()), 2),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    questions = load_questions(args.dataset, args.limit)
+    max_concurrency = max(args.concurrency)
+
+    if args.in_process:
+        client = in_process_client(args)
+    else:
+        client = httpx.AsyncClient(
+            base_url=args.url,
+            timeout=args.timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+
+    report = {
+        "meta": {
+            "target": "in-process" if args.in_process else args.url,
+            "backend": in_process_backend() if args.in_process else None,
+            "endpoint": "/generate/stream" if args.stream else "/generate",
+            "dataset": os.path.basename(args.dataset),
+            "questions": len(questions),
+            "max_tokens": args.max_tokens,
+            "duration_s": args.duration,
+            "seed": args.seed,
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
         },
-    )
-    print(response.json())
+        "levels": [],
+    }
+
+    async with client:
+        for rps in args.rps:
+            for concurrency in args.concurrency:
+                level = await run_level(client, questions, rps, concurrency, args)
+                report["levels"].append(level)
+                logger.info(
+                    f"rps={rps} concurrency={concurrency}: {level['throughput_rps']} req/s, "
+                    f"p50={level['latency_ms'].get('p50')}ms p99={level['latency_ms'].get('p99')}ms, "
+                    f"errors={level['error_rate']:.1%}"
+                )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--in-process", action="store_true", help="Drive the FastAPI app in-process on the simulated backend")
+    parser.add_argument("--stream", action="store_true", help="Use /generate/stream and record time to first token")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="ALQAC-style CSV or JSONL with questions")
+    parser.add_argument("--limit", type=int, help="Only use the first N questions")
+    parser.add_argument("--rps", type=float, nargs="+", default=[1.0], help="Target arrival rates to sweep")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="In-flight caps to sweep")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of arrivals per level")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sim-prefill-ms", type=float, default=50.0)
+    parser.add_argument("--sim-prefill-ms-per-token", type=float, default=0.2)
+    parser.add_argument("--sim-token-ms", type=float, default=5.0)
+    parser.add_argument("--sim-cpu-fraction", type=float, default=0.0, help="Share of simulated model time spent busy on a CPU core")
+    parser.add_argument("--output", default="loadtest_report.json")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    logger.info(f"Report written to {args.output}")
+
 
 if __name__ == "__main__":
-    while True:
-        predict()
-        sleep(0.5)
\ No newline at end of file
+    main()
@@ -1,10 +1,16 @@
 """
 Custom Prometheus metrics for the FastAPI application
+
+With PROMETHEUS_MULTIPROC_DIR set (see src.utils.prometheus_multiproc) every worker process
+writes its values to mmap files and /metrics aggregates them; `multiprocess_mode` says how
+each gauge combines across the live workers. Info metrics are not exported in that mode.
 """
 from prometheus_client import Counter, Histogram, Gauge, Info
+from functools import lru_cache
+import os
 import psutil
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 # Request metrics
 chat_requests_total = Counter(
@@ -33,9 +39,141 @@ model_inference_duration = Histogram(
     buckets=[0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0]
 )
 
+time_to_first_token = Histogram(
+    'time_to_first_token_seconds',
+    'Time from request start to the first streamed token',
+    buckets=[0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0]
+)
+
+inter_token_latency = Histogram(
+    'inter_token_latency_seconds',
+    'Time between consecutive streamed tokens',
+    buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+)
+
+# Per-request stage timings: queue, retrieval, template, tokenize, prefill, decode, detokenize, serialize
+request_stage_duration = Histogram(
+    'request_stage_duration_seconds',
+    'Time one generation request spends in each stage',
+    ['endpoint', 'stage'],
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+)
+
+generation_tokens_per_second = Histogram(
+    'generation_tokens_per_second',
+    'Generated tokens per second of prefill plus decode, per request',
+    ['endpoint'],
+    buckets=[1, 2, 5, 10, 20, 50, 100, 200, 500]
+)
+
 model_loaded = Gauge(
     'model_loaded',
-    'Whether the model is currently loaded (1) or not (0)'
+    'Whether the model is currently loaded (1) or not (0)',
+    multiprocess_mode='livemin'
+)
+
+# Batching metrics
+inference_batch_size = Histogram(
+    'inference_batch_size',
+    'Number of requests served by one batched generate call',
+    buckets=[1, 2, 4, 8, 16, 32, 64]
+)
+
+inference_queue_wait = Histogram(
+    'inference_queue_wait_seconds',
+    'Time a request waits in the batching queue before its batch starts',
+    buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0, 5.0]
+)
+
+# Admission control metrics (autoscaling signals)
+admission_inflight_requests = Gauge(
+    'admission_inflight_requests',
+    'Generation requests admitted and not yet finished (queued or running)',
+    multiprocess_mode='livesum'
+)
+
+admission_inflight_tokens = Gauge(
+    'admission_inflight_tokens',
+    'Estimated tokens (prompt + max_tokens) of admitted, unfinished requests',
+    multiprocess_mode='livesum'
+)
+
+admission_saturation = Gauge(
+    'admission_saturation',
+    'In-flight token estimate divided by the admission budget',
+    multiprocess_mode='livemax'
+)
+
+admission_rejections_total = Counter(
+    'admission_rejections_total',
+    'Requests rejected with 429 by admission control, by priority class',
+    ['priority']
+)
+
+generations_cancelled_total = Counter(
+    'generations_cancelled_total',
+    'Generations abandoned before completion, by reason (deadline, disconnect)',
+    ['reason']
+)
+
+# Hot model swap metrics
+model_swaps_total = Counter(
+    'model_swaps_total',
+    'Hot model swaps through /model/load, by result (swapped, failed)',
+    ['result']
+)
+
+model_swap_phase_duration = Histogram(
+    'model_swap_phase_duration_seconds',
+    'Time spent in each phase of a hot model swap (download, load, warmup, drain)',
+    ['phase'],
+    buckets=[0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0]
+)
+
+# A gauge rather than an Info so it survives multiprocess mode; same series as Info('model_version')
+model_version_info = Gauge(
+    'model_version_info',
+    'Version of the model answering new requests (1 for the current version)',
+    ['version'],
+    multiprocess_mode='livemax'
+)
+_model_version: Optional[str] = None
+
+# Response cache metrics
+response_cache_lookups_total = Counter(
+    'response_cache_lookups_total',
+    'Response cache lookups by result (hit, miss, coalesced into an in-flight generation)',
+    ['result']
+)
+
+response_cache_evictions_total = Counter(
+    'response_cache_evictions_total',
+    'Response cache entries removed, by reason (capacity, expired)',
+    ['reason']
+)
+
+response_cache_entries = Gauge(
+    'response_cache_entries',
+    'Number of responses currently cached',
+    multiprocess_mode='livesum'
+)
+
+response_cache_bytes = Gauge(
+    'response_cache_bytes',
+    'Approximate memory held by cached responses',
+    multiprocess_mode='livesum'
+)
+
+semantic_cache_lookups_total = Counter(
+    'semantic_cache_lookups_total',
+    'Semantic (near-duplicate) cache lookups by result (hit, miss)',
+    ['result']
+)
+
+semantic_cache_entries = Gauge(
+    'semantic_cache_entries',
+    'Number of question embeddings held by the semantic cache',
+    multiprocess_mode='livesum'
 )
 
 # Token metrics
@@ -53,12 +191,14 @@ tokens_per_request = Histogram(
 # System metrics
 memory_usage_bytes = Gauge(
     'memory_usage_bytes',
-    'Current memory usage in bytes'
+    'Current memory usage in bytes',
+    multiprocess_mode='liveall'
 )
 
 cpu_usage_percent = Gauge(
     'cpu_usage_percent',
-    'Current CPU usage percentage'
+    'Current CPU usage percentage',
+    multiprocess_mode='liveall'
 )
 
 # Error metrics
@@ -81,24 +221,40 @@ app_info = Info('app_info', 'Application information')
 # MLflow metrics
 mlflow_experiments_total = Gauge(
     'mlflow_experiments_total',
-    'Total number of MLflow experiments'
+    'Total number of MLflow experiments',
+    multiprocess_mode='livemax'
 )
 
 mlflow_runs_total = Gauge(
     'mlflow_runs_total',
-    'Total number of MLflow runs'
+    'Total number of MLflow runs',
+    multiprocess_mode='livemax'
 )
 
 # Connection metrics
 active_connections = Gauge(
     'active_connections',
-    'Number of active connections'
+    'Number of active connections',
+    multiprocess_mode='livesum'
 )
 
 # Custom business metrics
 chat_sessions_active = Gauge(
     'chat_sessions_active',
-    'Number of active chat sessions'
+    'Number of active chat sessions',
+    multiprocess_mode='livesum'
+)
+
+chat_session_store_bytes = Gauge(
+    'chat_session_store_bytes',
+    'Approximate bytes held by the chat session store',
+    multiprocess_mode='livesum'
+)
+
+chat_session_evictions_total = Counter(
+    'chat_session_evictions_total',
+    'Chat sessions evicted from the store, by reason (idle, memory)',
+    ['reason']
 )
 
 chat_response_quality = Histogram(
@@ -107,20 +263,40 @@ chat_response_quality = Histogram(
     buckets=[0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
 )
 
-def update_system_metrics():
-    """Update system resource metrics"""
+# Last sample of update_system_metrics, read by probes instead of asking psutil again
+_process: Optional[psutil.Process] = None
+_system_sample: Dict[str, Any] = {}
+
+def update_system_metrics() -> Dict[str, Any]:
+    """Sample this process's memory and CPU into the gauges and the cached sample"""
+    global _process, _system_sample
     try:
+        # cpu_percent is the usage since the previous call on the same Process object,
+        # so keep one per process (a forked worker gets its own)
+        if _process is None or _process.pid != os.getpid():
+            _process = psutil.Process()
+            _process.cpu_percent()
+
         # Memory usage
-        process = psutil.Process()
-        memory_info = process.memory_info()
+        memory_info = _process.memory_info()
         memory_usage_bytes.set(memory_info.rss)
-        
+
         # CPU usage
-        cpu_percent = process.cpu_percent()
+        cpu_percent = _process.cpu_percent()
         cpu_usage_percent.set(cpu_percent)
-        
+
+        _system_sample = {
+            'memory_bytes': memory_info.rss,
+            'cpu_percent': cpu_percent,
+            'sampled_at': time.time(),
+        }
     except Exception as e:
         print(f"Error updating system metrics: {e}")
+    return _system_sample
+
+def system_metrics() -> Dict[str, Any]:
+    """Last system sample (empty before the first update_system_metrics)"""
+    return _system_sample
 
 def record_chat_request(method: str, endpoint: str, status_code: int, duration: float):
     """Record chat request metrics"""
@@ -134,10 +310,106 @@ def record_model_inference(duration: float, tokens_generated: int = 0):
         tokens_generated_total.inc(tokens_generated)
         tokens_per_request.observe(tokens_generated)
 
+@lru_cache(maxsize=None)
+def _stage_histogram(endpoint: str, stage: str):
+    # Resolving a labelled child takes a lock and a dict lookup; do it once per label pair
+    return request_stage_duration.labels(endpoint=endpoint, stage=stage)
+
+@lru_cache(maxsize=None)
+def _tokens_per_second_histogram(endpoint: str):
+    return generation_tokens_per_second.labels(endpoint=endpoint)
+
+def record_stage_timings(endpoint: str, stages: Dict[str, float], tokens_generated: int = 0):
+    """Record the stage breakdown of one request, plus inference time and tokens/sec when it generated"""
+    for stage, duration in stages.items():
+        _stage_histogram(endpoint, stage).observe(duration)
+
+    generation = stages.get("prefill", 0.0) + stages.get("decode", 0.0)
+    if generation > 0:
+        record_model_inference(generation, tokens_generated)
+        if tokens_generated > 0:
+            _tokens_per_second_histogram(endpoint).observe(tokens_generated / generation)
+
+def record_time_to_first_token(duration: float):
+    """Record time-to-first-token of a streamed generation"""
+    time_to_first_token.observe(duration)
+
+def record_inter_token_latency(duration: float):
+    """Record the gap between two streamed tokens"""
+    inter_token_latency.observe(duration)
+
+def record_batch(batch_size: int, queue_waits):
+    """Record the size of a dispatched batch and the queue wait of each request in it"""
+    inference_batch_size.observe(batch_size)
+    for wait in queue_waits:
+        inference_queue_wait.observe(wait)
+
+def set_admission_load(requests: int, tokens: int, saturation: float):
+    """Set the admission controller's in-flight load"""
+    admission_inflight_requests.set(requests)
+    admission_inflight_tokens.set(tokens)
+    admission_saturation.set(saturation)
+
+def record_admission_rejection(priority: str):
+    """Record a request rejected by admission control"""
+    admission_rejections_total.labels(priority=priority).inc()
+
+def record_generation_cancelled(reason: str):
+    """Record a generation stopped early because its deadline passed or its client left"""
+    generations_cancelled_total.labels(reason=reason).inc()
+
+def record_model_swap(result: str, phases: Dict[str, float]):
+    """Record a finished hot model swap and how long each of its phases took"""
+    model_swaps_total.labels(result=result).inc()
+    for phase, seconds in phases.items():
+        model_swap_phase_duration.labels(phase=phase).observe(seconds)
+
+def set_model_version(version: str):
+    """Set the version of the model answering new requests"""
+    global _model_version
+    if _model_version is not None and _model_version != version:
+        model_version_info.labels(version=_model_version).set(0)
+    model_version_info.labels(version=version).set(1)
+    _model_version = version
+
+def record_cache_lookup(result: str):
+    """Record a response cache lookup: hit, miss or coalesced"""
+    response_cache_lookups_total.labels(result=result).inc()
+
+def record_cache_eviction(reason: str):
+    """Record a response cache eviction"""
+    response_cache_evictions_total.labels(reason=reason).inc()
+
+def set_cache_size(entries: int, size_bytes: int):
+    """Set the current response cache size"""
+    response_cache_entries.set(entries)
+    response_cache_bytes.set(size_bytes)
+
+def record_semantic_cache_lookup(result: str):
+    """Record a semantic cache lookup: hit or miss"""
+    semantic_cache_lookups_total.labels(result=result).inc()
+
+def set_semantic_cache_size(entries: int):
+    """Set the current semantic cache size"""
+    semantic_cache_entries.set(entries)
+
 def record_error(error_type: str, endpoint: str):
     """Record error metrics"""
     errors_total.labels(error_type=error_type, endpoint=endpoint).inc()
 
+def record_model_load(duration: float):
+    """Record how long loading the model took"""
+    model_load_duration.observe(duration)
+
+def set_chat_sessions(active: int, size_bytes: int):
+    """Set the number of live chat sessions and the memory they hold"""
+    chat_sessions_active.set(active)
+    chat_session_store_bytes.set(size_bytes)
+
+def record_session_eviction(reason: str):
+    """Record a chat session dropped for being idle or for the store memory cap"""
+    chat_session_evictions_total.labels(reason=reason).inc()
+
 def set_model_status(loaded: bool):
     """Set model loading status"""
     model_loaded.set(1 if loaded else 0)
@@ -0,0 +1,130 @@
+import asyncio
+import math
+import time
+
+from .config import settings
+from monitor.metrics import record_admission_rejection, set_admission_load
+
+# Rough prompt size without running the tokenizer on the event loop
+PROMPT_CHARS_PER_TOKEN = 4
+
+
+class AdmissionRejected(Exception):
+    """Too much work in flight; retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """Budget held by one admitted request; release exactly once when its work is done"""
+
+    __slots__ = ("controller", "cost", "admitted_at", "released")
+
+    def __init__(self, controller: "AdmissionController", cost: int):
+        self.controller = controller
+        self.cost = cost
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    Token-budget admission in front of ChatService.
+
+    Each request costs its estimated prompt tokens (message and expected statute passages)
+    plus `max_tokens`. Normal requests are admitted while the in-flight total stays within
+    `max_inflight_tokens * (1 - priority_reserve)`;
+    priority (internal) requests may use the reserved remainder. A request arriving at an
+    idle server is always admitted, however large. Rejections carry a Retry-After derived
+    from the measured drain rate of the budget. Work that is already accepted (the later
+    micro-batches of a /generate/batch call) waits for budget with `admit_when_free` instead.
+    Everything runs on the event loop, so no lock.
+    """
+
+    def __init__(self, max_inflight_tokens: int, priority_reserve: float = 0.2, initial_tokens_per_second: float = 50.0):
+        self.max_inflight_tokens = max_inflight_tokens
+        self.priority_reserve = min(max(priority_reserve, 0.0), 1.0)
+        self.inflight_tokens = 0
+        self.inflight_requests = 0
+        # EWMA of budget tokens released per second, for Retry-After
+        self._drain_rate = initial_tokens_per_second
+        # Replaced on every release, waking whoever waits in admit_when_free
+        self._freed = asyncio.Event()
+        self._publish()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_inflight_tokens > 0
+
+    @staticmethod
+    def estimate_cost(message: str, max_tokens: int, grounding_tokens: int = 0) -> int:
+        return math.ceil(len(message) / PROMPT_CHARS_PER_TOKEN) + grounding_tokens + max_tokens
+
+    def _excess(self, cost: int, priority: bool) -> float:
+        """Tokens by which admitting `cost` now would overrun the limit of its class (<= 0 when it fits)"""
+        if not self.enabled or self.inflight_requests == 0:
+            return 0
+        limit = self.max_inflight_tokens if priority else self.max_inflight_tokens * (1 - self.priority_reserve)
+        return self.inflight_tokens + cost - limit
+
+    def admit(self, cost: int, priority: bool = False) -> AdmissionTicket:
+        """Reserve `cost` tokens of budget or raise AdmissionRejected"""
+        excess = self._excess(cost, priority)
+        if excess > 0:
+            record_admission_rejection("priority" if priority else "normal")
+            raise AdmissionRejected(min(60, max(1, math.ceil(excess / max(self._drain_rate, 1e-3)))))
+        return self._take(cost)
+
+    async def admit_when_free(self, cost: int, priority: bool = False) -> AdmissionTicket:
+        """Reserve `cost` tokens of budget, waiting for releases until it fits"""
+        while self._excess(cost, priority) > 0:
+            await self._freed.wait()
+        return self._take(cost)
+
+    def _take(self, cost: int) -> AdmissionTicket:
+        self.inflight_tokens += cost
+        self.inflight_requests += 1
+        self._publish()
+        return AdmissionTicket(self, cost)
+
+    def _release(self, ticket: AdmissionTicket):
+        self.inflight_tokens -= ticket.cost
+        self.inflight_requests -= 1
+        elapsed = time.monotonic() - ticket.admitted_at
+        if elapsed > 0:
+            # Requests run concurrently, so the budget drains at roughly cost/elapsed times the number in flight
+            rate = ticket.cost / elapsed * (self.inflight_requests + 1)
+            self._drain_rate = 0.8 * self._drain_rate + 0.2 * rate
+        self._publish()
+        self._freed.set()
+        self._freed = asyncio.Event()
+
+    def saturation(self) -> float:
+        if not self.enabled:
+            return 0.0
+        return self.inflight_tokens / self.max_inflight_tokens
+
+    def _publish(self):
+        set_admission_load(self.inflight_requests, self.inflight_tokens, self.saturation())
+
+    def stats(self) -> dict:
+        return {
+            "inflight_requests": self.inflight_requests,
+            "inflight_tokens": self.inflight_tokens,
+            "max_inflight_tokens": self.max_inflight_tokens,
+            "saturation": round(self.saturation(), 3),
+            "drain_tokens_per_second": round(self._drain_rate, 1),
+        }
+
+
+admissionController = AdmissionController(
+    max_inflight_tokens=settings.admission_max_inflight_tokens,
+    priority_reserve=settings.admission_priority_reserve,
+)
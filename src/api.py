@@ -1,18 +1,112 @@
-from fastapi import APIRouter, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from loguru import logger
+from pydantic import ValidationError
+from starlette.background import BackgroundTask
+import asyncio
+from datetime import datetime
+import hmac
+import os
 import time
 from typing import Optional
 
 # Import models và services
-from .dto import ChatRequestDTO, ChatResponseDTO, ErrorResponseDTO
-from .chat_service import chatService
+from .dto import (
+    BatchChatItemDTO, BatchChatRequestDTO, BatchChatResponseDTO, ChatHistoryResponseDTO,
+    ChatRequestDTO, ChatResponseDTO, ChatStreamChunkDTO, ErrorResponseDTO, MessageDTO, ModelLoadRequestDTO
+)
+from .admission import AdmissionRejected, AdmissionTicket, admissionController
+from .chat_service import DEFAULT_MAX_TOKENS, DeadlineExceeded, SwapInProgress, chatService
+from .config import settings
+from .topology import serving_topology
+from .utils.tracing import RequestTrace, current_trace
+from monitor.metrics import system_metrics
 
 # Tạo router
 router = APIRouter()
 
+# How often a non-streaming request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.25
+# nginx's "client closed request"; only ever seen in logs and metrics
+CLIENT_CLOSED_REQUEST = 499
+
+class ClientDisconnected(Exception):
+    pass
+
+async def ensure_model_ready():
+    """Reject with 503 until the model is loaded and warm; restart a failed startup load"""
+    if not chatService.is_ready():
+        logger.warning("Model not ready, rejecting request")
+        chatService.start_background()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI model is not available. Please try again later.",
+            headers={"Retry-After": "5"}
+        )
+
+def is_internal(http_request: Request) -> bool:
+    """Priority class: callers presenting the configured X-Internal-Token"""
+    token = http_request.headers.get("x-internal-token")
+    return bool(settings.internal_api_token and token) and hmac.compare_digest(token, settings.internal_api_token)
+
+def admission_cost(items) -> int:
+    """Estimated budget of (message, max_tokens) pairs, with the passages grounding adds to each"""
+    grounding = chatService.grounding_cost()
+    return sum(
+        admissionController.estimate_cost(message, max_tokens or DEFAULT_MAX_TOKENS, grounding) for message, max_tokens in items
+    )
+
+def admit(http_request: Request, items) -> AdmissionTicket:
+    """Reserve admission budget for (message, max_tokens) pairs, or reject with 429 and Retry-After"""
+    cost = admission_cost(items)
+    try:
+        return admissionController.admit(cost, priority=is_internal(http_request))
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected {http_request.url.path} costing {cost} tokens: {admissionController.stats()}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Server is busy. Please retry later.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+async def cancel_on_disconnect(http_request: Request, awaitable):
+    """Await `awaitable`, cancelling it (and so its generation) if the client disconnects first"""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                logger.info(f"Client left {http_request.url.path}, cancelling its generation")
+                raise ClientDisconnected()
+    finally:
+        task.cancel()
+
+def check_adapter(adapter: Optional[str]):
+    """400 for a LoRA adapter that is not registered, before the request takes any budget"""
+    if adapter is not None and adapter not in chatService.adapters():
+        available = ", ".join(chatService.adapters()) or "none"
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown adapter {adapter!r}. Available adapters: {available}."
+        )
+
+def release_all(*holds):
+    """Callable releasing admission tickets and model leases, for the background task of a streamed response"""
+    def release():
+        for hold in holds:
+            hold.release()
+    return release
+
+def deadline_exceeded() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        detail="Response not ready before the request deadline."
+    )
+
 @router.post("/generate", response_model=ChatResponseDTO, status_code=status.HTTP_200_OK)
-async def generate_chat_response(request: ChatRequestDTO):
+async def generate_chat_response(request: ChatRequestDTO, http_request: Request):
     """
     Generate AI response for user message
     """
@@ -20,40 +114,54 @@ async def generate_chat_response(request: ChatRequestDTO):
         start_time = time.time()
 
         # Validate model is loaded
-        if not chatService.is_model_loaded():
-            logger.warning("Model not loaded, attempting to load...")
-            try:
-                await chatService.load_model()
-            except Exception as e:
-                logger.error(f"Failed to load model: {e}")
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail="AI model is not available. Please try again later."
-                )
+        await ensure_model_ready()
+        check_adapter(request.adapter)
+        ticket = admit(http_request, [(request.message, request.max_tokens)])
+        lease = chatService.lease()
 
         # Generate response using the service
         try:
-            ai_response = chatService.generate_response(
+            ai_response = await cancel_on_disconnect(http_request, chatService.agenerate(
                 user_input=request.message,
                 max_tokens=request.max_tokens,
-            )
+                deadline_ms=request.deadline_ms,
+                adapter=request.adapter,
+                lease=lease,
+                session_id=request.session_id,
+            ))
 
+        except ClientDisconnected:
+            return Response(status_code=CLIENT_CLOSED_REQUEST)
+        except DeadlineExceeded:
+            logger.warning(f"Deadline exceeded generating {request.max_tokens} tokens")
+            raise deadline_exceeded()
         except Exception as e:
             logger.error(f"Error generating AI response: {e}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Failed to generate response. Please try again."
             )
+        finally:
+            ticket.release()
+            lease.release()
 
         response_time = time.time() - start_time
 
-        # Return response (không save database)
-        return ChatResponseDTO(
+        # Return response (không save database); serialized here so the stage is timed
+        serialize_start = time.perf_counter()
+        body = ChatResponseDTO(
             response=ai_response,
             response_time=response_time,
-            model_used="custom-llama",
+            model_used=lease.version,
+            session_id=request.session_id,
             timestamp=time.time()
-        )
+        ).model_dump_json()
+
+        trace = current_trace()
+        if trace is not None:
+            trace.add("serialize", time.perf_counter() - serialize_start)
+            trace.finish("/generate")
+        return Response(content=body, media_type="application/json")
 
     except HTTPException:
         raise
@@ -64,77 +172,303 @@ async def generate_chat_response(request: ChatRequestDTO):
             detail="An unexpected error occurred. Please try again."
         )
 
-@router.get("/health")
-async def health_check():
+@router.post("/generate/stream")
+async def stream_chat_response(request: ChatRequestDTO, http_request: Request):
+    """
+    Stream the AI response as NDJSON: one {"token": ...} line per chunk, then a final {"done": true} line
+    """
+    await ensure_model_ready()
+    check_adapter(request.adapter)
+    ticket = admit(http_request, [(request.message, request.max_tokens)])
+    lease = chatService.lease()
+    start_time = time.time()
+    trace = current_trace()
+
+    async def ndjson_lines():
+        serialize = 0.0
+        try:
+            async for token in chatService.astream(
+                user_input=request.message,
+                max_tokens=request.max_tokens,
+                deadline_ms=request.deadline_ms,
+                adapter=request.adapter,
+                lease=lease,
+                session_id=request.session_id,
+            ):
+                serialize_start = time.perf_counter()
+                line = ChatStreamChunkDTO(token=token).model_dump_json(exclude_none=True) + "\n"
+                serialize += time.perf_counter() - serialize_start
+                yield line
+        except DeadlineExceeded:
+            logger.warning(f"Deadline exceeded streaming {request.max_tokens} tokens")
+            yield ChatStreamChunkDTO(done=True, error="Response not ready before the request deadline.").model_dump_json(exclude_none=True) + "\n"
+            return
+        except Exception as e:
+            logger.error(f"Error streaming AI response: {e}")
+            yield ChatStreamChunkDTO(done=True, error="Failed to generate response. Please try again.").model_dump_json(exclude_none=True) + "\n"
+            return
+        finally:
+            ticket.release()
+            lease.release()
+
+        yield ChatStreamChunkDTO(
+            done=True,
+            response_time=time.time() - start_time,
+            model_used=lease.version,
+            session_id=request.session_id
+        ).model_dump_json(exclude_none=True) + "\n"
+
+        if trace is not None:
+            trace.add("serialize", serialize)
+            trace.finish("/generate/stream")
+
+    # The background task also releases the budget and the model when the body was never iterated
+    return StreamingResponse(
+        ndjson_lines(), media_type="application/x-ndjson", background=BackgroundTask(release_all(ticket, lease))
+    )
+
+async def _batch_item_result(index: int, task: asyncio.Task, trace: Optional[RequestTrace]) -> BatchChatItemDTO:
+    try:
+        response = await task
+    except asyncio.CancelledError:
+        raise
+    except DeadlineExceeded:
+        return BatchChatItemDTO(index=index, error="Response not ready before the request deadline.")
+    except Exception as e:
+        logger.error(f"Error generating batch item {index}: {e}")
+        return BatchChatItemDTO(index=index, error="Failed to generate response. Please try again.")
+    if trace is not None:
+        trace.finish("/generate/batch")
+    return BatchChatItemDTO(index=index, response=response)
+
+def _batch_chunks(items: list) -> list:
+    """Positions of `items` split into micro-batches of similar length, shortest first"""
+    order = sorted(range(len(items)), key=lambda i: len(items[i]["user_input"]))
+    size = max(1, settings.batch_max_size)
+    return [order[start:start + size] for start in range(0, len(order), size)]
+
+def _chunk_cost(items: list, chunk: list) -> list:
+    return [(items[i]["user_input"], items[i]["max_tokens"]) for i in chunk]
+
+async def _batch_results(
+    http_request: Request, items: list, indices: list, chunks: list, ticket: AdmissionTicket, lease,
+    trace: Optional[RequestTrace]
+):
     """
-    Health check endpoint
+    Results of a batch in completion order, generated one micro-batch at a time. Each chunk
+    holds its own admission ticket; the first is admitted by the caller (429 before anything
+    runs), later ones wait for budget so a large batch never holds more than one micro-batch
+    of it and interactive requests keep getting admitted in between. Each item is traced on
+    its own (`<trace id>/<index>`) and finished as one /generate/batch generation.
+    """
+    priority = is_internal(http_request)
+    for number, chunk in enumerate(chunks):
+        if number > 0:
+            try:
+                ticket = await asyncio.wait_for(
+                    admissionController.admit_when_free(admission_cost(_chunk_cost(items, chunk)), priority),
+                    settings.request_deadline_ms / 1000 if settings.request_deadline_ms else None
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"Batch chunk of {len(chunk)} items not admitted in time: {admissionController.stats()}")
+                for i in chunk:
+                    yield BatchChatItemDTO(index=indices[i], error="Server is busy. Please retry later.")
+                continue
+        traces = [trace.child(indices[i]) if trace is not None else None for i in chunk]
+        tasks = chatService.agenerate_many([items[i] for i in chunk], lease, traces)
+        pending = [
+            asyncio.ensure_future(_batch_item_result(indices[i], task, item_trace))
+            for i, task, item_trace in zip(chunk, tasks, traces)
+        ]
+        try:
+            for next_item in asyncio.as_completed(pending):
+                yield await next_item
+        finally:
+            # Cancelled or client went away: drop the generations nobody will read
+            for task in tasks + pending:
+                task.cancel()
+            ticket.release()
+
+@router.post("/generate/batch", response_model=BatchChatResponseDTO)
+async def generate_batch_responses(request: BatchChatRequestDTO, http_request: Request):
+    """
+    Answer many questions in one call. Items are validated one by one (an invalid item gets
+    an error, the rest still run) and generated as length-sorted micro-batches, each admitted
+    on its own; items whose micro-batch gets no budget before the request deadline fail with
+    a busy error. Results come back in input order, or with `stream` as NDJSON lines in
+    completion order followed by a final {"done": true} line.
+    """
+    await ensure_model_ready()
+    start_time = time.time()
+
+    results = [None] * len(request.items)
+    valid, indices = [], []
+    for index, item in enumerate(request.items):
+        try:
+            dto = ChatRequestDTO.model_validate(item)
+        except ValidationError as e:
+            results[index] = BatchChatItemDTO(index=index, error=f"Invalid item: {e.errors()[0]['msg']}")
+            continue
+        try:
+            check_adapter(dto.adapter)
+        except HTTPException as e:
+            results[index] = BatchChatItemDTO(index=index, error=e.detail)
+            continue
+        valid.append({
+            "user_input": dto.message, "max_tokens": dto.max_tokens, "deadline_ms": dto.deadline_ms,
+            "adapter": dto.adapter, "session_id": dto.session_id
+        })
+        indices.append(index)
+
+    # Only the first micro-batch can be rejected with 429; the rest wait for budget as it runs
+    chunks = _batch_chunks(valid)
+    ticket = admit(http_request, _chunk_cost(valid, chunks[0]) if chunks else [])
+    lease = chatService.lease()
+    trace = current_trace()
+
+    if not request.stream:
+        async def collect():
+            return [item async for item in _batch_results(http_request, valid, indices, chunks, ticket, lease, trace)]
+
+        try:
+            for item in await cancel_on_disconnect(http_request, collect()):
+                results[item.index] = item
+        except ClientDisconnected:
+            return Response(status_code=CLIENT_CLOSED_REQUEST)
+        finally:
+            ticket.release()
+            lease.release()
+        return BatchChatResponseDTO(results=results, response_time=time.time() - start_time, model_used=lease.version)
+
+    async def ndjson_lines():
+        # Generations start with the body, so a client gone before it is read leaves nothing running
+        generated = _batch_results(http_request, valid, indices, chunks, ticket, lease, trace)
+        try:
+            for item in results:
+                if item is not None:
+                    yield item.model_dump_json(exclude_none=True) + "\n"
+            async for item in generated:
+                yield item.model_dump_json(exclude_none=True) + "\n"
+            yield ChatStreamChunkDTO(
+                done=True,
+                response_time=time.time() - start_time,
+                model_used=lease.version
+            ).model_dump_json(exclude_none=True) + "\n"
+        finally:
+            await generated.aclose()
+            ticket.release()
+            lease.release()
+
+    # The background task also releases the budget and the model when the body was never iterated
+    return StreamingResponse(
+        ndjson_lines(), media_type="application/x-ndjson", background=BackgroundTask(release_all(ticket, lease))
+    )
+
+@router.get("/sessions/{session_id}", response_model=ChatHistoryResponseDTO)
+async def get_session_history(session_id: str, limit: int = Query(default=50, ge=1, le=1000)):
+    """
+    Last `limit` messages of a chat session, oldest first
+    """
+    messages = chatService.get_chat_history(session_id, limit)
+    if messages is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found or expired.")
+    return ChatHistoryResponseDTO(
+        session_id=session_id,
+        messages=[
+            MessageDTO(role=m["role"], content=m["content"], timestamp=datetime.fromtimestamp(m["timestamp"]))
+            for m in messages
+        ]
+    )
+
+@router.delete("/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_session(session_id: str):
+    """
+    Forget a chat session
+    """
+    if not chatService.sessions.delete(session_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found or expired.")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@router.get("/ready")
+async def readiness_check():
+    """
+    Readiness endpoint: 503 until the model is loaded and warmed up
     """
     try:
-        import psutil
-        process = psutil.Process()
-        memory_info = process.memory_info()
-        memory_usage_mb = memory_info.rss / 1024 / 1024
-
-        return {
-            "status": "healthy",
-            "service": "chat-service",
-            "version": "1.0.0",
-            "model_loaded": chatService.is_model_loaded(),
-            "memory_usage_mb": round(memory_usage_mb, 2),
-        }
+        # Sampled in the background (SYSTEM_METRICS_INTERVAL_SECONDS), not per probe
+        memory_bytes = system_metrics().get("memory_bytes")
+        memory_usage_mb = round(memory_bytes / 1024 / 1024, 2) if memory_bytes is not None else None
+
+        ready = chatService.is_ready()
+        return JSONResponse(
+            status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={
+                "status": "ready" if ready else "warming_up",
+                "service": "chat-service",
+                "version": "1.0.0",
+                "model_loaded": chatService.is_model_loaded(),
+                "memory_usage_mb": memory_usage_mb,
+            }
+        )
     except Exception as e:
-        logger.error(f"Health check error: {e}")
-        return {
-            "status": "unhealthy",
-            "error": str(e),
-        }
-
-# @router.post("/model/load")
-# async def load_model(model_path: Optional[str] = None):
-#     """
-#     Load or reload the AI model
-#     """
-#     try:
-#         logger.info(f"Loading model from path: {model_path or settings.MODEL_PATH}")
-#         await chatService.load_model(model_path)
-
-#         return {
-#             "success": True,
-#             "message": "Model loaded successfully",
-#             "model_path": model_path or settings.MODEL_PATH,
-#         }
-
-#     except Exception as e:
-#         logger.error(f"Error loading model: {e}")
-#         raise HTTPException(
-#             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-#             detail=f"Failed to load model: {str(e)}"
-#         )
-
-# @router.get("/model/status")
-# async def get_model_status():
-#     """
-#     Get model status and information
-#     """
-#     try:
-#         import os
-#         model_path = settings.MODEL_PATH
-#         path_exists = os.path.exists(model_path)
-
-#         return {
-#             "model_loaded": chatService.is_model_loaded(),
-#             "model_path": model_path,
-#             "path_exists": path_exists,
-#             "absolute_path": os.path.abspath(model_path),
-#             "working_dir": os.getcwd(),
-#             "device": chatService.device if hasattr(chatService, 'device') else "unknown",
-#         }
-#     except Exception as e:
-#         logger.error(f"Error getting model status: {e}")
-#         return {
-#             "error": str(e),
-#             "timestamp": time.time()
-        # }
+        logger.error(f"Readiness check error: {e}")
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={
+                "status": "unhealthy",
+                "error": str(e),
+            }
+        )
+
+@router.post("/model/load", status_code=status.HTTP_202_ACCEPTED)
+async def load_model(request: ModelLoadRequestDTO, http_request: Request):
+    """
+    Hot-swap to another model version without downtime: download (registry S3 prefix) or
+    read (local path) it, load and warm it up in the background, then route new requests to
+    it while in-flight ones finish on the old model. Poll /model/status for progress.
+    Requires X-Internal-Token; disabled (403) while INTERNAL_API_TOKEN is unset.
+    """
+    if not settings.internal_api_token:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Model loading is disabled: INTERNAL_API_TOKEN is not set.")
+    if not is_internal(http_request):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Model loading needs X-Internal-Token.")
+    if request.model_path and request.s3_prefix:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Give either model_path or s3_prefix, not both.")
+    if request.model_path and not os.path.isdir(request.model_path):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Model path {request.model_path} does not exist.")
+
+    try:
+        swap = chatService.swap_model(model_path=request.model_path, s3_prefix=request.s3_prefix, version=request.version)
+    except SwapInProgress as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+    logger.info(f"Hot swap requested: {swap['previous_version']} -> {swap['version']} from {swap['source']}")
+    return {"success": True, "message": "Model swap started", "swap": swap}
+
+@router.get("/model/status")
+async def get_model_status():
+    """
+    Current model (version, source, requests in flight, backend details) and the last hot swap
+    """
+    return {
+        "model_loaded": chatService.is_model_loaded(),
+        "ready": chatService.is_ready(),
+        "model": chatService.model.describe(),
+        "swap": chatService.swap_status,
+    }
+
+@router.get("/topology")
+async def get_topology():
+    """
+    Serving layout of this worker: CPU limit, worker processes, inference threads and torch
+    threads planned from it, and the torch threads actually in use
+    """
+    return {
+        **serving_topology.describe(),
+        "pid": os.getpid(),
+        "executor_workers": chatService.max_workers,
+        "torch": serving_topology.torch_threads(),
+    }
 
 # Export router
 Router = router
@@ -0,0 +1,28 @@
+"""
+Inference backends behind ChatService, selected with INFERENCE_BACKEND:
+
+- transformers: the Hugging Face model at MODEL_PATH (default)
+- simulated: no weights; deterministic answers with configurable prefill/decode latency
+  and CPU burn (SIM_* settings), for load-testing queueing, batching and caching
+"""
+from ..config import settings
+from .base import DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE, DEFAULT_TOP_P, GenerationRequest, InferenceBackend, TextSink
+from .simulated import SimulatedBackend
+
+BACKENDS = ("transformers", "simulated")
+
+
+def create_backend(name: str, system_prompt: str) -> InferenceBackend:
+    """Backend `name` configured from settings; transformers is imported only when chosen"""
+    if name == "transformers":
+        from .transformers_backend import TransformersBackend
+        return TransformersBackend(system_prompt)
+    if name == "simulated":
+        return SimulatedBackend(
+            prefill_ms=settings.sim_prefill_ms,
+            token_ms=settings.sim_token_ms,
+            prefill_ms_per_token=settings.sim_prefill_ms_per_token,
+            batch_overhead=settings.sim_batch_overhead,
+            cpu_fraction=settings.sim_cpu_fraction,
+        )
+    raise ValueError(f"Unknown inference backend {name!r}, expected one of {', '.join(BACKENDS)}")
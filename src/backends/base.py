@@ -0,0 +1,149 @@
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence
+
+from ..utils.tracing import RequestTrace
+
+DEFAULT_MAX_TOKENS = 200
+DEFAULT_TEMPERATURE = 0.7
+DEFAULT_TOP_P = 0.9
+
+# Receives each decoded text chunk of a streamed generation, on the inference thread
+TextSink = Callable[[str], None]
+
+
+@dataclass
+class GenerationRequest:
+    """One prompt waiting to be generated"""
+    user_input: str
+    max_tokens: int = DEFAULT_MAX_TOKENS
+    temperature: float = DEFAULT_TEMPERATURE
+    top_p: float = DEFAULT_TOP_P
+    trace: Optional[RequestTrace] = field(default=None, compare=False)
+    submitted_at: float = 0.0
+    # perf_counter time after which the caller gives up; None waits forever
+    deadline: Optional[float] = None
+    # Set on the event loop when nobody waits for the result any more, read between decode steps
+    cancelled: bool = False
+    # user_input with retrieved statutes prepended, set by ChatService before generation
+    grounded_input: Optional[str] = None
+    # Registered LoRA adapter to generate with; None for the base model
+    adapter: Optional[str] = None
+    # Model the request was pinned to when it was made (ChatService's current one when None)
+    backend: Optional["InferenceBackend"] = field(default=None, compare=False, repr=False)
+    model_version: str = ""
+    # Session turns: token ids of each earlier exchange (oldest first), placed between the system
+    # prefix and this message; None outside a session
+    history: Optional[List[Sequence[int]]] = field(default=None, compare=False, repr=False)
+    # Set by the backend on session turns: user_input (never the grounded input) and its answer as
+    # ids to append to the history
+    exchange: Optional[List[int]] = field(default=None, compare=False, repr=False)
+
+    @property
+    def sampling_key(self):
+        return (self.temperature, self.top_p)
+
+    @property
+    def batch_key(self):
+        """Requests with equal keys can share one `generate` call"""
+        return (self.adapter or "", self.temperature, self.top_p)
+
+    @property
+    def model_input(self) -> str:
+        """User message as the model sees it"""
+        return self.grounded_input if self.grounded_input is not None else self.user_input
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline (None without one)"""
+        return None if self.deadline is None else self.deadline - time.perf_counter()
+
+    def record(self, stages: Dict[str, float], tokens: int = 0):
+        if self.trace is not None:
+            for stage, seconds in stages.items():
+                self.trace.add(stage, seconds)
+            self.trace.tokens += tokens
+
+
+def fit_history(history: Sequence[Sequence[int]], budget: int) -> List[int]:
+    """Ids of the newest exchanges whose total fits in `budget` tokens, in conversation order"""
+    kept, used = [], 0
+    for exchange in reversed(history):
+        if used + len(exchange) > budget:
+            break
+        kept.append(exchange)
+        used += len(exchange)
+    return [token for exchange in reversed(kept) for token in exchange]
+
+
+class InferenceBackend(ABC):
+    """
+    Model engine behind ChatService. ChatService owns scheduling, caching and retrieval;
+    a backend turns GenerationRequests into text. Everything except `is_loaded` and
+    `describe` blocks and runs off the event loop.
+
+    Backends record their stages (template, tokenize, prefill, decode, detokenize) and
+    generated token counts with `request.record`, and stop a request whose `cancelled`
+    flag is set at the next decode step. Backends that carry session history put
+    `request.history` (trimmed with `fit_history`) before the message and set
+    `request.exchange` once the answer is done.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def load(self, model_path: str, prepare: bool = True):
+        """Load weights and tokenizer; `prepare=False` skips running the model (preload before fork)"""
+
+    def prepare(self):
+        """Per-process setup that runs the model, after a `load(prepare=False)` and fork"""
+
+    def unload(self):
+        """Drop the weights and hand their memory back; the backend is unusable afterwards"""
+
+    @abstractmethod
+    def is_loaded(self) -> bool:
+        ...
+
+    @abstractmethod
+    def generate_batch(self, requests: List[GenerationRequest]) -> List[Optional[str]]:
+        """One response per request, in order (None for requests cancelled before they finished)"""
+
+    @abstractmethod
+    def stream(self, request: GenerationRequest, emit: TextSink):
+        """Generate one response, passing text chunks to `emit` as they are decoded"""
+
+    def load_adapter(self, name: str, path: str) -> dict:
+        """Register a LoRA adapter on top of the loaded base weights; returns its load stats"""
+        raise NotImplementedError(f"The {self.name} backend does not serve LoRA adapters")
+
+    def adapters(self) -> List[str]:
+        """Names of the registered LoRA adapters"""
+        return []
+
+    def context_window(self) -> int:
+        """Tokens a session prompt (history, message and answer) may span; 0 when sessions are unsupported"""
+        return 0
+
+    def encode_exchange(self, user_input: str, answer: str) -> List[int]:
+        """Token ids of a finished exchange as it sits in session history"""
+        raise NotImplementedError(f"The {self.name} backend does not keep session history")
+
+    def prompt_budget(self, max_new_tokens: int) -> Optional[int]:
+        """
+        Tokens a user message (grounding and session history included) may take so the
+        templated prompt and `max_new_tokens` answer tokens fit the model; None when unbounded
+        """
+        return None
+
+    def count_tokens(self, text: str) -> int:
+        """Tokens of `text` inside a prompt; needed when `prompt_budget` is not None"""
+        raise NotImplementedError(f"The {self.name} backend does not count tokens")
+
+    def truncate_tokens(self, text: str, max_tokens: int) -> str:
+        """Leading part of `text` that takes at most `max_tokens` tokens"""
+        raise NotImplementedError(f"The {self.name} backend does not count tokens")
+
+    def describe(self) -> dict:
+        """Static facts about the loaded model, for status endpoints and logs"""
+        return {"backend": self.name}
@@ -0,0 +1,182 @@
+import hashlib
+import random
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from .base import GenerationRequest, InferenceBackend, TextSink, fit_history
+
+# Output vocabulary; answers are drawn from it with a per-prompt seed
+VOCABULARY = (
+    "theo quy định của pháp luật người phạm tội bị xử phạt tù có thời hạn từ năm đến "
+    "năm trách nhiệm hình sự điều khoản bộ luật dân sự hợp đồng quyền nghĩa vụ cơ quan "
+    "nhà nước tòa án nhân dân bồi thường thiệt hại tài sản"
+).split()
+
+# Tokens a simulated session prompt may span, and the id space of its word "tokens"
+CONTEXT_WINDOW = 2048
+VOCAB_SIZE = 32000
+
+# hashlib releases the GIL on buffers over 2 KiB, so burning CPU with it contends for
+# cores like torch kernels do without freezing the event loop thread
+_BURN_BLOCK = b"\0" * (64 * 1024)
+
+
+def _spend(seconds: float, cpu_fraction: float):
+    """Take `seconds`: the first `cpu_fraction` of it busy on a core, the rest asleep"""
+    if seconds <= 0:
+        return
+    end = time.perf_counter() + seconds
+    burn_until = time.perf_counter() + seconds * cpu_fraction
+    while time.perf_counter() < burn_until:
+        hashlib.sha256(_BURN_BLOCK).digest()
+    remaining = end - time.perf_counter()
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+class SimulatedBackend(InferenceBackend):
+    """
+    Deterministic stand-in for the model, for load tests of the serving stack without weights.
+
+    Costs follow a CPU decoder: a batch pays `prefill_ms` plus `prefill_ms_per_token` per
+    prompt word, then `token_ms` per decode step, each scaled by `1 + batch_overhead * (rows - 1)`.
+    `cpu_fraction` of that time is spent busy on a core instead of sleeping, so thread and
+    worker counts matter as they do for the real model. Each answer's length and words are
+    seeded by its prompt, max_tokens and adapter, so identical requests get identical answers
+    and the same traffic always costs the same. Cancelled rows stop at the next step.
+    Adapters are only names here: registering one costs nothing. Tokens are words; session
+    history adds its (trimmed) length to the prompt and to the answer seed.
+    """
+
+    name = "simulated"
+
+    def __init__(
+        self,
+        prefill_ms: float = 50.0,
+        token_ms: float = 5.0,
+        prefill_ms_per_token: float = 0.2,
+        batch_overhead: float = 0.1,
+        cpu_fraction: float = 0.0,
+        seed: int = 0,
+    ):
+        self.prefill = prefill_ms / 1000
+        self.per_token = token_ms / 1000
+        self.prefill_per_token = prefill_ms_per_token / 1000
+        self.batch_overhead = batch_overhead
+        self.cpu_fraction = min(max(cpu_fraction, 0.0), 1.0)
+        self.seed = seed
+        self.loaded = False
+        self._adapters: Dict[str, str] = {}
+
+    def load(self, model_path: str, prepare: bool = True):
+        logger.info(
+            f"Simulated backend: prefill {self.prefill * 1000:.0f}ms + {self.prefill_per_token * 1000:.2f}ms/token, "
+            f"{self.per_token * 1000:.1f}ms/token decode, {self.cpu_fraction:.0%} CPU burn"
+        )
+        self.loaded = True
+
+    def unload(self):
+        self.loaded = False
+        self._adapters = {}
+
+    def load_adapter(self, name: str, path: str) -> dict:
+        self._adapters[name] = path
+        return {"path": path, "params_mb": 0.0, "rss_mb": 0.0, "load_s": 0.0}
+
+    def adapters(self) -> List[str]:
+        return list(self._adapters)
+
+    def is_loaded(self) -> bool:
+        return self.loaded
+
+    def context_window(self) -> int:
+        return CONTEXT_WINDOW
+
+    def encode_exchange(self, user_input: str, answer: str) -> List[int]:
+        return [zlib.crc32(word.encode()) % VOCAB_SIZE for word in f"{user_input} {answer}".split()]
+
+    def prompt_budget(self, max_new_tokens: int) -> Optional[int]:
+        return CONTEXT_WINDOW - max_new_tokens
+
+    def count_tokens(self, text: str) -> int:
+        return len(text.split())
+
+    def truncate_tokens(self, text: str, max_tokens: int) -> str:
+        words = text.split()
+        return text if len(words) <= max_tokens else " ".join(words[:max(max_tokens, 0)])
+
+    def _history_tokens(self, request: GenerationRequest) -> int:
+        if not request.history:
+            return 0
+        budget = CONTEXT_WINDOW - request.max_tokens - len(request.model_input.split())
+        return len(fit_history(request.history, budget))
+
+    def describe(self) -> dict:
+        return {
+            "backend": self.name,
+            "prefill_ms": self.prefill * 1000,
+            "token_ms": self.per_token * 1000,
+            "cpu_fraction": self.cpu_fraction,
+            "adapters": self.adapters(),
+        }
+
+    def _answer(self, request: GenerationRequest) -> List[str]:
+        """Deterministic answer tokens: between half and all of max_tokens, as if EOS came early"""
+        rng = random.Random(
+            f"{self.seed}:{request.adapter}:{self._history_tokens(request)}:{request.max_tokens}:{request.model_input}"
+        )
+        length = rng.randint(max(1, request.max_tokens // 2), request.max_tokens)
+        return [rng.choice(VOCABULARY) for _ in range(length)]
+
+    def _run(self, requests: List[GenerationRequest], emit: Optional[TextSink] = None) -> List[Optional[List[str]]]:
+        """Simulate one padded `generate` call; returns each row's tokens, None if it was cancelled"""
+        live = [not r.cancelled for r in requests]
+        if not any(live):
+            return [None] * len(requests)
+
+        start = time.perf_counter()
+        answers = [self._answer(r) for r in requests]
+        prompt_tokens = [len(r.model_input.split()) + self._history_tokens(r) for r in requests]
+        tokenized = time.perf_counter()
+
+        scale = 1 + self.batch_overhead * (len(requests) - 1)
+        _spend((self.prefill + self.prefill_per_token * sum(prompt_tokens)) * scale, self.cpu_fraction)
+        prefilled = time.perf_counter()
+
+        produced = [0] * len(requests)
+        step = 0
+        while any(live):
+            _spend(self.per_token * scale, self.cpu_fraction)
+            for row, request in enumerate(requests):
+                if not live[row]:
+                    continue
+                if request.cancelled:
+                    live[row] = False
+                    continue
+                if emit is not None:
+                    emit(answers[row][step] + " ")
+                produced[row] += 1
+                live[row] = produced[row] < len(answers[row])
+            step += 1
+
+        decoded = time.perf_counter()
+        stages: Dict[str, float] = {"tokenize": tokenized - start, "prefill": prefilled - tokenized, "decode": decoded - prefilled}
+        results: List[Optional[List[str]]] = []
+        for row, request in enumerate(requests):
+            if request.cancelled:
+                results.append(None)
+                continue
+            request.record(stages, produced[row])
+            if request.history is not None:
+                request.exchange = self.encode_exchange(request.user_input, " ".join(answers[row][:produced[row]]))
+            results.append(answers[row])
+        return results
+
+    def generate_batch(self, requests: List[GenerationRequest]) -> List[Optional[str]]:
+        return [None if tokens is None else " ".join(tokens) for tokens in self._run(requests)]
+
+    def stream(self, request: GenerationRequest, emit: TextSink):
+        self._run([request], emit)
@@ -0,0 +1,539 @@
+import gc
+import mmap
+import os
+import time
+from itertools import groupby
+from typing import Dict, List, Optional
+
+import psutil
+import torch
+from loguru import logger
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache, StoppingCriteria, StoppingCriteriaList, TextStreamer
+
+from ..config import settings
+from ..utils.mmap_weights import close_mappings, load_mmap_model
+from ..utils.precision import DTYPES, quantize_linear_int8, release_free_memory, resolve_precision
+from .base import GenerationRequest, InferenceBackend, TextSink, fit_history
+
+# Stands in for the user message when splitting the chat template into a fixed prefix and a tail
+PROMPT_MARKER = "<<user_input>>"
+
+# peft's name for "no adapter" in per-row adapter_names
+BASE_ADAPTER = "__base__"
+
+
+class _GenerationClock:
+    """
+    Minimal streamer for `generate`: its first `put` is the prompt, the second the first
+    sampled token, so the gap between them splits prefill from decode
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self._puts = 0
+
+    def put(self, value):
+        self._puts += 1
+        if self._puts == 2:
+            self.first_token_at = time.perf_counter()
+
+    def end(self):
+        pass
+
+    def split(self) -> Dict[str, float]:
+        """Prefill and decode durations up to now"""
+        now = time.perf_counter()
+        first = self.first_token_at or now
+        return {"prefill": first - self.started_at, "decode": now - first}
+
+
+class _CancellationCriteria(StoppingCriteria):
+    """
+    Checked by `generate` after every decode step: rows whose request was cancelled stop
+    there (and are padded from then on), and `generate` returns once every row has stopped,
+    freeing the batch slot.
+    """
+
+    def __init__(self, requests: List[GenerationRequest]):
+        self.requests = requests
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.tensor([request.cancelled for request in self.requests], device=input_ids.device)
+
+
+class _SinkStreamer(TextStreamer):
+    """Passes decoded text chunks from the generation thread to a TextSink"""
+
+    def __init__(self, tokenizer, emit: TextSink):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.emit = emit
+        self.clock = _GenerationClock()
+        self.ids: List[int] = []
+
+    @property
+    def tokens(self) -> int:
+        return len(self.ids)
+
+    def put(self, value):
+        self.clock.put(value)
+        if self.clock.first_token_at is not None:
+            self.ids.extend(value.view(-1).tolist())
+        super().put(value)
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self.emit(text)
+
+
+class TransformersBackend(InferenceBackend):
+    """
+    Hugging Face causal LM run with `generate`: micro-batches are left-padded into one call
+    per (adapter, sampling) group, and the templated system prefix is prefilled once at load
+    time and its past-key-values reused by every request.
+
+    LoRA adapters are registered on the shared base weights with peft. Each `generate` call
+    names its adapter per row (`adapter_names`) instead of switching a global active adapter,
+    so inference threads never race and changing adapters between batches costs nothing.
+    Adapters change the attention projections, so the prefix KV is kept per adapter.
+
+    Session history is kept as token ids: a finished exchange is the message ids already
+    tokenized for its prompt, the generated ids and the pre-tokenized template text that
+    closes an answer, so nothing is re-templated or re-tokenized on later turns.
+    """
+
+    name = "transformers"
+
+    def __init__(self, system_prompt: str, precision: Optional[str] = None):
+        self.system_prompt = system_prompt
+        self.model: Optional[AutoModelForCausalLM] = None
+        self.tokenizer: Optional[AutoTokenizer] = None
+        # safetensors mappings the weights view with WEIGHTS_MMAP, closed on unload
+        self._mappings: List[mmap.mmap] = []
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # See utils.precision; resolved against the device at load time
+        self.precision = resolve_precision(precision or settings.model_precision, self.device)
+        self.add_special_tokens = True
+
+        # Chat template split around the user message at load time (None when it cannot be split)
+        self._prefix_text: Optional[str] = None
+        self._prefix_list: List[int] = []
+        self._prompt_tail = ""
+        self._suffix_only = False
+        # Template text around the answer of an earlier exchange (None when sessions are unsupported)
+        self._answer_head: Optional[str] = None
+        self._answer_tail = ""
+        self._answer_tail_ids: List[int] = []
+        # Tokens of the chat template around an empty message (system prompt included)
+        self._template_tokens = 0
+
+        # Prefix cache: system prefix ids and, per adapter (None = base), past-key-values computed once
+        self._prefix_ids: Optional[torch.Tensor] = None
+        self._prefix_kv: Dict[Optional[str], tuple] = {}
+
+        # name -> {"path", "params_mb", "rss_mb", "load_s"}
+        self._adapters: Dict[str, dict] = {}
+
+    def load(self, model_path: str, prepare: bool = True):
+        dtype = DTYPES[self.precision]
+        if settings.weights_mmap:
+            # Parameters view the safetensors pages directly; processes share them via the page cache
+            self.model, self._mappings = load_mmap_model(model_path)
+            logger.info(f"Memory-mapped {self.model.dtype} weights from {model_path}")
+            if self.model.dtype != dtype:
+                logger.warning(f"Converting mmapped {self.model.dtype} weights to {dtype}: they are copied and no longer shared")
+                self.model = self.model.to(dtype)
+        else:
+            self.model = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                torch_dtype=dtype,
+                low_cpu_mem_usage=True
+            )
+
+        if self.precision == "int8":
+            self.model = quantize_linear_int8(self.model)
+            logger.info("Linear layers quantized to dynamic int8")
+
+        # Move model to device manually
+        self.model = self.model.to(self.device)
+        logger.info(f"device set to {self.device}")
+        self.model.eval()
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+        # Batched decoder-only generation needs left padding so every prompt ends at the same position
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        if not hasattr(self.tokenizer, 'apply_chat_template'):
+            raise RuntimeError("Tokenizer has no chat template")
+
+        # Some chat templates (Llama-2) already emit BOS, others (TinyLlama) rely on the tokenizer adding it
+        bos = self.tokenizer.bos_token
+        self.add_special_tokens = not (bos and self.build_prompt("").startswith(bos))
+
+        self._prefix_ids, self._prefix_kv = None, {}
+        self._adapters = {}
+        self._template_tokens = len(
+            self.tokenizer(self.build_prompt(""), add_special_tokens=self.add_special_tokens)["input_ids"]
+        )
+        self._split_template()
+        if prepare:
+            self.prepare()
+
+    def prepare(self):
+        if settings.prefix_cache_enabled and self._prefix_text is not None and self._prefix_ids is None:
+            self._build_prefix_cache()
+
+    def load_adapter(self, name: str, path: str) -> dict:
+        try:
+            from peft import PeftModel
+        except ImportError as e:
+            raise RuntimeError("LORA_ADAPTERS needs the peft package (see requirements.txt)") from e
+
+        if self.precision == "int8":
+            raise RuntimeError("LoRA adapters need float base weights, not MODEL_PRECISION=int8")
+        if name in self._adapters or name == BASE_ADAPTER:
+            raise ValueError(f"Adapter {name!r} is already registered")
+
+        process = psutil.Process(os.getpid())
+        rss_before = process.memory_info().rss
+        start = time.perf_counter()
+        if isinstance(self.model, PeftModel):
+            self.model.load_adapter(path, adapter_name=name)
+        else:
+            self.model = PeftModel.from_pretrained(self.model, path, adapter_name=name)
+        self.model.eval()
+        load_seconds = time.perf_counter() - start
+
+        marker = f".{name}."
+        params = sum(p.numel() * p.element_size() for n, p in self.model.named_parameters() if marker in n)
+        stats = {
+            "path": path,
+            "params_mb": round(params / 2**20, 2),
+            "rss_mb": round((process.memory_info().rss - rss_before) / 2**20, 2),
+            "load_s": round(load_seconds, 3),
+        }
+        self._adapters[name] = stats
+        if self._prefix_ids is not None:
+            self._prefill_prefix(name)
+        return stats
+
+    def adapters(self) -> List[str]:
+        return list(self._adapters)
+
+    def _adapter_kwargs(self, adapter: Optional[str], rows: int) -> dict:
+        """Per-row adapter selection for a model call; nothing when no adapter is registered"""
+        if not self._adapters:
+            return {}
+        return {"adapter_names": [adapter or BASE_ADAPTER] * rows}
+
+    def is_loaded(self) -> bool:
+        return self.model is not None and self.tokenizer is not None
+
+    def unload(self):
+        # A generation still running keeps its own references; its tensors go when it returns
+        self.model, self.tokenizer = None, None
+        self._prefix_ids, self._prefix_kv = None, {}
+        self._adapters = {}
+        gc.collect()
+        # Only once the weights are freed; a running generation keeps them mapped until it returns
+        close_mappings(self._mappings)
+        self._mappings = []
+        if self.device == "cuda":
+            torch.cuda.empty_cache()
+        release_free_memory()
+
+    def describe(self) -> dict:
+        return {
+            "backend": self.name,
+            "device": self.device,
+            "precision": self.precision,
+            "prefix_cache": self._prefix_ids is not None,
+            "sessions": self._answer_head is not None,
+            "adapters": dict(self._adapters),
+        }
+
+    def build_prompt(self, user_input: str) -> str:
+        """Render the chat template for one user message"""
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": f"{user_input}"}
+        ]
+        return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def _split_template(self):
+        """
+        Split the chat template around the user message, so requests tokenize only their own
+        message behind a fixed system prefix, and find the template text around an answer,
+        so session exchanges can be kept as token ids. Either is disabled (with a warning)
+        when the template or tokenizer does not allow it.
+        """
+        self._prefix_text, self._answer_head = None, None
+        template = self.build_prompt(PROMPT_MARKER)
+        if template.count(PROMPT_MARKER) != 1:
+            logger.warning("Chat template does not embed the user message verbatim, prefix cache and sessions disabled")
+            return
+        prefix_text, tail = template.split(PROMPT_MARKER)
+        prefix_list = self.tokenizer(prefix_text, add_special_tokens=self.add_special_tokens)["input_ids"]
+
+        # The prefix must tokenize identically on its own and inside a full prompt
+        probe = "Xin chào" + tail
+        joint = self.tokenizer(prefix_text + probe, add_special_tokens=self.add_special_tokens)["input_ids"]
+        if joint[:len(prefix_list)] != prefix_list:
+            logger.warning("Tokenizer merges across the system prefix boundary, prefix cache and sessions disabled")
+            return
+        # SentencePiece tokenizers add a word-start marker to a separately tokenized suffix;
+        # those tokenize behind the prefix text and drop the prefix ids
+        self._suffix_only = joint[len(prefix_list):] == self.tokenizer(probe, add_special_tokens=False)["input_ids"]
+        self._prefix_text, self._prefix_list, self._prompt_tail = prefix_text, prefix_list, tail
+
+        try:
+            parts = self.tokenizer.apply_chat_template(
+                [
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": PROMPT_MARKER},
+                    {"role": "assistant", "content": PROMPT_MARKER},
+                    {"role": "user", "content": PROMPT_MARKER},
+                ],
+                tokenize=False,
+                add_generation_prompt=True
+            ).split(PROMPT_MARKER)
+        except Exception as e:
+            logger.warning(f"Chat template cannot render a conversation, sessions disabled: {e}")
+            return
+        if len(parts) != 4 or parts[0] != prefix_text or parts[3] != tail:
+            logger.warning("Chat template renders earlier turns differently, sessions disabled")
+            return
+        self._answer_head, self._answer_tail = parts[1], parts[2]
+        self._answer_tail_ids = self._encode_suffixes([self._answer_tail])[0]
+
+    def _build_prefix_cache(self):
+        """
+        Prefill the templated system prefix once and keep its past-key-values, so each
+        request only prefills its own message (and session history).
+        """
+        self._prefix_ids = torch.tensor([self._prefix_list], device=self.device)
+        for adapter in [None] + self.adapters():
+            self._prefill_prefix(adapter)
+        logger.info(f"Cached KV of the {len(self._prefix_list)}-token system prefix for {len(self._prefix_kv)} adapter(s)")
+
+    def _prefill_prefix(self, adapter: Optional[str]):
+        with torch.inference_mode():
+            past_key_values = self.model(
+                input_ids=self._prefix_ids, use_cache=True, **self._adapter_kwargs(adapter, 1)
+            ).past_key_values
+        if isinstance(past_key_values, DynamicCache):
+            past_key_values = past_key_values.to_legacy_cache()
+        self._prefix_kv[adapter] = past_key_values
+
+    def context_window(self) -> int:
+        if self._answer_head is None or self.model is None:
+            return 0
+        return getattr(self.model.config, "max_position_embeddings", 2048) - len(self._prefix_list)
+
+    def encode_exchange(self, user_input: str, answer: str) -> List[int]:
+        if self._answer_head is None:
+            raise NotImplementedError("The chat template does not allow session history")
+        return self._encode_suffixes([user_input + self._answer_head + answer + self._answer_tail])[0]
+
+    def prompt_budget(self, max_new_tokens: int) -> Optional[int]:
+        if self.model is None:
+            return None
+        window = getattr(self.model.config, "max_position_embeddings", 2048)
+        return window - self._template_tokens - max_new_tokens
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def truncate_tokens(self, text: str, max_tokens: int) -> str:
+        ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+        if len(ids) <= max_tokens:
+            return text
+        return self.tokenizer.decode(ids[:max(max_tokens, 0)], skip_special_tokens=True)
+
+    def _encode_suffixes(self, texts: List[str]) -> List[List[int]]:
+        """Token ids of texts that follow the system prefix, as they tokenize inside a full prompt"""
+        if self._suffix_only:
+            return self.tokenizer(texts, add_special_tokens=False)["input_ids"]
+        prefix_len = len(self._prefix_list)
+        full_ids = self.tokenizer([self._prefix_text + t for t in texts], add_special_tokens=self.add_special_tokens)["input_ids"]
+        return [ids[prefix_len:] for ids in full_ids]
+
+    def _tokenize_messages(self, user_inputs: List[str], stages: Optional[Dict[str, float]] = None) -> List[List[int]]:
+        """Token ids of `message + template tail` per message; needs the split template"""
+        start = time.perf_counter()
+        texts = [u + self._prompt_tail for u in user_inputs]
+        templated = time.perf_counter()
+        message_ids = self._encode_suffixes(texts)
+        if stages is not None:
+            stages["template"] = templated - start
+            stages["tokenize"] = time.perf_counter() - templated
+        return message_ids
+
+    def _prepare_inputs(
+        self,
+        user_inputs: List[str],
+        stages: Optional[Dict[str, float]] = None,
+        adapter: Optional[str] = None,
+        histories: Optional[List[Optional[list]]] = None,
+        max_new_tokens: int = 0,
+        message_ids: Optional[List[List[int]]] = None
+    ) -> dict:
+        """
+        Tokenize a batch of user messages into `generate` kwargs for `adapter`.
+        Only `message + template tail` is tokenized (pass `message_ids` when that is done
+        already) and put behind the system prefix ids. With the prefix cache each row starts
+        from its own copy of the adapter's prefix past-key-values, so only the rest is
+        prefilled. Session rows get their history between prefix and message, oldest exchanges
+        dropped to leave room for `max_new_tokens`.
+        Templating and tokenization times are added to `stages` when given.
+        """
+        if self._prefix_text is None:
+            start = time.perf_counter()
+            texts = [self.build_prompt(u) for u in user_inputs]
+            templated = time.perf_counter()
+            inputs = self.tokenizer(
+                texts,
+                return_tensors="pt",
+                padding=True,
+                add_special_tokens=self.add_special_tokens
+            ).to(self.device)
+            inputs = {"input_ids": inputs["input_ids"], "attention_mask": inputs["attention_mask"]}
+            if stages is not None:
+                stages["template"] = templated - start
+                stages["tokenize"] = time.perf_counter() - templated
+            inputs.update(self._adapter_kwargs(adapter, len(user_inputs)))
+            return inputs
+
+        if message_ids is None:
+            message_ids = self._tokenize_messages(user_inputs, stages)
+        start = time.perf_counter()
+        budget = self.context_window() - max_new_tokens
+        rows = [
+            fit_history(history, budget - len(ids)) + ids if history else ids
+            for history, ids in zip(histories or [None] * len(message_ids), message_ids)
+        ]
+
+        batch_size = len(rows)
+        if self._prefix_ids is None:
+            padded = self.tokenizer.pad({"input_ids": [self._prefix_list + row for row in rows]}, return_tensors="pt").to(self.device)
+            inputs = {"input_ids": padded["input_ids"], "attention_mask": padded["attention_mask"]}
+        else:
+            suffix = self.tokenizer.pad({"input_ids": rows}, return_tensors="pt").to(self.device)
+            prefix_ids = self._prefix_ids.expand(batch_size, -1)
+            # Left padding now sits between prefix and message; position ids follow the attention mask
+            inputs = {
+                "input_ids": torch.cat([prefix_ids, suffix["input_ids"]], dim=1),
+                "attention_mask": torch.cat([torch.ones_like(prefix_ids), suffix["attention_mask"]], dim=1),
+                "past_key_values": DynamicCache.from_legacy_cache(tuple(
+                    (key.repeat(batch_size, 1, 1, 1), value.repeat(batch_size, 1, 1, 1))
+                    for key, value in self._prefix_kv[adapter]
+                )),
+            }
+        inputs.update(self._adapter_kwargs(adapter, batch_size))
+
+        if stages is not None:
+            stages["tokenize"] = stages.get("tokenize", 0.0) + time.perf_counter() - start
+        return inputs
+
+    def _exchange_ids(self, request: GenerationRequest, message_ids: Optional[List[int]], answer_ids: List[int]) -> List[int]:
+        """
+        A finished session exchange as history ids: the prompt's message ids, the generated ids
+        and the answer's closing template, when the template frames past turns like the prompt.
+        History keeps what the user typed, so a grounded message (statutes prepended) is re-encoded
+        """
+        if request.grounded_input is not None:
+            message_ids = None
+        if message_ids is not None and self._answer_head == self._prompt_tail:
+            if answer_ids and answer_ids[-1] == self.tokenizer.eos_token_id:
+                answer_ids = answer_ids[:-1]
+            return message_ids + answer_ids + self._answer_tail_ids
+        return self.encode_exchange(request.user_input, self.tokenizer.decode(answer_ids, skip_special_tokens=True).strip())
+
+    def _sampling_kwargs(self, temperature: float, top_p: float) -> dict:
+        return dict(
+            do_sample=True,
+            top_p=top_p,
+            temperature=temperature,
+            repetition_penalty=1.2,
+            eos_token_id=self.tokenizer.eos_token_id,
+            pad_token_id=self.tokenizer.pad_token_id
+        )
+
+    def generate_batch(self, requests: List[GenerationRequest]) -> List[Optional[str]]:
+        """
+        Generate responses for several prompts with as few `generate` calls as possible.
+        Requests sharing adapter and sampling params are padded together into one call; each
+        output is cut to its own `max_tokens`.
+        """
+        results: List[Optional[str]] = [None] * len(requests)
+        order = sorted(range(len(requests)), key=lambda i: requests[i].batch_key)
+
+        for (adapter, temperature, top_p), group in groupby(order, key=lambda i: requests[i].batch_key):
+            indices = list(group)
+            if all(requests[i].cancelled for i in indices):
+                continue
+            stages: Dict[str, float] = {}
+            user_inputs = [requests[i].model_input for i in indices]
+            message_ids = self._tokenize_messages(user_inputs, stages) if self._prefix_text is not None else None
+            max_new_tokens = max(requests[i].max_tokens for i in indices)
+            inputs = self._prepare_inputs(
+                user_inputs, stages, adapter or None, [requests[i].history for i in indices], max_new_tokens, message_ids
+            )
+
+            clock = _GenerationClock()
+            with torch.inference_mode():
+                output = self.model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    streamer=clock,
+                    stopping_criteria=StoppingCriteriaList([_CancellationCriteria([requests[i] for i in indices])]),
+                    **self._sampling_kwargs(temperature, top_p)
+                )
+            stages.update(clock.split())
+
+            new_tokens = output[:, inputs["input_ids"].shape[1]:]
+            for row, (i, tokens) in enumerate(zip(indices, new_tokens)):
+                request = requests[i]
+                if request.cancelled:
+                    continue
+                tokens = tokens[:request.max_tokens]
+                generated = self._count_generated(tokens)
+                decode_start = time.perf_counter()
+                results[i] = self.tokenizer.decode(tokens, skip_special_tokens=True).strip()
+                if request.history is not None:
+                    request.exchange = self._exchange_ids(
+                        request, message_ids and message_ids[row], tokens[:generated].tolist()
+                    )
+                request.record(dict(stages, detokenize=time.perf_counter() - decode_start), generated)
+
+        return results
+
+    def _count_generated(self, tokens: torch.Tensor) -> int:
+        """Tokens up to and including the first EOS (the rest is padding)"""
+        eos = (tokens == self.tokenizer.eos_token_id).nonzero()
+        return int(eos[0, 0]) + 1 if len(eos) else len(tokens)
+
+    def stream(self, request: GenerationRequest, emit: TextSink):
+        stages: Dict[str, float] = {}
+        message_ids = self._tokenize_messages([request.model_input], stages) if self._prefix_text is not None else None
+        inputs = self._prepare_inputs(
+            [request.model_input], stages, request.adapter, [request.history], request.max_tokens, message_ids
+        )
+        streamer = _SinkStreamer(self.tokenizer, emit)
+        with torch.inference_mode():
+            self.model.generate(
+                **inputs,
+                max_new_tokens=request.max_tokens,
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([_CancellationCriteria([request])]),
+                **self._sampling_kwargs(request.temperature, request.top_p)
+            )
+        # Streamed chunks are detokenized inside the streamer, so decode includes detokenization
+        stages.update(streamer.clock.split())
+        if request.history is not None and not request.cancelled:
+            answer_ids = streamer.ids[:self._count_generated(torch.tensor(streamer.ids))] if streamer.ids else []
+            request.exchange = self._exchange_ids(request, message_ids and message_ids[0], answer_ids)
+        request.record(stages, streamer.tokens)
@@ -0,0 +1,134 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Set
+
+from loguru import logger
+
+from monitor.metrics import record_batch
+
+
+@dataclass
+class _Pending:
+    item: Any
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching scheduler.
+
+    Concurrent `submit` calls are collected for at most `max_wait_ms` (or until
+    `max_batch_size` items are queued), handed to `process_batch` as one list on
+    the executor, and each result is routed back to its awaiting caller.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], List[Any]],
+        executor: Executor,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        max_concurrent_batches: int = 1,
+        record_metrics: bool = True,
+    ):
+        self.process_batch = process_batch
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self.record_metrics = record_metrics
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+
+    def _ensure_started(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._worker = asyncio.create_task(self._run(), name="micro-batcher")
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item and wait for its result"""
+        self._ensure_started()
+        pending = _Pending(item=item, future=asyncio.get_running_loop().create_future())
+        self._queue.put_nowait(pending)
+        return await pending.future
+
+    async def stop(self):
+        """Stop scheduling; queued items fail with CancelledError"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._queue is not None:
+            while not self._queue.empty():
+                self._queue.get_nowait().future.cancel()
+
+    async def _collect(self) -> List[_Pending]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # Anything already queued joins without waiting
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        while True:
+            # Wait for a free slot first so requests pile up into the next batch while the model is busy
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[_Pending]):
+        try:
+            live = [p for p in batch if not p.future.done()]
+            if not live:
+                return
+
+            if self.record_metrics:
+                started = time.perf_counter()
+                record_batch(len(live), [started - p.enqueued_at for p in live])
+
+            loop = asyncio.get_running_loop()
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.process_batch, [p.item for p in live]
+                )
+            except Exception as e:
+                logger.error(f"Batch of {len(live)} failed: {e}")
+                for p in live:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+                return
+
+            for p, result in zip(live, results):
+                if not p.future.done():
+                    p.future.set_result(result)
+        finally:
+            self._slots.release()
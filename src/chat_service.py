@@ -1,115 +1,657 @@
-# from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
-# import torch
+import asyncio
+import math
+import os
 import time
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, List, Optional
 from loguru import logger
 
+from .admission import PROMPT_CHARS_PER_TOKEN
+from .backends import (
+    DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE, DEFAULT_TOP_P, GenerationRequest, InferenceBackend, create_backend
+)
+from .batcher import MicroBatcher
+from .config import settings
+from .model_handle import ModelHandle, ModelLease
+from .response_cache import ResponseCache
+from .retrieval import BM25Index
+from .semantic_cache import HashedNgramEmbedder, SemanticCache
+from .sessions import Session, SessionStore
+from .topology import serving_topology
+from .utils.model_downloader import load_model_from_s3
+from .utils.tracing import RequestTrace, current_trace
+from monitor.metrics import (
+    record_generation_cancelled, record_inter_token_latency, record_model_load, record_model_swap,
+    record_time_to_first_token, set_model_status, set_model_version
+)
+
+SYSTEM_PROMPT = "You are an SQL analyst with 15 years of experience writing complex SQL queries. Consider the following tables with their schemas: Write a SQLite SQL query that would help you answer the following question: Remember always return sql query answer, do not return any extra information or explain or add text. \n"
+
+GROUNDED_PROMPT = "Căn cứ pháp luật:\n{context}\n\nCâu hỏi: {question}"
+PASSAGE_SEPARATOR = "\n\n"
+
+WARMUP_QUESTIONS = ["Tù chung thân là gì?", "Người từ đủ bao nhiêu tuổi phải chịu trách nhiệm hình sự về mọi tội phạm?"]
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before its response was complete"""
+
+
+class UnknownAdapter(ValueError):
+    """The request names a LoRA adapter the backend has not registered"""
+
+
+class SwapInProgress(RuntimeError):
+    """A hot model swap is already running"""
+
+
 class ChatService:
-    """Service for managing the LLM model"""
+    """
+    Service for managing the LLM model: scheduling (micro-batching, deadlines, cancellation),
+    caching and retrieval grounding live here; the model itself is an InferenceBackend.
+
+    The current model is a ModelHandle. Each request is pinned to the handle current when it
+    is made, so a hot swap (`swap_model`) only changes which model new requests get; requests
+    holding a lease on the old one finish on it before its weights are freed.
+
+    Requests with a session id carry the session's earlier exchanges (token ids kept by the
+    SessionStore) and skip the response and semantic caches, whose answers ignore history.
+    """
 
-    def __init__(self):
-        # self.model: Optional[AutoModelForCausalLM] = None
-        # self.tokenizer: Optional[AutoTokenizer] = None
-        # self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    def __init__(self, max_workers: Optional[int] = None, backend: Optional[InferenceBackend] = None):
+        self.model = ModelHandle(
+            backend or create_backend(settings.inference_backend, SYSTEM_PROMPT), settings.model_version, settings.model_path
+        )
         self.model_loaded = False
+        self.ready = False
+        self._startup_task: Optional[asyncio.Task] = None
+        self._swap_task: Optional[asyncio.Task] = None
+        # State of the last hot swap, for /model/status
+        self.swap_status: Optional[dict] = None
+
+        self.retriever: Optional[BM25Index] = None
+        # Moving average of passage tokens put into a grounded prompt, priced in by admission control
+        self.grounding_tokens = 0.0
+
+        # Generation is blocking; it runs on this pool so the event loop keeps serving /health and /metrics
+        self.max_workers = max_workers or serving_topology.inference_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._batcher: Optional[MicroBatcher] = None
+
+        self.response_cache = ResponseCache(
+            max_entries=settings.response_cache_max_entries,
+            max_bytes=int(settings.response_cache_max_mb * 1024 * 1024),
+            ttl_seconds=settings.response_cache_ttl_seconds,
+        )
+
+        self.sessions = SessionStore(
+            max_bytes=int(settings.session_store_max_mb * 1024 * 1024),
+            idle_seconds=settings.session_idle_seconds,
+        )
+
+        self.semantic_cache: Optional[SemanticCache] = None
+        self._semantic_batcher: Optional[MicroBatcher] = None
+        self._cache_executor: Optional[ThreadPoolExecutor] = None
+        if settings.semantic_cache_capacity > 0:
+            self.semantic_cache = SemanticCache(
+                capacity=settings.semantic_cache_capacity,
+                threshold=settings.semantic_cache_threshold,
+                embedder=HashedNgramEmbedder(dim=settings.semantic_cache_dim),
+            )
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Inference thread pool, created on first use"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="inference",
+            )
+            logger.info(f"Inference executor started with {self.max_workers} worker(s)")
+        return self._executor
+
+    @property
+    def batcher(self) -> MicroBatcher:
+        """Micro-batching scheduler feeding generate_batch, created on first use"""
+        if self._batcher is None:
+            self._batcher = MicroBatcher(
+                self.generate_batch,
+                self.executor,
+                max_batch_size=settings.batch_max_size,
+                max_wait_ms=settings.batch_window_ms,
+                max_concurrent_batches=self.max_workers,
+            )
+        return self._batcher
+
+    @property
+    def semantic_batcher(self) -> MicroBatcher:
+        """
+        Batches concurrent semantic cache lookups into one similarity matmul, on its own thread
+        so lookups never queue behind a generation
+        """
+        if self._semantic_batcher is None:
+            self._cache_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-cache")
+            self._semantic_batcher = MicroBatcher(
+                self.semantic_cache.lookup_batch,
+                self._cache_executor,
+                max_batch_size=64,
+                max_wait_ms=1.0,
+                record_metrics=False,
+            )
+        return self._semantic_batcher
+
+    @property
+    def backend(self) -> InferenceBackend:
+        """Backend of the current model"""
+        return self.model.backend
+
+    async def shutdown(self):
+        """Stop the batchers and the executors, dropping queued generations"""
+        for task in (self._startup_task, self._swap_task):
+            if task is not None and not task.done():
+                task.cancel()
+        if self._batcher is not None:
+            await self._batcher.stop()
+            self._batcher = None
+        if self._semantic_batcher is not None:
+            await self._semantic_batcher.stop()
+            self._semantic_batcher = None
+            self._cache_executor.shutdown(wait=False, cancel_futures=True)
+            self._cache_executor = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def start_background(self) -> asyncio.Task:
+        """Load and warm up the model in a background task (no-op while one is already running)"""
+        if self._startup_task is None or self._startup_task.done():
+            self._startup_task = asyncio.create_task(self._start(), name="model-startup")
+        return self._startup_task
+
+    async def _start(self):
+        try:
+            if not self.is_model_loaded():
+                await self.load_model()
+            else:
+                # Weights were preloaded by the parent before fork; anything that runs the model happens in the worker
+                serving_topology.apply_torch()
+                await asyncio.get_running_loop().run_in_executor(None, self.backend.prepare)
+                # Gauges set by the parent do not carry over to this process
+                set_model_status(True)
+                set_model_version(self.model.version)
+            await self.warm_up()
+            self.ready = True
+            logger.info("Model is warm, service ready")
+        except Exception as e:
+            logger.error(f"Model startup failed: {e}")
+
+    def is_ready(self) -> bool:
+        """Readiness: model loaded and warmed up"""
+        return self.ready and self.is_model_loaded()
+
+    async def warm_up(self, backend: Optional[InferenceBackend] = None):
+        """Run a short batched generation so buffers and kernels are allocated before real traffic"""
+        start_time = time.time()
+        requests = [GenerationRequest(q, max_tokens=settings.warmup_max_tokens, backend=backend) for q in WARMUP_QUESTIONS]
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.generate_batch, requests)
+        logger.info(f"Warm-up generation finished in {time.time() - start_time:.2f} seconds")
 
     async def load_model(self, model_path: str = None) -> str:
-        return "Loaded successfully"
+        """Load model and tokenizer off the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(None, self._load_model_sync, model_path)
+
+    def preload(self, model_path: str = None) -> str:
+        """
+        Load weights and tokenizer synchronously without running the model, for a parent
+        process that forks workers afterwards (no torch thread pool exists yet at fork time)
+        """
+        return self._load_model_sync(model_path, prepare=False)
+
+    def use_backend(self, backend: InferenceBackend):
+        """Replace the backend; it has to be loaded (and warmed up) again before serving"""
+        self.model = ModelHandle(backend, settings.model_version, settings.model_path)
+        self.model_loaded = False
+        self.ready = False
+        set_model_status(False)
 
-        # try:
-        #     if model_path is None:
-        #         model_path = ""
+    def _load_model_sync(self, model_path: str = None, prepare: bool = True) -> str:
+        self.ready = False
+        try:
+            if model_path is None:
+                model_path = settings.model_path
 
-        #     start_time = time.time()
+            start_time = time.time()
 
-        #     self.model = AutoModelForCausalLM.from_pretrained(
-        #         model_path,
-        #         torch_dtype=torch.float16,
-        #         low_cpu_mem_usage=True
-        #     )
+            serving_topology.apply_torch()
+            self._load_backend(self.backend, model_path, prepare)
 
-        #     # Move model to device manually
-        #     if torch.cuda.is_available():
-        #         self.model = self.model.to("cuda")
-        #         logger.info("device set to cuda")
-        #     else:
-        #         self.model = self.model.to("cpu")
-        #         logger.info("device set to cpu")
+            if settings.retrieval_index_path and self.retriever is None:
+                self.retriever = BM25Index.load(settings.retrieval_index_path)
+                logger.info(f"Loaded retrieval index with {self.retriever.num_docs} passages")
+                # Until prompts are measured: top-k passages of average size at PROMPT_CHARS_PER_TOKEN (bytes overcount)
+                passage_bytes = self.retriever.text_offsets[-1] / max(self.retriever.num_docs, 1)
+                self.grounding_tokens = settings.retrieval_top_k * passage_bytes / PROMPT_CHARS_PER_TOKEN
 
-        #     self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+            load_time = time.time() - start_time
+            logger.info(f"Model loaded successfully in {load_time:.2f} seconds: {self.backend.describe()}")
+            self.model_loaded = True
+            record_model_load(load_time)
+            set_model_status(True)
+            set_model_version(self.model.version)
+            return "Loaded successfully"
 
-        #     try:
-        #         self.pipe = pipeline(
-        #             "text-generation",
-        #             model=self.model,
-        #             tokenizer=self.tokenizer,
-        #             device_map="auto"
-        #         )
+        except Exception as e:
+            logger.error(f"Error while loading model: {e}")
+            self.model_loaded = False
+            set_model_status(False)
+            raise
 
-        #     except Exception as e:
-        #          raise RuntimeError("Model is not loaded")
+    @staticmethod
+    def _load_backend(backend: InferenceBackend, model_path: str, prepare: bool = True):
+        backend.load(model_path, prepare=prepare)
+        for name, path in settings.lora_adapters.items():
+            stats = backend.load_adapter(name, path)
+            logger.info(f"Loaded LoRA adapter {name!r}: {stats}")
 
-        #     load_time = time.time() - start_time
-        #     logger.info(f"Model loaded successfully in {load_time:.2f} seconds")
-        #     self.model_loaded = True
+    def swap_model(self, model_path: str = None, s3_prefix: str = None, version: str = None) -> dict:
+        """
+        Start a hot swap to another model version in the background and return its status.
+        The new version is downloaded (from the registry bucket when `s3_prefix` is given),
+        loaded next to the current one and warmed up; then new requests go to it, and the old
+        weights are freed once the requests pinned to them finish. Serving continues
+        throughout, so the pod needs memory for two models while a swap runs.
+        """
+        if self._swap_task is not None and not self._swap_task.done():
+            raise SwapInProgress(f"Swap to {self.swap_status['version']} is still {self.swap_status['state']}")
 
+        source = s3_prefix or model_path or settings.model_path
+        version = version or os.path.basename(source.rstrip("/")) or settings.model_version
+        self.swap_status = {
+            "state": "pending",
+            "version": version,
+            "source": source,
+            "previous_version": self.model.version,
+            "started_at": time.time(),
+            "phases": {},
+            "error": None,
+        }
+        self._swap_task = asyncio.create_task(self._swap(model_path, s3_prefix, version, self.swap_status), name="model-swap")
+        return self.swap_status
 
-        # except Exception as e:
-        #     logger.error("Error while loading model:", e)
-        #     self.model_loaded = False
-        #     raise
+    async def _swap(self, model_path: Optional[str], s3_prefix: Optional[str], version: str, status: dict):
+        loop = asyncio.get_running_loop()
+        phases: Dict[str, float] = status["phases"]
+        backend = None
+
+        def enter(state: str) -> float:
+            status["state"] = state
+            logger.info(f"Model swap to {version}: {state}")
+            return time.perf_counter()
+
+        try:
+            if s3_prefix:
+                start = enter("downloading")
+                local_dir = os.path.join(settings.model_download_dir, version)
+                model_path = await loop.run_in_executor(None, load_model_from_s3, s3_prefix, local_dir)
+                phases["download"] = time.perf_counter() - start
+
+            start = enter("loading")
+            backend = create_backend(settings.inference_backend, SYSTEM_PROMPT)
+            await loop.run_in_executor(None, self._load_backend, backend, model_path or settings.model_path)
+            phases["load"] = time.perf_counter() - start
+            record_model_load(phases["load"])
+
+            start = enter("warming_up")
+            await self.warm_up(backend)
+            phases["warmup"] = time.perf_counter() - start
+
+            # One assignment on the event loop: requests made from here on are pinned to the new model
+            old, self.model = self.model, ModelHandle(backend, version, s3_prefix or model_path or settings.model_path)
+            self.model_loaded = True
+            set_model_status(True)
+            set_model_version(version)
+            logger.info(f"Now serving model {version}; draining {old.inflight} request(s) on {old.version}")
+
+            start = enter("draining")
+            await old.drain()
+            await loop.run_in_executor(None, old.backend.unload)
+            phases["drain"] = time.perf_counter() - start
+
+            enter("swapped")
+            record_model_swap("swapped", phases)
+        except asyncio.CancelledError:
+            status["state"] = "cancelled"
+            raise
+        except Exception as e:
+            status["state"], status["error"] = "failed", str(e) or type(e).__name__
+            logger.error(f"Model swap to {version} failed: {status['error']}")
+            record_model_swap("failed", phases)
+            if backend is not None and backend is not self.backend:
+                await loop.run_in_executor(None, backend.unload)
+        finally:
+            status["finished_at"] = time.time()
+
+    def lease(self) -> ModelLease:
+        """Pin the current model for a request's lifetime; release the lease when the request is done"""
+        return self.model.lease()
 
     def is_model_loaded(self) -> bool:
         """Check if model is loaded"""
-        return True
-        # return self.model_loaded and self.model is not None and self.tokenizer is not None
+        return self.model_loaded and self.backend.is_loaded()
+
+    def adapters(self) -> List[str]:
+        """LoRA adapters requests can pick, besides the base model"""
+        return self.backend.adapters()
+
+    def ground(self, user_input: str, backend: Optional[InferenceBackend] = None, max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
+        """
+        Prepend the most relevant statute passages to the user message, the last ones cut so
+        that the prompt still leaves `max_tokens` of the model's context to the answer
+        """
+        if self.retriever is None:
+            return user_input
+        passages = self.retriever.search_passages(user_input, settings.retrieval_top_k)
+        backend = backend or self.backend
+        budget = backend.prompt_budget(max_tokens)
+        if budget is None:
+            tokens = sum(len(p) for p in passages) / PROMPT_CHARS_PER_TOKEN
+        else:
+            budget -= backend.count_tokens(GROUNDED_PROMPT.format(context="", question=user_input))
+            passages, tokens = self._fit_passages(passages, budget, backend)
+        self.grounding_tokens = 0.9 * self.grounding_tokens + 0.1 * tokens
+        if not passages:
+            return user_input
+        return GROUNDED_PROMPT.format(context=PASSAGE_SEPARATOR.join(passages), question=user_input)
+
+    @staticmethod
+    def _fit_passages(passages: List[str], budget: int, backend: InferenceBackend) -> tuple:
+        """Passages in rank order within `budget` tokens, the first that overflows cut short; and their tokens"""
+        # Slack per passage for its separator and for tokens merging or splitting at its edges
+        slack = backend.count_tokens(PASSAGE_SEPARATOR) + 1
+        kept, used = [], 0
+        for passage in passages:
+            room = budget - used - slack
+            if room <= 0:
+                break
+            tokens = backend.count_tokens(passage)
+            if tokens > room:
+                kept.append(backend.truncate_tokens(passage, room))
+                used += room + slack
+                break
+            kept.append(passage)
+            used += tokens + slack
+        return kept, used
+
+    def _ground(self, request: GenerationRequest):
+        """Set the grounded model input of a request, timing the retrieval stage"""
+        start = time.perf_counter()
+        request.grounded_input = self.ground(request.user_input, request.backend, request.max_tokens)
+        request.record({"retrieval": time.perf_counter() - start})
+
+    def grounding_cost(self) -> int:
+        """Expected passage tokens of a grounded prompt (0 without retrieval), for admission control"""
+        return math.ceil(self.grounding_tokens) if self.retriever is not None else 0
+
+    def generate_batch(self, requests: List[GenerationRequest]) -> List[Optional[str]]:
+        """
+        Generate responses for a micro-batch on the backend (blocking, runs on the inference
+        executor). Responses of requests cancelled mid-generation are None. During a hot swap
+        a batch can mix requests pinned to the old and the new model; each model gets its own call.
+        """
+        if not self.is_model_loaded():
+            raise RuntimeError("Model is not loaded")
+
+        batch_start = time.perf_counter()
+        groups: Dict[int, tuple] = {}
+        for i, request in enumerate(requests):
+            if request.submitted_at:
+                request.record({"queue": batch_start - request.submitted_at})
+            self._ground(request)
+            backend = request.backend or self.backend
+            groups.setdefault(id(backend), (backend, []))[1].append(i)
+
+        results: List[Optional[str]] = [None] * len(requests)
+        for backend, indices in groups.values():
+            for i, response in zip(indices, backend.generate_batch([requests[i] for i in indices])):
+                results[i] = response
+        return results
 
     def generate_response(
         self,
         user_input: str,
         max_tokens: int = None,
         temperature: float = None,
-        top_p: float = None
+        top_p: float = None,
+        adapter: str = None
+    ) -> str:
+        """Generate response from user input"""
+        try:
+            return self.generate_batch([self._make_request(user_input, max_tokens, temperature, top_p, adapter=adapter)])[0]
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            raise
+
+    async def agenerate(
+        self,
+        user_input: str,
+        max_tokens: int = None,
+        temperature: float = None,
+        top_p: float = None,
+        deadline_ms: int = None,
+        adapter: str = None,
+        lease: Optional[ModelLease] = None,
+        session_id: str = None
     ) -> str:
-        # """Generate response from user input"""
-
-        # try:
-        #     messages = [
-        #         {"role": "system", "content": "You are an SQL analyst with 15 years of experience writing complex SQL queries. Consider the following tables with their schemas: Write a SQLite SQL query that would help you answer the following question: Remember always return sql query answer, do not return any extra information or explain or add text. \n"},
-        #         {"role": "user", "content": f"{user_input}"}
-        #     ]
-        #     if hasattr(self.tokenizer, 'apply_chat_template'):
-        #         prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        #     else:
-        #         raise Exception("not chat template")
-
-        #     response = self.pipe(
-        #         prompt,
-        #         do_sample=True,
-        #         top_p=0.9,
-        #         temperature=0.7,
-        #         max_new_tokens=max_tokens,
-        #         repetition_penalty=1.2,
-        #         eos_token_id=self.tokenizer.eos_token_id
-        #     )
-
-        #     generated_text = response[0]['generated_text']
-
-        #     # Extract only the assistant's response
-        #     if "assistant" in generated_text:
-        #         response = generated_text.split("assistant")[-1].strip()
-        #     else:
-        #         return generated_text
-
-        #     return response
-
-        # except Exception as e:
-        #     logger.error(f"Error generating response: {e}")
-        #     raise
-        return "Hi, currrent service not reponsable"
-
-
-    def get_chat_history(self, session_id: str, db, limit: int = 50):
-        pass
-
-chatService = ChatService()
\ No newline at end of file
+        """
+        Awaitable generate_response. Repeated questions are answered from the response cache,
+        paraphrases from the semantic cache; the rest are micro-batched on the inference executor.
+        Raises DeadlineExceeded after `deadline_ms` (default settings.request_deadline_ms);
+        cancelling the awaiting task stops the generation at its next decode step.
+        Raises UnknownAdapter when `adapter` is not registered. Runs on the model of `lease`
+        (the current one without it). With `session_id` the answer follows the session's
+        earlier turns and the exchange is added to it.
+        """
+        request = self._make_request(user_input, max_tokens, temperature, top_p, deadline_ms, adapter, lease)
+        return await self._generate_in_session(request, session_id)
+
+    def agenerate_many(
+        self, items: List[dict], lease: Optional[ModelLease] = None, traces: Optional[List[Optional[RequestTrace]]] = None
+    ) -> List[asyncio.Task]:
+        """
+        Start one generation per item (`agenerate` keyword arguments) and return their tasks
+        in input order, all on the model of `lease`. Tasks are started shortest message first, so the micro-batcher pads
+        neighbours of similar length together; caches and single-flight apply per item.
+        Item i records its stages on `traces[i]` (untraced without `traces`): on one shared
+        trace the timings of all items would add up.
+        """
+        requests = [
+            self._make_request(
+                item["user_input"], item.get("max_tokens"), item.get("temperature"), item.get("top_p"),
+                item.get("deadline_ms"), item.get("adapter"), lease
+            )
+            for item in items
+        ]
+        tasks: List[Optional[asyncio.Task]] = [None] * len(requests)
+        for i in sorted(range(len(requests)), key=lambda i: len(requests[i].user_input)):
+            requests[i].trace = traces[i] if traces is not None else None
+            tasks[i] = asyncio.create_task(self._generate_in_session(requests[i], items[i].get("session_id")))
+        return tasks
+
+    async def _open_session(self, request: GenerationRequest, session_id: str) -> Optional[Session]:
+        """Put the session's history on `request`, re-tokenizing turns kept from before a model swap"""
+        backend = request.backend or self.backend
+        if not self.sessions.enabled or backend.context_window() <= 0:
+            return None
+        session = self.sessions.get(session_id)
+        stale = session.stale(request.model_version)
+        if stale:
+            ids = await asyncio.get_running_loop().run_in_executor(
+                self.executor, lambda: [backend.encode_exchange(turn.user_input, turn.answer) for turn in stale]
+            )
+            self.sessions.reencode(session, stale, ids, request.model_version)
+        request.history = session.history(request.model_version)
+        return session
+
+    def _close_session(self, session: Optional[Session], request: GenerationRequest, answer: str):
+        if session is not None and request.exchange is not None:
+            window = (request.backend or self.backend).context_window()
+            self.sessions.append(session, request.user_input, answer, request.exchange, request.model_version, window)
+
+    async def _generate_in_session(self, request: GenerationRequest, session_id: Optional[str]) -> str:
+        if session_id is None:
+            return await self._generate(request)
+        session = await self._open_session(request, session_id)
+        response = await self._generate(request)
+        self._close_session(session, request, response)
+        return response
+
+    async def _generate(self, request: GenerationRequest) -> str:
+        try:
+            return await asyncio.wait_for(self._generate_cached(request), request.remaining())
+        except asyncio.TimeoutError:
+            record_generation_cancelled("deadline")
+            raise DeadlineExceeded("Response not ready before the request deadline")
+        except asyncio.CancelledError:
+            record_generation_cancelled("disconnect")
+            raise
+
+    async def _generate_cached(self, request: GenerationRequest) -> str:
+        if self.response_cache.max_entries <= 0 or request.history is not None:
+            return await self._generate_uncached(request)
+
+        key = ResponseCache.make_key(
+            request.user_input, request.max_tokens, request.temperature, request.top_p, request.adapter, request.model_version
+        )
+        return await self.response_cache.get_or_compute(key, lambda: self._generate_uncached(request))
+
+    async def _generate_uncached(self, request: GenerationRequest) -> str:
+        if self.semantic_cache is None or request.history is not None:
+            return await self._submit(request)
+
+        params = (request.model_version, request.max_tokens, request.adapter, request.sampling_key)
+        cached = await self.semantic_batcher.submit((request.user_input, params))
+        if cached is not None:
+            return cached
+
+        response = await self._submit(request)
+        self.semantic_cache.put(request.user_input, params, response)
+        return response
+
+    async def _submit(self, request: GenerationRequest) -> str:
+        request.submitted_at = time.perf_counter()
+        try:
+            return await self.batcher.submit(request)
+        except asyncio.CancelledError:
+            # Still queued: the batcher skips it; already generating: its row stops at the next step
+            request.cancelled = True
+            raise
+
+    def _generate_streaming(self, request: GenerationRequest, emit: Callable[[object], None]):
+        """
+        Run one generation on the executor, passing text chunks to `emit`, then None when
+        done or the exception that stopped it
+        """
+        try:
+            if not self.is_model_loaded():
+                raise RuntimeError("Model is not loaded")
+            if request.cancelled:
+                return
+
+            request.record({"queue": time.perf_counter() - request.submitted_at})
+            self._ground(request)
+            (request.backend or self.backend).stream(request, emit)
+            emit(None)
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            emit(e)
+
+    async def astream(
+        self,
+        user_input: str,
+        max_tokens: int = None,
+        temperature: float = None,
+        top_p: float = None,
+        deadline_ms: int = None,
+        adapter: str = None,
+        lease: Optional[ModelLease] = None,
+        session_id: str = None
+    ) -> AsyncIterator[str]:
+        """
+        Yield response text chunks as the model produces them.
+        Records time-to-first-token and the latency between consecutive chunks. Raises
+        DeadlineExceeded when the deadline passes mid-stream; closing the iterator early
+        (client disconnect) stops the generation at its next decode step.
+        """
+        request = self._make_request(user_input, max_tokens, temperature, top_p, deadline_ms, adapter, lease)
+        session = await self._open_session(request, session_id) if session_id is not None else None
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def emit(item):
+            # The loop is only closed at shutdown, when nobody reads the stream anyway
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        start_time = time.perf_counter()
+        request.submitted_at = start_time
+        generation = loop.run_in_executor(self.executor, self._generate_streaming, request, emit)
+
+        last_time = None
+        finished = False
+        chunks: List[str] = []
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(queue.get(), request.remaining())
+                except asyncio.TimeoutError:
+                    record_generation_cancelled("deadline")
+                    raise DeadlineExceeded("Request deadline passed while streaming")
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+
+                now = time.perf_counter()
+                if last_time is None:
+                    record_time_to_first_token(now - start_time)
+                else:
+                    record_inter_token_latency(now - last_time)
+                last_time = now
+                chunks.append(chunk)
+                yield chunk
+            finished = True
+        except (GeneratorExit, asyncio.CancelledError):
+            record_generation_cancelled("disconnect")
+            raise
+        finally:
+            if not finished:
+                request.cancelled = True
+
+        await generation
+        self._close_session(session, request, "".join(chunks).strip())
+
+    def _make_request(
+        self, user_input, max_tokens, temperature, top_p, deadline_ms=None, adapter=None, lease=None
+    ) -> GenerationRequest:
+        model = lease.model if lease is not None else self.model
+        if adapter is not None and adapter not in model.backend.adapters():
+            available = ", ".join(model.backend.adapters()) or "none"
+            raise UnknownAdapter(f"Unknown adapter {adapter!r} (available: {available})")
+        deadline_ms = deadline_ms or settings.request_deadline_ms
+        return GenerationRequest(
+            user_input=user_input,
+            max_tokens=max_tokens or DEFAULT_MAX_TOKENS,
+            temperature=DEFAULT_TEMPERATURE if temperature is None else temperature,
+            top_p=DEFAULT_TOP_P if top_p is None else top_p,
+            trace=current_trace(),
+            deadline=time.perf_counter() + deadline_ms / 1000 if deadline_ms else None,
+            adapter=adapter,
+            backend=model.backend,
+            model_version=model.version,
+        )
+
+    def get_chat_history(self, session_id: str, limit: int = 50) -> Optional[List[dict]]:
+        """Last `limit` messages of a session (role, content, timestamp), None for an unknown or expired one"""
+        return self.sessions.messages(session_id, limit)
+
+chatService = ChatService()
@@ -0,0 +1,150 @@
+import os
+from typing import Dict
+
+from pydantic import BaseModel, ConfigDict
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _env_mapping(name: str) -> Dict[str, str]:
+    """`key=value,key2=value2` → dict (empty when unset)"""
+    mapping = {}
+    for item in os.getenv(name, "").split(","):
+        key, sep, value = item.partition("=")
+        if item.strip():
+            if not sep or not key.strip() or not value.strip():
+                raise ValueError(f"{name}: expected name=value, got {item!r}")
+            mapping[key.strip()] = value.strip()
+    return mapping
+
+
+class ServiceConfig(BaseModel):
+    """Runtime configuration of the chat service, read from environment variables"""
+
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_path: str = ""
+    # Reported as model_used; /model/load swaps in a new version at runtime
+    model_version: str = "custom-llama"
+    # Registry (S3) downloads of /model/load land in <model_download_dir>/<version>
+    model_download_dir: str = "downloaded_model"
+
+    # transformers (the model at model_path) or simulated (no weights, see backends.simulated)
+    inference_backend: str = "transformers"
+    # Simulated backend costs: per batch and per prompt token prefill, per decode step, share spent busy on CPU
+    sim_prefill_ms: float = 50.0
+    sim_prefill_ms_per_token: float = 0.2
+    sim_token_ms: float = 5.0
+    sim_batch_overhead: float = 0.1
+    sim_cpu_fraction: float = 0.0
+
+    # Memory-map safetensors shards instead of copying them (weights keep their saved dtype)
+    weights_mmap: bool = False
+
+    # auto, float32, float16, bfloat16 or int8 (dynamic quantization of the linear layers, CPU only)
+    model_precision: str = "auto"
+
+    # LoRA adapters registered on the base model, name -> adapter directory; requests pick one by name
+    lora_adapters: Dict[str, str] = {}
+
+    # Serving topology (see topology.py); 0 → derive from the pod CPU limit
+    # Worker processes forked by `python -m src.server` after preloading the weights
+    web_workers: int = 0
+    port: int = 8000
+    # Inference executor threads per worker, and torch intra-op / inter-op threads per worker
+    inference_workers: int = 0
+    torch_threads: int = 0
+    torch_interop_threads: int = 0
+
+    # Tokens generated by the startup warm-up run
+    warmup_max_tokens: int = 8
+
+    # Micro-batching: a batch closes after batch_window_ms or batch_max_size requests
+    batch_max_size: int = 8
+    batch_window_ms: float = 5.0
+
+    # Reuse the past-key-values of the fixed system prompt across requests
+    prefix_cache_enabled: bool = True
+
+    # Semantic cache for paraphrased questions: 0 capacity disables it (off unless configured)
+    semantic_cache_capacity: int = 0
+    semantic_cache_threshold: float = 0.9
+    semantic_cache_dim: int = 256
+
+    # BM25 index over the statute passages (built with `python -m src.retrieval build`); empty disables grounding
+    retrieval_index_path: str = ""
+    retrieval_top_k: int = 2
+
+    # Response cache: 0 entries disables it
+    response_cache_max_entries: int = 1024
+    response_cache_max_mb: float = 32.0
+    response_cache_ttl_seconds: float = 600.0
+
+    # Admission control: estimated tokens (prompt + max_tokens) in flight before new requests get 429; 0 disables it
+    admission_max_inflight_tokens: int = 8192
+    # Share of the budget only priority callers (X-Internal-Token) may use
+    admission_priority_reserve: float = 0.2
+    # Also required by /model/load, which is disabled while it is empty
+    internal_api_token: str = ""
+
+    # Multi-turn sessions: memory cap of the in-memory store (0 disables sessions) and idle expiry
+    session_store_max_mb: float = 64.0
+    session_idle_seconds: float = 1800.0
+
+    # Seconds between samples of the process memory/CPU gauges (read by /ready and /metrics); 0 samples once at startup
+    system_metrics_interval_seconds: float = 15.0
+
+    # Deadline of a generation when the request sets none (504 once it passes); 0 disables it
+    request_deadline_ms: int = 60000
+
+    @classmethod
+    def from_env(cls) -> "ServiceConfig":
+        return cls(
+            model_path=os.getenv("MODEL_PATH", ""),
+            model_version=os.getenv("MODEL_VERSION", "custom-llama"),
+            model_download_dir=os.getenv("MODEL_DOWNLOAD_DIR", "downloaded_model"),
+            inference_backend=os.getenv("INFERENCE_BACKEND", "transformers"),
+            sim_prefill_ms=_env_float("SIM_PREFILL_MS", 50.0),
+            sim_prefill_ms_per_token=_env_float("SIM_PREFILL_MS_PER_TOKEN", 0.2),
+            sim_token_ms=_env_float("SIM_TOKEN_MS", 5.0),
+            sim_batch_overhead=_env_float("SIM_BATCH_OVERHEAD", 0.1),
+            sim_cpu_fraction=_env_float("SIM_CPU_FRACTION", 0.0),
+            weights_mmap=os.getenv("WEIGHTS_MMAP", "false").lower() == "true",
+            model_precision=os.getenv("MODEL_PRECISION", "auto").lower(),
+            lora_adapters=_env_mapping("LORA_ADAPTERS"),
+            web_workers=_env_int("WEB_WORKERS", 0),
+            port=_env_int("PORT", 8000),
+            inference_workers=_env_int("INFERENCE_WORKERS", 0),
+            torch_threads=_env_int("TORCH_THREADS", 0),
+            torch_interop_threads=_env_int("TORCH_INTEROP_THREADS", 0),
+            warmup_max_tokens=_env_int("WARMUP_MAX_TOKENS", 8),
+            batch_max_size=_env_int("BATCH_MAX_SIZE", 8),
+            batch_window_ms=_env_float("BATCH_WINDOW_MS", 5.0),
+            prefix_cache_enabled=os.getenv("PREFIX_CACHE_ENABLED", "true").lower() == "true",
+            semantic_cache_capacity=_env_int("SEMANTIC_CACHE_CAPACITY", 0),
+            semantic_cache_threshold=_env_float("SEMANTIC_CACHE_THRESHOLD", 0.9),
+            semantic_cache_dim=_env_int("SEMANTIC_CACHE_DIM", 256),
+            retrieval_index_path=os.getenv("RETRIEVAL_INDEX_PATH", ""),
+            retrieval_top_k=_env_int("RETRIEVAL_TOP_K", 2),
+            response_cache_max_entries=_env_int("RESPONSE_CACHE_MAX_ENTRIES", 1024),
+            response_cache_max_mb=_env_float("RESPONSE_CACHE_MAX_MB", 32.0),
+            response_cache_ttl_seconds=_env_float("RESPONSE_CACHE_TTL_SECONDS", 600.0),
+            admission_max_inflight_tokens=_env_int("ADMISSION_MAX_INFLIGHT_TOKENS", 8192),
+            admission_priority_reserve=_env_float("ADMISSION_PRIORITY_RESERVE", 0.2),
+            internal_api_token=os.getenv("INTERNAL_API_TOKEN", ""),
+            request_deadline_ms=_env_int("REQUEST_DEADLINE_MS", 60000),
+            session_store_max_mb=_env_float("SESSION_STORE_MAX_MB", 64.0),
+            session_idle_seconds=_env_float("SESSION_IDLE_SECONDS", 1800.0),
+            system_metrics_interval_seconds=_env_float("SYSTEM_METRICS_INTERVAL_SECONDS", 15.0),
+        )
+
+
+settings = ServiceConfig.from_env()
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field, field_validator
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import Any, Dict, List, Optional
 from enum import Enum
 from datetime import datetime
 import uuid
@@ -17,8 +17,10 @@ class MessageDTO(BaseModel):
 
 class ChatRequestDTO(BaseModel):
     message: str = Field(..., min_length=1, max_length=1000, description="User's question or message")
-    # session_id: Optional[str] = Field(default_factory=lambda: str(uuid.uuid4()), description="Session ID for conversation tracking")
+    session_id: Optional[str] = Field(default=None, min_length=1, max_length=128, description="Session ID for conversation tracking; the answer follows the session's earlier turns (stateless when omitted)")
     max_tokens: Optional[int] = Field(default=200, ge=1, le=1000, description="Maximum tokens to generate")
+    deadline_ms: Optional[int] = Field(default=None, ge=1, le=600000, description="Give up with 504 if the response is not done within this many milliseconds (server default otherwise)")
+    adapter: Optional[str] = Field(default=None, min_length=1, max_length=64, description="Registered LoRA adapter to answer with (base model when omitted)")
     # temperature: Optional[float] = Field(default=0.7, ge=0.0, le=2.0, description="Temperature for text generation")
 
     @field_validator('message')
@@ -33,6 +35,45 @@ class ChatResponseDTO(BaseModel):
     timestamp: float = Field(default_factory=lambda: time.time())
     response_time: Optional[float] = None
     model_used: str = "custom-llama"
+    session_id: Optional[str] = None
+
+class ChatStreamChunkDTO(BaseModel):
+    """One NDJSON line of /generate/stream: a token chunk, or the final done (or error) line"""
+    # Set on token chunks only
+    token: Optional[str] = None
+    done: bool = False
+    error: Optional[str] = None
+    response_time: Optional[float] = None
+    model_used: Optional[str] = None
+    session_id: Optional[str] = None
+
+class BatchChatRequestDTO(BaseModel):
+    """Many questions in one call; each item has the ChatRequestDTO fields and is validated on its own"""
+    items: List[Dict[str, Any]] = Field(..., min_length=1, max_length=256, description="ChatRequestDTO-style items")
+    stream: bool = Field(default=False, description="Stream one NDJSON line per item as it finishes")
+
+class BatchChatItemDTO(BaseModel):
+    """Result of one batch item; `index` is its position in the request"""
+    index: int
+    response: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchChatResponseDTO(BaseModel):
+    results: List[BatchChatItemDTO]
+    response_time: Optional[float] = None
+    model_used: str = "custom-llama"
+
+class ChatHistoryResponseDTO(BaseModel):
+    session_id: str
+    messages: List[MessageDTO]
+
+class ModelLoadRequestDTO(BaseModel):
+    """Hot swap to another model version; without a source the current MODEL_PATH is reloaded"""
+    model_config = ConfigDict(protected_namespaces=())
+
+    version: Optional[str] = Field(default=None, min_length=1, max_length=128, description="Version label reported as model_used (derived from the source when omitted)")
+    model_path: Optional[str] = Field(default=None, min_length=1, description="Local model directory")
+    s3_prefix: Optional[str] = Field(default=None, min_length=1, description="Registry artifact prefix in the model bucket, e.g. models/health-llm/<run id>")
 
 class HealthResponseDTO(BaseModel):
     status: str
@@ -4,6 +4,7 @@ from fastapi.responses import JSONResponse
 import uvicorn
 from loguru import logger
 from contextlib import asynccontextmanager
+import asyncio
 import os
 import sys
 import socket
@@ -14,25 +15,47 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from .api import Router as ChatRouter
 from .chat_service import chatService
+from .config import settings
+from .topology import serving_topology
+from .utils import prometheus_multiproc
+from .utils.tracing import TraceMiddleware, configure_logging
+from monitor.metrics import set_model_status, update_system_metrics
+
+configure_logging()
+
+
+async def sample_system_metrics(interval: float):
+    """Refresh the memory/CPU gauges every `interval` seconds; probes and scrapes read the cached values"""
+    while True:
+        await asyncio.sleep(interval)
+        update_system_metrics()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Handle startup and shutdown events"""
     logger.info("Starting QA Chatbot service...")
+    logger.info(f"Serving topology: {serving_topology.summary()}")
 
-    # Load model if needed (uncomment để load model khi startup)
-    # try:
-    #     await chatService.load_model()
-    #     logger.info("Model loaded on startup")
-    # except Exception as e:
-    #     logger.warning(f"Could not load model on startup: {e}")
-    #     logger.info("Model will be loaded on first request")
+    # Load and warm up the model in the background; /ready reports not-ready until it finishes
+    set_model_status(False)
+    chatService.start_background()
+
+    update_system_metrics()
+    sampler = None
+    if settings.system_metrics_interval_seconds > 0:
+        sampler = asyncio.create_task(
+            sample_system_metrics(settings.system_metrics_interval_seconds), name="system-metrics"
+        )
 
     yield
 
     # Shutdown
     logger.info("Shutting down QA Chatbot service...")
+    if sampler is not None:
+        sampler.cancel()
+    await chatService.shutdown()
+    prometheus_multiproc.mark_dead(os.getpid())
 
 
 app = FastAPI(
@@ -56,10 +79,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Trace ID per request (X-Trace-ID, loguru context) and request metrics for the chat endpoints
+app.add_middleware(TraceMiddleware, traced_paths=["/generate", "/generate/stream", "/generate/batch"])
+
 # Include routers
 # app.include_router(ChatRouter, prefix="/api/v1/chat", tags=["chat"])
+app.include_router(ChatRouter, tags=["chat"])
 
-# Health check endpoint
+# Liveness endpoint: constant time, never touches the model
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
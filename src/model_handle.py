@@ -0,0 +1,70 @@
+import asyncio
+import time
+from typing import Optional
+
+from .backends import InferenceBackend
+
+
+class ModelLease:
+    """Keeps one model version in service for a request; release exactly once when its work is done"""
+
+    __slots__ = ("model", "released")
+
+    def __init__(self, model: "ModelHandle"):
+        self.model = model
+        self.released = False
+
+    @property
+    def version(self) -> str:
+        return self.model.version
+
+    @property
+    def backend(self) -> InferenceBackend:
+        return self.model.backend
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.model._release()
+
+
+class ModelHandle:
+    """
+    One loaded model version. ChatService points new requests at its current handle; a hot
+    swap replaces the handle, and the old one is unloaded once every lease on it is released.
+    Leases are taken and released on the event loop, so no lock.
+    """
+
+    def __init__(self, backend: InferenceBackend, version: str, source: str = ""):
+        self.backend = backend
+        self.version = version
+        self.source = source
+        self.loaded_at = time.time()
+        self.inflight = 0
+        self.retired = False
+        self._drained: Optional[asyncio.Event] = None
+
+    def lease(self) -> ModelLease:
+        self.inflight += 1
+        return ModelLease(self)
+
+    def _release(self):
+        self.inflight -= 1
+        if self.inflight == 0 and self._drained is not None:
+            self._drained.set()
+
+    async def drain(self):
+        """Wait until every lease on this handle is released; the caller has already swapped it out"""
+        self.retired = True
+        if self.inflight > 0:
+            self._drained = asyncio.Event()
+            await self._drained.wait()
+
+    def describe(self) -> dict:
+        return {
+            "version": self.version,
+            "source": self.source,
+            "loaded_at": self.loaded_at,
+            "inflight": self.inflight,
+            **self.backend.describe(),
+        }
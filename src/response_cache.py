@@ -0,0 +1,144 @@
+import asyncio
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+from monitor.metrics import record_cache_eviction, record_cache_lookup, set_cache_size
+
+
+@dataclass
+class _Entry:
+    value: str
+    expires_at: float
+    size: int
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of generated responses, bounded by entry count and bytes.
+
+    `get_or_compute` coalesces concurrent misses for the same key: only one
+    generation runs and every waiter receives its result. The generation is
+    cancelled once every waiter has been cancelled.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 32 * 1024 * 1024, ttl_seconds: float = 600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(
+        message: str, max_tokens: int, temperature: float, top_p: float, adapter: str = None, version: str = ""
+    ) -> tuple:
+        """Cache key of a request; `message` is expected already stripped by ChatRequestDTO"""
+        return (message, max_tokens, temperature, top_p, adapter, version)
+
+    @staticmethod
+    def _sizeof(key: Hashable, value: str) -> int:
+        return sys.getsizeof(value) + sys.getsizeof(key)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key, reason="expired")
+            return None
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def put(self, key: Hashable, value: str):
+        if self.max_entries <= 0:
+            return
+        size = self._sizeof(key, value)
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key).size
+        self._entries[key] = _Entry(value=value, expires_at=time.monotonic() + self.ttl_seconds, size=size)
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest, reason="capacity")
+        set_cache_size(len(self._entries), self._bytes)
+
+    def _remove(self, key: Hashable, reason: str):
+        self._bytes -= self._entries.pop(key).size
+        self.evictions += 1
+        record_cache_eviction(reason)
+        set_cache_size(len(self._entries), self._bytes)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        set_cache_size(0, 0)
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[str]]) -> str:
+        """Return the cached value for `key`, or run `compute` once for all concurrent callers"""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            record_cache_lookup("hit")
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            record_cache_lookup("coalesced")
+        else:
+            self.misses += 1
+            record_cache_lookup("miss")
+            # A separate task so one caller disconnecting does not cancel the others' result
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_computed(key, t))
+
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Last waiter gone (deadline or disconnect): nobody will read the result
+            if self._waiters[key] == 1 and not task.done():
+                task.cancel()
+                # A caller arriving now starts a fresh generation instead of joining the cancelled one
+                self._inflight.pop(key, None)
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def _on_computed(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,194 @@
+"""
+BM25 retrieval over the ALQAC statute passages.
+
+The index is a CSR-style inverted index: one concatenated array of document ids
+and one of precomputed BM25 term weights, sliced per term by an offsets array.
+It is persisted to a single file whose arrays are memory-mapped read-only on load,
+so pods open it without rebuilding and share its pages through the page cache.
+
+Build:  python -m src.retrieval build ALQAC.csv data/alqac.bm25
+Query:  python -m src.retrieval query data/alqac.bm25 "tù chung thân"
+"""
+import csv
+import json
+import re
+import sys
+import unicodedata
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+MAGIC = b"BM25IDX1"
+ALIGNMENT = 64
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Vietnamese-aware tokenization: NFC-normalised, lowercased syllables (diacritics kept,
+    they distinguish words) plus adjacent-syllable bigrams, since most Vietnamese words
+    span two syllables ("trách nhiệm", "hình sự").
+    """
+    syllables = _WORD_RE.findall(unicodedata.normalize("NFC", text).lower())
+    return syllables + [f"{a}_{b}" for a, b in zip(syllables, syllables[1:])]
+
+
+def load_passages(csv_path: str) -> List[str]:
+    """Distinct `context` passages of an ALQAC-style CSV, in file order"""
+    with open(csv_path, encoding="utf-8-sig", newline="") as f:
+        contexts = (row["context"].strip() for row in csv.DictReader(f))
+        return list(dict.fromkeys(c for c in contexts if c))
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed passage collection"""
+
+    def __init__(self, vocab: dict, offsets: np.ndarray, doc_ids: np.ndarray, weights: np.ndarray,
+                 idf: np.ndarray, doc_lengths: np.ndarray, text_offsets: np.ndarray, text_blob: np.ndarray,
+                 k1: float, b: float):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.idf = idf
+        self.doc_lengths = doc_lengths
+        self.text_offsets = text_offsets
+        self.text_blob = text_blob
+        self.k1 = k1
+        self.b = b
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_lengths)
+
+    @classmethod
+    def build(cls, passages: Iterable[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        passages = list(passages)
+        vocab: dict = {}
+        term_ids, doc_ids, counts = [], [], []
+        doc_lengths = np.zeros(len(passages), dtype=np.float32)
+
+        for doc_id, passage in enumerate(passages):
+            tokens = tokenize(passage)
+            doc_lengths[doc_id] = len(tokens)
+            ids = np.fromiter((vocab.setdefault(t, len(vocab)) for t in tokens), dtype=np.int64, count=len(tokens))
+            unique, tf = np.unique(ids, return_counts=True)
+            term_ids.append(unique)
+            counts.append(tf)
+            doc_ids.append(np.full(len(unique), doc_id, dtype=np.int32))
+
+        term_ids = np.concatenate(term_ids) if term_ids else np.zeros(0, dtype=np.int64)
+        doc_ids = np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int32)
+        counts = np.concatenate(counts).astype(np.float32) if counts else np.zeros(0, dtype=np.float32)
+
+        # Group postings by term (stable, so doc ids stay sorted within a term)
+        order = np.argsort(term_ids, kind="stable")
+        term_ids, doc_ids, counts = term_ids[order], doc_ids[order], counts[order]
+
+        df = np.bincount(term_ids, minlength=len(vocab))
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=offsets[1:])
+
+        n = len(passages)
+        idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        # Term-frequency saturation and length normalisation are query independent: fold them in now
+        avgdl = float(doc_lengths.mean()) if n else 0.0
+        norm = k1 * (1 - b + b * doc_lengths[doc_ids] / max(avgdl, 1e-9))
+        weights = (counts * (k1 + 1) / (counts + norm)).astype(np.float32)
+
+        encoded = [p.encode("utf-8") for p in passages]
+        text_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=text_offsets[1:])
+        text_blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        return cls(vocab, offsets, doc_ids, weights, idf, doc_lengths, text_offsets, text_blob, k1, b)
+
+    def passage(self, doc_id: int) -> str:
+        start, end = self.text_offsets[doc_id], self.text_offsets[doc_id + 1]
+        return self.text_blob[start:end].tobytes().decode("utf-8")
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[int, float]]:
+        """Top-k (doc_id, score) pairs for a query, best first"""
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not term_ids or self.num_docs == 0 or k <= 0:
+            return []
+
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # Doc ids are unique within a posting list, so fancy-index accumulation is safe
+            scores[self.doc_ids[start:end]] += self.idf[term_id] * self.weights[start:end]
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(d), float(scores[d])) for d in top if scores[d] > 0]
+
+    def search_passages(self, query: str, k: int = 3) -> List[str]:
+        return [self.passage(doc_id) for doc_id, _ in self.search(query, k)]
+
+    _ARRAYS = ("offsets", "doc_ids", "weights", "idf", "doc_lengths", "text_offsets", "text_blob")
+
+    def save(self, path: str):
+        """Write the index as a header followed by 64-byte aligned raw arrays"""
+        arrays, offset = {}, 0
+        for name in self._ARRAYS:
+            array = np.ascontiguousarray(getattr(self, name))
+            arrays[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+        vocab = sorted(self.vocab, key=self.vocab.get)
+        header = json.dumps({"k1": self.k1, "b": self.b, "vocab": vocab, "arrays": arrays}, ensure_ascii=False).encode("utf-8")
+        data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+        with open(path, "wb") as f:
+            f.write(MAGIC)
+            f.write(np.uint64(len(header)).tobytes())
+            f.write(header)
+            for name in self._ARRAYS:
+                f.seek(data_start + arrays[name]["offset"])
+                f.write(np.ascontiguousarray(getattr(self, name)).tobytes())
+            f.truncate(data_start + offset)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Open a saved index; arrays are read-only memory maps of the file"""
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a BM25 index")
+            header_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        data_start = -(-(len(MAGIC) + 8 + header_len) // ALIGNMENT) * ALIGNMENT
+
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            shape = tuple(spec["shape"])
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=spec["dtype"])
+                continue
+            mapped = np.memmap(path, dtype=spec["dtype"], mode="r", offset=data_start + spec["offset"], shape=shape)
+            # Plain ndarray view over the mapping: slicing a memmap subclass is measurably slower per term
+            arrays[name] = mapped.view(np.ndarray)
+
+        vocab = {term: i for i, term in enumerate(header["vocab"])}
+        return cls(vocab, k1=header["k1"], b=header["b"], **arrays)
+
+
+def _main(argv: List[str]):
+    if len(argv) == 3 and argv[0] == "build":
+        passages = load_passages(argv[1])
+        BM25Index.build(passages).save(argv[2])
+        print(f"Indexed {len(passages)} passages → {argv[2]}")
+    elif len(argv) >= 3 and argv[0] == "query":
+        index = BM25Index.load(argv[1])
+        for doc_id, score in index.search(" ".join(argv[2:])):
+            print(f"[{doc_id}] {score:.3f} {index.passage(doc_id)[:120]!r}")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
@@ -0,0 +1,205 @@
+import re
+import threading
+import unicodedata
+import zlib
+from typing import FrozenSet, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from monitor.metrics import record_semantic_cache_lookup, set_semantic_cache_size
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_NUMBER_RE = re.compile(r"\d+")
+# Politeness and filler syllables that do not change what is asked ("... là gì vậy ạ?")
+_FILLER_WORDS = frozenset({"à", "ạ", "ơi", "nhé", "nhỉ", "hả", "vậy", "thế", "là", "thì", "xin", "hỏi", "tôi"})
+# Phrases that name the same thing, folded onto one spelling before content words are compared
+_PHRASE_ALIASES = {("án", "tù"): "tù", ("phạt", "tù"): "tù"}
+
+
+def content_words(text: str) -> List[str]:
+    """
+    Words of a question that carry its meaning, in order: lowercased syllables without
+    fillers, with aliased phrases folded ("Án tù chung thân là gì vậy?" -> tù chung thân gì)
+    """
+    words = _WORD_RE.findall(unicodedata.normalize("NFC", text).lower())
+    folded = []
+    i = 0
+    while i < len(words):
+        alias = _PHRASE_ALIASES.get(tuple(words[i:i + 2]))
+        folded.append(alias or words[i])
+        i += 2 if alias else 1
+    return [w for w in folded if w not in _FILLER_WORDS]
+
+
+class HashedNgramEmbedder:
+    """
+    Offline CPU embedder: signed feature hashing of character n-grams and words
+    into a fixed-size, L2-normalised vector. Uses crc32 so vectors are stable across processes.
+    """
+
+    def __init__(self, dim: int = 256, ngram_range: Tuple[int, int] = (3, 4)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def _features(self, text: str) -> List[str]:
+        words = _WORD_RE.findall(unicodedata.normalize("NFC", text).lower())
+        padded = f" {' '.join(words)} "
+        features = list(words)
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def embed(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(
+            (zlib.crc32(f.encode("utf-8")) for f in self._features(text)),
+            dtype=np.uint32
+        )
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        vector = np.bincount(hashes % self.dim, weights=signs, minlength=self.dim).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self.embed(t) for t in texts])
+
+
+class SemanticCache:
+    """
+    Cache of responses for near-duplicate questions.
+
+    Questions are embedded by their content words, so fillers neither dilute nor fake a
+    match. Embeddings live in a preallocated (capacity, dim) matrix; a lookup is one matrix
+    product against all filled rows, and the best row whose cosine similarity reaches
+    `threshold` and whose question has the same set of content words is a hit. The n-gram
+    cosine alone scores "trách nhiệm hình sự" and "trách nhiệm dân sự" as near-duplicates;
+    the word sets keep them apart, while word order may still differ. Entries
+    only match requests with the same generation params and the same numbers ("dưới 16 tuổi"
+    must never answer "dưới 18 tuổi"). When full, the least recently used row is overwritten.
+    """
+
+    def __init__(self, capacity: int = 10000, threshold: float = 0.9, embedder: Optional[HashedNgramEmbedder] = None):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.embedder = embedder or HashedNgramEmbedder()
+
+        self._matrix = np.zeros((capacity, self.embedder.dim), dtype=np.float32)
+        self._param_ids = np.full(capacity, -1, dtype=np.int32)
+        self._last_used = np.zeros(capacity, dtype=np.int64)
+        self._values: List[Optional[str]] = [None] * capacity
+        self._words: List[Optional[FrozenSet[str]]] = [None] * capacity
+        self._size = 0
+        self._tick = 0
+        # partition -> id compared against _param_ids, with the rows holding each id; an id is
+        # freed (and reused) when its last row is overwritten, so these stay within capacity
+        self._params: dict = {}
+        self._partitions: dict = {}
+        self._param_rows: dict = {}
+        self._free_ids: List[int] = []
+        # Lookups run on an executor thread while inserts happen on the event loop
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _partition(question: str, params: Hashable) -> Hashable:
+        return (params, tuple(_NUMBER_RE.findall(question)))
+
+    def _acquire_param_id(self, partition: Hashable) -> int:
+        """Id of `partition` for one more row"""
+        param_id = self._params.get(partition)
+        if param_id is None:
+            param_id = self._free_ids.pop() if self._free_ids else len(self._params)
+            self._params[partition] = param_id
+            self._partitions[param_id] = partition
+            self._param_rows[param_id] = 0
+        self._param_rows[param_id] += 1
+        return param_id
+
+    def _release_param_id(self, param_id: int):
+        """A row with `param_id` was overwritten; forget the partition with its last row"""
+        self._param_rows[param_id] -= 1
+        if self._param_rows[param_id] == 0:
+            del self._param_rows[param_id]
+            del self._params[self._partitions.pop(param_id)]
+            self._free_ids.append(param_id)
+
+    def lookup_batch(self, queries: List[Tuple[str, Hashable]]) -> List[Optional[str]]:
+        """Cached response (or None) for each (question, params) pair"""
+        words = [content_words(q) for q, _ in queries]
+        embeddings = self.embedder.embed_batch([" ".join(w) for w in words])
+
+        with self._lock:
+            results: List[Optional[str]] = [None] * len(queries)
+            if self._size > 0:
+                # (size, dim) @ (dim, n) streams the matrix once in row order: ~2x faster than the transpose
+                scores = (self._matrix[:self._size] @ embeddings.T).T
+                wanted = np.array(
+                    [self._params.get(self._partition(q, p), -2) for q, p in queries],
+                    dtype=np.int32
+                )
+                scores[self._param_ids[:self._size][None, :] != wanted[:, None]] = -np.inf
+
+                for i in range(len(queries)):
+                    candidates = np.flatnonzero(scores[i] >= self.threshold)
+                    if len(candidates) == 0:
+                        continue
+                    wanted_words = frozenset(words[i])
+                    for row in candidates[np.argsort(-scores[i, candidates])]:
+                        if self._words[row] == wanted_words:
+                            self._tick += 1
+                            self._last_used[row] = self._tick
+                            results[i] = self._values[row]
+                            break
+
+        for result in results:
+            if result is None:
+                self.misses += 1
+                record_semantic_cache_lookup("miss")
+            else:
+                self.hits += 1
+                record_semantic_cache_lookup("hit")
+        return results
+
+    def lookup(self, question: str, params: Hashable = None) -> Optional[str]:
+        return self.lookup_batch([(question, params)])[0]
+
+    def put(self, question: str, params: Hashable, response: str):
+        words = content_words(question)
+        embedding = self.embedder.embed(" ".join(words))
+
+        with self._lock:
+            if self._size < self.capacity:
+                row = self._size
+                self._size += 1
+            else:
+                row = int(self._last_used.argmin())
+                self.evictions += 1
+
+            param_id = self._acquire_param_id(self._partition(question, params))
+            if self._param_ids[row] >= 0:
+                self._release_param_id(int(self._param_ids[row]))
+
+            self._tick += 1
+            self._matrix[row] = embedding
+            self._param_ids[row] = param_id
+            self._last_used[row] = self._tick
+            self._values[row] = response
+            self._words[row] = frozenset(words)
+            set_semantic_cache_size(self._size)
+
+    def stats(self) -> dict:
+        return {
+            "entries": self._size,
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "partitions": len(self._params),
+        }
@@ -0,0 +1,103 @@
+"""
+Preload-then-fork server entry point, an alternative to `uvicorn src.main:app`.
+
+The parent loads the weights once, binds the listening socket, then forks WEB_WORKERS
+uvicorn workers (derived from the CPU limit when 0, see topology.py) that accept on the
+shared socket. Weight pages are shared copy-on-write between the workers (and through the
+page cache with WEIGHTS_MMAP=true). Each worker builds its own prefix cache, executor and
+warm-up after the fork, because torch thread pools do not survive a fork. With several
+workers metrics switch to Prometheus multiprocess mode (see utils.prometheus_multiproc)
+so /metrics covers all of them.
+
+    WEB_WORKERS=2 WEIGHTS_MMAP=true python -m src.server
+"""
+import os
+import signal
+import socket
+import sys
+
+import uvicorn
+from loguru import logger
+
+from .config import settings
+from .topology import serving_topology
+from .utils import prometheus_multiproc
+
+# Before anything creates a metric: values are bound to the multiprocess files at creation
+prometheus_multiproc.prepare(serving_topology.web_workers)
+
+from .chat_service import chatService  # noqa: E402
+from .main import app  # noqa: E402
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _serve(sock: socket.socket):
+    server = uvicorn.Server(uvicorn.Config(app, log_level="info"))
+    server.run(sockets=[sock])
+
+
+def main():
+    logger.info(f"Serving topology: {serving_topology.summary()}")
+    try:
+        chatService.preload()
+    except Exception as e:
+        logger.warning(f"Could not preload model, workers will load it themselves: {e}")
+
+    sock = _bind("0.0.0.0", settings.port)
+    if serving_topology.web_workers <= 1:
+        _serve(sock)
+        return
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                _serve(sock)
+            finally:
+                os._exit(0)
+        children.add(pid)
+        logger.info(f"Forked worker {pid}")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(serving_topology.web_workers):
+        spawn()
+    # The parent only supervises from here on; its gauges (set while preloading) would skew the live ones
+    prometheus_multiproc.mark_dead(os.getpid())
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        prometheus_multiproc.mark_dead(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited with status {status}, restarting")
+            spawn()
+
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
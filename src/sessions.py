@@ -0,0 +1,169 @@
+import sys
+import time
+from array import array
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional
+
+from monitor.metrics import record_session_eviction, set_chat_sessions
+
+# Bookkeeping of a session and of a turn beyond their buffers (objects, dict slots)
+SESSION_OVERHEAD_BYTES = 512
+TURN_OVERHEAD_BYTES = 256
+
+
+@dataclass
+class _Turn:
+    user_input: str
+    answer: str
+    # Token ids of the whole exchange as the model version `version` sees it in a prompt
+    ids: array
+    version: str
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def size(self) -> int:
+        return (
+            TURN_OVERHEAD_BYTES + self.ids.itemsize * len(self.ids)
+            + sys.getsizeof(self.user_input) + sys.getsizeof(self.answer)
+        )
+
+
+@dataclass
+class Session:
+    session_id: str
+    turns: Deque[_Turn] = field(default_factory=deque)
+    tokens: int = 0
+    size: int = SESSION_OVERHEAD_BYTES
+    last_used: float = field(default_factory=time.monotonic)
+
+    def history(self, version: str) -> List[array]:
+        """Token ids per exchange, oldest first; call `stale` first so every turn has `version` ids"""
+        return [turn.ids for turn in self.turns if turn.version == version]
+
+    def stale(self, version: str) -> List[_Turn]:
+        """Turns tokenized by another model version (before a hot swap)"""
+        return [turn for turn in self.turns if turn.version != version]
+
+
+class SessionStore:
+    """
+    In-memory multi-turn chat sessions, bounded by idle time and total bytes.
+
+    Each finished exchange is kept as one compact int32 id buffer (plus its text, for the
+    history endpoint and re-tokenizing after a model swap), so a new turn only appends its
+    own ids; nothing earlier is re-templated or re-tokenized. Turns beyond the model's
+    context window can never reach a prompt and are dropped oldest first. Sessions idle for
+    `idle_seconds` expire, and the least recently used ones are evicted while the store is
+    over `max_bytes`. Everything runs on the event loop, so no lock.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, idle_seconds: float = 1800.0):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str, create: bool = True) -> Optional[Session]:
+        """The live session (touched as most recently used), a new one when `create`"""
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = self._sessions[session_id] = Session(session_id)
+            self._bytes += session.size
+            set_chat_sessions(len(self._sessions), self._bytes)
+        session.last_used = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def append(self, session: Session, user_input: str, answer: str, ids: List[int], version: str, max_tokens: int):
+        """Add a finished exchange, dropping the oldest turns past `max_tokens` (the context window)"""
+        if self._sessions.get(session.session_id) is not session:
+            # Evicted or deleted while its turn was generating
+            return
+        turn = _Turn(user_input, answer, array("i", ids), version)
+        session.turns.append(turn)
+        session.tokens += len(turn.ids)
+        session.size += turn.size
+        self._bytes += turn.size
+        while session.tokens > max_tokens and len(session.turns) > 1:
+            self._drop_turn(session)
+        session.last_used = time.monotonic()
+        self._sessions.move_to_end(session.session_id)
+        self._evict()
+
+    def reencode(self, session: Session, turns: List[_Turn], ids: List[List[int]], version: str):
+        """Replace the ids of `turns` with ones tokenized for `version`"""
+        for turn, new_ids in zip(turns, ids):
+            session.tokens -= len(turn.ids)
+            session.size -= turn.size
+            self._bytes -= turn.size
+            turn.ids, turn.version = array("i", new_ids), version
+            session.tokens += len(turn.ids)
+            session.size += turn.size
+            self._bytes += turn.size
+        set_chat_sessions(len(self._sessions), self._bytes)
+
+    def delete(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._bytes -= session.size
+        set_chat_sessions(len(self._sessions), self._bytes)
+        return True
+
+    def messages(self, session_id: str, limit: int = 50) -> Optional[List[dict]]:
+        """The last `limit` messages of a session as role/content dicts, None for an unknown session"""
+        session = self.get(session_id, create=False)
+        if session is None:
+            return None
+        messages = []
+        for turn in session.turns:
+            messages.append({"role": "user", "content": turn.user_input, "timestamp": turn.created_at})
+            messages.append({"role": "assistant", "content": turn.answer, "timestamp": turn.created_at})
+        return messages[-limit:] if limit > 0 else []
+
+    def _drop_turn(self, session: Session):
+        turn = session.turns.popleft()
+        session.tokens -= len(turn.ids)
+        session.size -= turn.size
+        self._bytes -= turn.size
+
+    def _remove(self, session_id: str, reason: str):
+        self._bytes -= self._sessions.pop(session_id).size
+        self.evictions += 1
+        record_session_eviction(reason)
+
+    def _expire(self):
+        deadline = time.monotonic() - self.idle_seconds
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if oldest.last_used > deadline:
+                break
+            self._remove(oldest_id, reason="idle")
+        set_chat_sessions(len(self._sessions), self._bytes)
+
+    def _evict(self):
+        self._expire()
+        # The session just used is last in LRU order and only goes when it alone is over the cap
+        while self._bytes > self.max_bytes and self._sessions:
+            self._remove(next(iter(self._sessions)), reason="memory")
+        set_chat_sessions(len(self._sessions), self._bytes)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,136 @@
+"""
+Serving topology: how the pod's CPU budget is split between worker processes, inference
+executor threads and torch threads.
+
+torch starts one intra-op thread per host core (and as many inter-op threads) no matter
+what the cgroup quota allows, so on a `cpu: 500m` pod on a 32-core node every generate call
+runs 32 threads on half a core, and several executor threads or forked workers multiply
+that. The layout is planned once from the quota so that
+
+    web_workers × inference_workers × intra_op_threads ≤ whole cores of the limit (at least 1)
+
+Every setting left at 0 is derived; explicit WEB_WORKERS, INFERENCE_WORKERS, TORCH_THREADS
+and TORCH_INTEROP_THREADS win. `python -m benchmarks.bench_topology` compares layouts.
+"""
+import math
+import os
+import sys
+from dataclasses import asdict, dataclass, field
+from typing import Optional, Tuple
+
+from .config import settings
+from .utils.cpu_limits import get_cgroup_cpu_quota, get_cpu_limit
+
+# Generate calls on small CPU batches stop scaling with threads well before this many cores
+# share one worker; past it the cores go to more workers (own GIL, event loop, tokenizer)
+CORES_PER_WORKER = 4
+# Executor threads per worker when it has the cores: a long stream does not hold up batches
+MAX_INFERENCE_WORKERS = 2
+
+
+@dataclass(frozen=True)
+class Topology:
+    cpu_limit: float
+    cgroup_quota: Optional[float]
+    host_cpus: int
+    web_workers: int
+    inference_workers: int
+    intra_op_threads: int
+    interop_threads: int
+    # Settings derived from the CPU limit rather than set explicitly
+    derived: Tuple[str, ...] = field(default=())
+
+    @property
+    def cores(self) -> int:
+        """Whole cores the layout is planned for"""
+        return max(1, math.floor(self.cpu_limit))
+
+    @property
+    def threads(self) -> int:
+        """Compute threads the layout runs at full load, over all workers"""
+        return self.web_workers * self.inference_workers * self.intra_op_threads
+
+    def summary(self) -> str:
+        quota = f"{self.cgroup_quota:g}" if self.cgroup_quota is not None else "none"
+        return (
+            f"{self.web_workers} worker(s) x {self.inference_workers} inference thread(s) x "
+            f"{self.intra_op_threads} torch thread(s) (+{self.interop_threads} inter-op) on "
+            f"{self.cpu_limit:g} CPU (cgroup quota {quota}, {self.host_cpus} host CPUs; "
+            f"derived: {', '.join(self.derived) or 'none'})"
+        )
+
+    def describe(self) -> dict:
+        return {**asdict(self), "derived": list(self.derived), "cores": self.cores, "threads": self.threads}
+
+    def torch_threads(self) -> Optional[dict]:
+        """Thread counts torch is actually using in this process (None without torch)"""
+        torch = sys.modules.get("torch")
+        if torch is None:
+            return None
+        return {"intra_op": torch.get_num_threads(), "interop": torch.get_num_interop_threads()}
+
+    def apply_torch(self):
+        """
+        Size torch's thread pools in this process. Call before the model runs, and again in a
+        forked worker; a no-op when no backend imported torch
+        """
+        torch = sys.modules.get("torch")
+        if torch is None:
+            return
+        torch.set_num_threads(self.intra_op_threads)
+        try:
+            torch.set_num_interop_threads(self.interop_threads)
+        except RuntimeError:
+            # Only settable once per process and before any inter-op work (a forked worker inherits it)
+            pass
+
+
+def plan_topology(
+    cpu_limit: Optional[float] = None,
+    web_workers: int = 0,
+    inference_workers: int = 0,
+    intra_op_threads: int = 0,
+    interop_threads: int = 0,
+) -> Topology:
+    """Layout for `cpu_limit` cores (the pod limit when None); non-zero arguments are kept as given"""
+    if cpu_limit is None:
+        cpu_limit = get_cpu_limit()
+    cores = max(1, math.floor(cpu_limit))
+    derived = []
+
+    if web_workers <= 0:
+        web_workers = max(1, cores // CORES_PER_WORKER)
+        derived.append("web_workers")
+    per_worker = max(1, cores // web_workers)
+
+    if inference_workers <= 0:
+        inference_workers = min(MAX_INFERENCE_WORKERS, per_worker)
+        derived.append("inference_workers")
+
+    if intra_op_threads <= 0:
+        intra_op_threads = max(1, per_worker // inference_workers)
+        derived.append("intra_op_threads")
+
+    if interop_threads <= 0:
+        # generate runs one op after another; extra inter-op threads only compete for the cores
+        interop_threads = 1
+        derived.append("interop_threads")
+
+    return Topology(
+        cpu_limit=cpu_limit,
+        cgroup_quota=get_cgroup_cpu_quota(),
+        host_cpus=os.cpu_count() or 1,
+        web_workers=web_workers,
+        inference_workers=inference_workers,
+        intra_op_threads=intra_op_threads,
+        interop_threads=interop_threads,
+        derived=tuple(derived),
+    )
+
+
+serving_topology = plan_topology(
+    web_workers=settings.web_workers,
+    inference_workers=settings.inference_workers,
+    intra_op_threads=settings.torch_threads,
+    interop_threads=settings.torch_interop_threads,
+)
@@ -0,0 +1,224 @@
+"""
+Collation for fine-tuning without padding every row to max_length.
+
+Both modes start from `tokenize_and_mask_batched(..., pad=False)` (unpadded `input_ids`,
+`labels` and `length` columns):
+
+- packing: `pack_examples` concatenates examples into rows of up to `max_length` tokens
+  (first-fit decreasing within each map batch) and writes `position_ids` that restart
+  at 0 for each example; `PackedCollator` turns them into a block-diagonal causal mask so
+  no token attends across an example boundary.
+- bucketing: `LengthBucketBatchSampler` groups examples of similar length into batches and
+  `DynamicPaddingCollator` pads each batch only to its own longest row.
+
+`padding_stats` measures the padding ratio and tokens per step of a sequence of batches.
+"""
+import random
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+def _as_array(values) -> np.ndarray:
+    return values if isinstance(values, np.ndarray) else np.asarray(values, dtype=np.int64)
+
+
+def pack_examples(batch, max_length: int) -> Dict[str, List[np.ndarray]]:
+    """
+    `Dataset.map(batched=True)` function: pack unpadded examples into rows of at most
+    `max_length` tokens. Labels keep their -100 prompt masks, and the first label of each
+    example is masked as well so no position is trained to predict across a boundary.
+    Examples longer than `max_length` are truncated.
+    """
+    examples = [
+        (_as_array(ids)[:max_length], _as_array(labels)[:max_length])
+        for ids, labels in zip(batch["input_ids"], batch["labels"])
+    ]
+
+    # First-fit decreasing: longest examples first, each into the first row with room
+    rows: List[List[int]] = []
+    free: List[int] = []
+    for index in sorted(range(len(examples)), key=lambda i: -len(examples[i][0])):
+        size = len(examples[index][0])
+        for row, space in enumerate(free):
+            if size <= space:
+                rows[row].append(index)
+                free[row] -= size
+                break
+        else:
+            rows.append([index])
+            free.append(max_length - size)
+
+    packed = {"input_ids": [], "labels": [], "position_ids": [], "length": []}
+    for row in rows:
+        labels = [examples[i][1].copy() for i in row]
+        for segment in labels:
+            segment[0] = -100
+        packed["input_ids"].append(np.concatenate([examples[i][0] for i in row]).astype(np.int32))
+        packed["labels"].append(np.concatenate(labels).astype(np.int32))
+        packed["position_ids"].append(np.concatenate([np.arange(len(examples[i][0])) for i in row]).astype(np.int32))
+        packed["length"].append(sum(len(examples[i][0]) for i in row))
+    return packed
+
+
+def _pad_rows(rows: Sequence, width: int, value: int, left: bool = False) -> torch.Tensor:
+    out = torch.full((len(rows), width), value, dtype=torch.long)
+    for i, row in enumerate(rows):
+        row = torch.as_tensor(_as_array(row), dtype=torch.long)
+        if left:
+            out[i, width - len(row):] = row
+        else:
+            out[i, :len(row)] = row
+    return out
+
+
+def _padded_width(lengths: Sequence[int], pad_to_multiple_of: Optional[int]) -> int:
+    width = max(lengths)
+    if pad_to_multiple_of:
+        width = -(-width // pad_to_multiple_of) * pad_to_multiple_of
+    return width
+
+
+class DynamicPaddingCollator:
+    """Pad a batch of unpadded examples to its longest row (rounded up to `pad_to_multiple_of`)"""
+
+    def __init__(self, pad_token_id: int, pad_to_multiple_of: Optional[int] = 8, padding_side: str = "right"):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.left = padding_side == "left"
+
+    def __call__(self, features: List[dict]) -> Dict[str, torch.Tensor]:
+        lengths = [len(f["input_ids"]) for f in features]
+        width = _padded_width(lengths, self.pad_to_multiple_of)
+        attention_mask = _pad_rows([np.ones(n, dtype=np.int64) for n in lengths], width, 0, self.left)
+        return {
+            "input_ids": _pad_rows([f["input_ids"] for f in features], width, self.pad_token_id, self.left),
+            "attention_mask": attention_mask,
+            "labels": _pad_rows([f["labels"] for f in features], width, -100, self.left),
+        }
+
+
+class PackedCollator:
+    """
+    Collate rows from `pack_examples`.
+
+    With `attn_implementation="flash_attention_2"` the model separates examples from
+    `position_ids` alone, so only those are passed. Otherwise (eager/sdpa) a 4D additive
+    mask of shape (batch, 1, seq, seq) is built: causal within each example, -inf across
+    examples and on padding. `dtype` must match the model's compute dtype.
+    """
+
+    def __init__(
+        self,
+        pad_token_id: int,
+        attn_implementation: str = "sdpa",
+        dtype: torch.dtype = torch.float32,
+        pad_to_multiple_of: Optional[int] = 8,
+    ):
+        self.pad_token_id = pad_token_id
+        self.flash = attn_implementation == "flash_attention_2"
+        self.dtype = dtype
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features: List[dict]) -> Dict[str, torch.Tensor]:
+        lengths = [len(f["input_ids"]) for f in features]
+        width = _padded_width(lengths, self.pad_to_multiple_of)
+        batch = {
+            "input_ids": _pad_rows([f["input_ids"] for f in features], width, self.pad_token_id),
+            "labels": _pad_rows([f["labels"] for f in features], width, -100),
+            # Padding gets position 0; it is masked out and unlabelled anyway
+            "position_ids": _pad_rows([f["position_ids"] for f in features], width, 0),
+        }
+        if self.flash:
+            return batch
+
+        # Segment id per token: a new segment starts wherever position_ids drops back to 0
+        positions = batch["position_ids"]
+        segments = torch.cumsum(positions == 0, dim=1)
+        real = torch.arange(width)[None, :] < torch.tensor(lengths)[:, None]
+        segments = torch.where(real, segments, -1)
+
+        same_segment = segments[:, :, None] == segments[:, None, :]
+        causal = torch.ones(width, width, dtype=torch.bool).tril()
+        allowed = same_segment & causal[None] & real[:, :, None]
+        # Padding rows attend to themselves only, so softmax never sees an all -inf row
+        allowed |= torch.eye(width, dtype=torch.bool)[None] & ~real[:, :, None]
+
+        mask = torch.zeros(allowed.shape, dtype=self.dtype)
+        mask.masked_fill_(~allowed, torch.finfo(self.dtype).min)
+        batch["attention_mask"] = mask[:, None]
+        return batch
+
+
+class LengthBucketBatchSampler(Sampler):
+    """
+    Batches of similar-length examples: indices are shuffled, cut into buckets of
+    `bucket_batches * batch_size`, sorted by length inside each bucket and split into
+    batches, and the batch order is shuffled again. Use as a DataLoader `batch_sampler`;
+    with the HF Trainer, `group_by_length=True` over the `length` column does the same.
+    """
+
+    def __init__(self, lengths: Sequence[int], batch_size: int, bucket_batches: int = 50, seed: int = 0, drop_last: bool = False):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = batch_size * bucket_batches
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _batches(self) -> List[List[int]]:
+        rng = random.Random(self.seed + self.epoch)
+        indices = list(range(len(self.lengths)))
+        rng.shuffle(indices)
+
+        batches = []
+        for start in self._bucket_starts():
+            bucket = sorted(indices[start:start + self.bucket_size], key=lambda i: self.lengths[i])
+            for b in range(0, len(bucket), self.batch_size):
+                batch = bucket[b:b + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch)
+        rng.shuffle(batches)
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        return iter(self._batches())
+
+    def _bucket_starts(self) -> range:
+        return range(0, len(self.lengths), self.bucket_size)
+
+    def __len__(self) -> int:
+        # Same per-bucket arithmetic as _batches: each bucket drops (or keeps) its own short batch
+        count = 0
+        for start in self._bucket_starts():
+            size = min(self.bucket_size, len(self.lengths) - start)
+            count += size // self.batch_size if self.drop_last else -(-size // self.batch_size)
+        return count
+
+
+def padding_stats(feature_batches: Iterable[List[dict]], collate: Callable[[List[dict]], dict]) -> dict:
+    """
+    Padding ratio and tokens per step of `collate` over batches of features:
+    computed tokens are the collated batch size times its width, real tokens the unpadded
+    lengths (or attention mask sums of pre-padded features), trained tokens those with a label.
+    """
+    steps = computed = real = trained = 0
+    for features in feature_batches:
+        batch = collate(features)
+        steps += 1
+        computed += batch["input_ids"].numel()
+        real += sum(int(np.sum(f["attention_mask"])) if "attention_mask" in f else len(f["input_ids"]) for f in features)
+        trained += int((batch["labels"] != -100).sum())
+
+    return {
+        "steps": steps,
+        "padding_ratio": round(1 - real / computed, 4) if computed else 0.0,
+        "computed_tokens_per_step": round(computed / steps, 1) if steps else 0.0,
+        "real_tokens_per_step": round(real / steps, 1) if steps else 0.0,
+        "trained_tokens_per_step": round(trained / steps, 1) if steps else 0.0,
+    }
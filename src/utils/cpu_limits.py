@@ -0,0 +1,45 @@
+import os
+from typing import Optional
+
+CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_V1_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def get_cgroup_cpu_quota() -> Optional[float]:
+    """
+    Return the container CPU limit in cores (e.g. 0.5 for `cpu: 500m`),
+    or None when the process is not CPU-limited.
+    """
+    cpu_max = _read(CGROUP_V2_CPU_MAX)
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+
+    quota, period = _read(CGROUP_V1_QUOTA), _read(CGROUP_V1_PERIOD)
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def get_cpu_limit() -> float:
+    """Effective number of cores available: cgroup quota, affinity mask, then host count"""
+    try:
+        available = len(os.sched_getaffinity(0))
+    except AttributeError:
+        available = os.cpu_count() or 1
+
+    quota = get_cgroup_cpu_quota()
+    if quota is None:
+        return float(available)
+    return min(quota, float(available))
@@ -1,12 +1,24 @@
-from datasets import load_dataset, Dataset
+import hashlib
+import itertools
+import json
+import os
+from datasets import load_dataset, load_from_disk, Dataset
 from tqdm.auto import tqdm
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from sklearn.model_selection import train_test_split
 
-def preprocess_function(example):
-    SYSTEM_PROMPT = (
+SYSTEM_PROMPT = (
     "Bạn là một trợ lý luật pháp Việt Nam thông minh, luôn trả lời bằng tiếng Việt chuẩn và dễ hiểu."
-    )
+)
+
+DATASET_SOURCE = "thangvip/vietnamese-legal-qa"
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", "data/cache")
+# Bump when the processing below changes, so stale caches are not reused
+DATASET_CACHE_VERSION = 2
+
+def preprocess_function(example):
     user_content = example["question"].strip()
     assistant_content = example["answer"].strip()
 
@@ -18,39 +30,92 @@ def preprocess_function(example):
         ]
     }
 
-def get_dataset(n_samples=30000):
-    ds = load_dataset("thangvip/vietnamese-legal-qa", split="train")
-
-    rows = []
-
-    for i in tqdm(range(len(ds))):
-        qa_pairs = ds[i]["generated_qa_pairs"]
-        for qa_pair in qa_pairs:
-            rows.append({
-                "question": qa_pair["question"],
-                "answer": qa_pair["answer"]
-            })
-
-    df = pd.DataFrame(rows)
-
-    df = df.assign(
-        num_tokens=df["answer"].apply(lambda text: len(str(text).split()))
+def _load_source(source: str) -> Dataset:
+    """Hub dataset id, a directory written by save_to_disk, or a local parquet/json/jsonl/csv file"""
+    if os.path.isdir(source):
+        return load_from_disk(source)
+    if os.path.isfile(source):
+        builder = {".jsonl": "json", ".json": "json", ".csv": "csv"}.get(os.path.splitext(source)[1], "parquet")
+        return load_dataset(builder, data_files=source, split="train")
+    return load_dataset(source, split="train")
+
+def _explode_qa_pairs(ds: Dataset, max_words: int, chunk_size: int) -> pa.Table:
+    """
+    Flatten `generated_qa_pairs` into question/answer rows and keep answers under `max_words`
+    words, one Arrow record batch at a time (the source stays memory-mapped, only kept rows
+    are held in memory)
+    """
+    kept = []
+    for chunk in tqdm(ds.select_columns(["generated_qa_pairs"]).with_format("arrow").iter(batch_size=chunk_size),
+                      total=-(-len(ds) // chunk_size), desc="Exploding QA pairs"):
+        pairs = pc.list_flatten(chunk.column("generated_qa_pairs"))
+        if len(pairs) == 0:
+            continue
+        pairs = pa.concat_arrays(pairs.chunks) if isinstance(pairs, pa.ChunkedArray) else pairs
+        questions, answers = pairs.field("question"), pairs.field("answer")
+        # Same count as len(answer.split()) (Unicode whitespace), in C++
+        num_words = pc.list_value_length(pc.utf8_split_whitespace(answers))
+        keep = pc.and_(pc.less(num_words, max_words), pc.and_(pc.is_valid(questions), pc.is_valid(answers)))
+        kept.append(pa.table({"question": questions, "answer": answers}).filter(keep))
+
+    if not kept:
+        return pa.table({"question": pa.array([], pa.string()), "answer": pa.array([], pa.string())})
+    return pa.concat_tables(kept)
+
+def _to_messages(table: pa.Table) -> Dataset:
+    """Columnar preprocess_function: one messages list (system, user, assistant) per row"""
+    n = table.num_rows
+    contents = np.empty(3 * n, dtype=object)
+    contents[0::3] = SYSTEM_PROMPT
+    contents[1::3] = pc.utf8_trim_whitespace(table.column("question")).to_numpy(zero_copy_only=False)
+    contents[2::3] = pc.utf8_trim_whitespace(table.column("answer")).to_numpy(zero_copy_only=False)
+    roles = np.tile(np.array(["system", "user", "assistant"], dtype=object), n)
+
+    messages = pa.ListArray.from_arrays(
+        pa.array(np.arange(0, 3 * n + 1, 3), pa.int32()),
+        pa.StructArray.from_arrays([pa.array(roles, pa.string()), pa.array(contents, pa.string())], ["role", "content"]),
     )
-
-    df = df.loc[df["num_tokens"] < 256]
+    return Dataset(pa.table({"messages": messages}))
+
+def get_dataset(n_samples=30000, source=DATASET_SOURCE, cache_dir=DATASET_CACHE_DIR, max_words=256,
+                test_size=0.1, seed=42, chunk_size=10000):
+    """
+    Train/val splits of chat-formatted legal QA pairs.
+
+    Results are cached under `cache_dir` with save_to_disk, keyed by a hash of the source
+    fingerprint and every parameter, so a repeat run only memory-maps two Arrow files.
+    `source` may be a Hub id or a local fixture (see _load_source).
+    """
+    ds = _load_source(source)
+    key = hashlib.sha256(json.dumps({
+        "source": source,
+        "fingerprint": ds._fingerprint,
+        "n_samples": n_samples,
+        "max_words": max_words,
+        "test_size": test_size,
+        "seed": seed,
+        "version": DATASET_CACHE_VERSION,
+    }, sort_keys=True).encode()).hexdigest()[:16]
+    cache_path = os.path.join(cache_dir, f"legal-qa-{key}")
+
+    if os.path.isdir(cache_path):
+        return load_from_disk(os.path.join(cache_path, "train")), load_from_disk(os.path.join(cache_path, "val"))
+
+    df = _explode_qa_pairs(ds, max_words, chunk_size).to_pandas()
     if len(df) > n_samples:
-        df = df.sample(n_samples, random_state=42).reset_index(drop=True)
+        df = df.sample(n_samples, random_state=seed).reset_index(drop=True)
 
-    df_train, df_val = train_test_split(df, test_size=0.1, random_state=42)
+    df_train, df_val = train_test_split(df, test_size=test_size, random_state=seed)
+    ds_train = _to_messages(pa.Table.from_pandas(df_train, preserve_index=False))
+    ds_val = _to_messages(pa.Table.from_pandas(df_val, preserve_index=False))
 
-    ds_train = Dataset.from_pandas(df)
-    ds_val = Dataset.from_pandas(df_val)
+    # Write next to the final path and rename, so an interrupted run never leaves a partial cache
+    tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+    ds_train.save_to_disk(os.path.join(tmp_path, "train"))
+    ds_val.save_to_disk(os.path.join(tmp_path, "val"))
+    os.replace(tmp_path, cache_path)
 
-    # Áp dụng preprocess_function
-    ds_train = ds_train.map(preprocess_function).select_columns(["messages"])
-    ds_val = ds_val.map(preprocess_function).select_columns(["messages"])
-
-    return ds_train, ds_val
+    return load_from_disk(os.path.join(cache_path, "train")), load_from_disk(os.path.join(cache_path, "val"))
 
 def tokenize_and_mask(example, tokenizer, max_length):
     messages = example["messages"]
@@ -72,3 +137,72 @@ def tokenize_and_mask(example, tokenizer, max_length):
     labels = labels[:max_length]
 
     return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+
+def _prompt_boundary(encoded, index, prompt_chars, text_chars, num_tokens):
+    """Index of the first token of the completion (num_tokens when truncation cut it off)"""
+    for char in range(prompt_chars, text_chars):
+        token = encoded.char_to_token(index, char)
+        if token is not None:
+            return token
+    return num_tokens
+
+def tokenize_and_mask_batched(batch, tokenizer, max_length, pad=True):
+    """
+    Batched tokenize_and_mask for `Dataset.map(batched=True, num_proc=N)`.
+
+    Each example is tokenized once, unpadded: with a fast tokenizer the prompt boundary is
+    the token holding the first completion character, otherwise it comes from one extra
+    length-only pass over the prompts. Padding, attention mask and labels are then built
+    with array operations; unlike tokenize_and_mask, padding positions are masked to -100
+    too (pad is eos in the fine-tuning notebook, so padding used to be trained as eos).
+    Returns int32 NumPy columns of width `max_length`; with `pad=False`, unpadded
+    `input_ids`/`labels` rows plus a `length` column for the collators in `collation.py`.
+    """
+    conversations = batch["messages"]
+    prompt_texts = tokenizer.apply_chat_template(
+        [messages[:-1] for messages in conversations], tokenize=False, add_generation_prompt=False
+    )
+    full_texts = [
+        prompt + messages[-1]["content"] + tokenizer.eos_token
+        for prompt, messages in zip(prompt_texts, conversations)
+    ]
+
+    encoded = tokenizer(full_texts, truncation=True, max_length=max_length, return_attention_mask=False)
+    ids = encoded["input_ids"]
+    lengths = np.fromiter(map(len, ids), dtype=np.int64, count=len(ids))
+
+    if tokenizer.is_fast:
+        prompt_lens = np.fromiter(
+            (
+                _prompt_boundary(encoded, i, len(prompt), len(text), n)
+                for i, (prompt, text, n) in enumerate(zip(prompt_texts, full_texts, lengths))
+            ),
+            dtype=np.int64,
+            count=len(ids),
+        )
+    else:
+        prompt_ids = tokenizer(prompt_texts, truncation=True, max_length=max_length)["input_ids"]
+        prompt_lens = np.fromiter(map(len, prompt_ids), dtype=np.int64, count=len(prompt_ids))
+
+    if not pad:
+        flat_ids = np.fromiter(itertools.chain.from_iterable(ids), dtype=np.int32, count=int(lengths.sum()))
+        offsets = np.cumsum(lengths)[:-1]
+        positions = np.arange(len(flat_ids)) - np.repeat(np.concatenate([[0], offsets]), lengths)
+        flat_labels = np.where(positions < np.repeat(prompt_lens, lengths), -100, flat_ids).astype(np.int32)
+        return {
+            "input_ids": np.split(flat_ids, offsets),
+            "labels": np.split(flat_labels, offsets),
+            "length": lengths.astype(np.int32),
+        }
+
+    positions = np.arange(max_length)
+    attention_mask = positions[None, :] < lengths[:, None]
+    if tokenizer.padding_side == "left":
+        attention_mask = attention_mask[:, ::-1]
+        prompt_lens = prompt_lens + (max_length - lengths)
+
+    input_ids = np.full((len(ids), max_length), tokenizer.pad_token_id, dtype=np.int32)
+    input_ids[attention_mask] = np.fromiter(itertools.chain.from_iterable(ids), dtype=np.int32, count=int(lengths.sum()))
+
+    labels = np.where((positions[None, :] < prompt_lens[:, None]) | ~attention_mask, -100, input_ids).astype(np.int32)
+    return {"input_ids": input_ids, "attention_mask": attention_mask.astype(np.int32), "labels": labels}
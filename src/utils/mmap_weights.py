@@ -0,0 +1,102 @@
+import glob
+import json
+import mmap
+import os
+import struct
+from typing import Dict, List, Tuple
+
+import torch
+from loguru import logger
+from transformers import AutoConfig, AutoModelForCausalLM
+from transformers.modeling_utils import no_init_weights
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def mmap_safetensors(path: str) -> Tuple[Dict[str, torch.Tensor], mmap.mmap]:
+    """
+    Map a .safetensors file and return tensors that view its pages directly, with the
+    mapping they point into. The mapping is private copy-on-write: unmodified pages stay
+    shared with every other process mapping the same file through the page cache.
+    """
+    with open(path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len))
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    data_start = 8 + header_len
+    tensors = {}
+    for name, spec in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[spec["dtype"]]
+        start, end = spec["data_offsets"]
+        count = (end - start) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            tensors[name] = torch.empty(spec["shape"], dtype=dtype)
+            continue
+        tensors[name] = torch.frombuffer(mapping, dtype=dtype, count=count, offset=data_start + start).view(spec["shape"])
+    return tensors, mapping
+
+
+def close_mappings(mappings: List[mmap.mmap]):
+    """
+    Unmap the shards of a released model. A mapping some tensor still views cannot be closed
+    yet; it is unmapped when that tensor is freed.
+    """
+    for mapping in mappings:
+        try:
+            mapping.close()
+        except BufferError:
+            logger.warning("Memory-mapped weights still referenced, unmapped once they are freed")
+
+
+def load_mmap_model(model_path: str) -> Tuple[AutoModelForCausalLM, List[mmap.mmap]]:
+    """
+    Build the model without initialising weights, then assign memory-mapped safetensors
+    shards as its parameters. No weight bytes are copied: RSS grows only as pages are touched,
+    and worker processes loading the same files share the physical pages.
+    Weights keep the dtype they were saved in. Returns the model and the shard mappings,
+    which the caller closes (`close_mappings`) once it has released the model.
+    """
+    shards = sorted(glob.glob(os.path.join(model_path, "*.safetensors")))
+    if not shards:
+        raise FileNotFoundError(f"No .safetensors shards in {model_path}")
+
+    state_dict: Dict[str, torch.Tensor] = {}
+    mappings: List[mmap.mmap] = []
+    for shard in shards:
+        tensors, mapping = mmap_safetensors(shard)
+        state_dict.update(tensors)
+        mappings.append(mapping)
+
+    config = AutoConfig.from_pretrained(model_path)
+    dtype = next(t.dtype for t in state_dict.values() if t.is_floating_point())
+
+    # Parameters are allocated with torch.empty and never touched, so they cost no resident memory
+    with no_init_weights():
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype)
+
+    missing, unexpected = model.load_state_dict(state_dict, strict=False, assign=True)
+    if unexpected:
+        raise RuntimeError(f"Unexpected weights in checkpoint: {unexpected[:5]}")
+
+    # Tied weights (e.g. lm_head → embed_tokens) are absent from the checkpoint by design
+    model.tie_weights()
+    mapped = {t.data_ptr() for t in state_dict.values()}
+    missing = [k for k in missing if model.get_parameter(k).data_ptr() not in mapped]
+    if missing:
+        raise RuntimeError(f"Weights missing from checkpoint: {missing[:5]}")
+
+    return model.eval(), mappings
@@ -1,50 +1,269 @@
 import boto3
 from dotenv import load_dotenv
+import hashlib
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Dict, List, Optional
 from tqdm.auto import tqdm
 
-def load_model_from_s3(s3_prefix: str, local_dir: str = "downloaded_model"):
+MANIFEST_NAME = ".s3_manifest.json"
+MULTIPART_THRESHOLD = 64 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+
+@dataclass
+class DownloadStats:
+    files_total: int = 0
+    files_skipped: int = 0
+    bytes_total: int = 0
+    bytes_downloaded: int = 0
+    bytes_resumed: int = 0
+    seconds: float = 0.0
+
+    @property
+    def throughput_mb_s(self) -> float:
+        return self.bytes_downloaded / 1024 / 1024 / self.seconds if self.seconds > 0 else 0.0
+
+
+class _PartialFile:
     """
-    Download an entire model directory (e.g., from MLflow-registered S3 prefix).
-    Example s3_prefix: "models/health-llm/b3f91d2b6f42464aab9b9ff07d22ad89"
+    A download in progress: `<path>.part` is preallocated to the object size and chunks are
+    written in place; finished chunk indices are recorded in `<path>.part.json` so an
+    interrupted download resumes with only the missing chunks.
     """
 
-    load_dotenv()
+    def __init__(self, local_path: str, size: int, etag: str, chunk_size: int):
+        self.local_path = local_path
+        self.part_path = local_path + ".part"
+        self.progress_path = local_path + ".part.json"
+        self.size = size
+        self.etag = etag
+        self.chunk_size = chunk_size
+        self.num_chunks = max(1, -(-size // chunk_size))
+        self._lock = threading.Lock()
+
+        self.done = set()
+        progress = _read_json(self.progress_path)
+        if (
+            progress.get("etag") == etag
+            and progress.get("size") == size
+            and progress.get("chunk_size") == chunk_size
+            and os.path.exists(self.part_path)
+        ):
+            self.done = set(progress.get("done", []))
+        else:
+            with open(self.part_path, "wb") as f:
+                f.truncate(size)
+
+    def pending_chunks(self) -> List[int]:
+        return [i for i in range(self.num_chunks) if i not in self.done]
+
+    def chunk_range(self, index: int):
+        start = index * self.chunk_size
+        return start, min(start + self.chunk_size, self.size) - 1
+
+    def mark_done(self, index: int) -> bool:
+        """Record a finished chunk; returns True once every chunk is on disk"""
+        with self._lock:
+            self.done.add(index)
+            _write_json(self.progress_path, {
+                "etag": self.etag,
+                "size": self.size,
+                "chunk_size": self.chunk_size,
+                "done": sorted(self.done),
+            })
+            return len(self.done) == self.num_chunks
+
+    def finalize(self):
+        os.replace(self.part_path, self.local_path)
+        os.remove(self.progress_path)
 
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json(path: str, data: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _make_client():
     aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
     aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
     aws_region = os.getenv("AWS_DEFAULT_REGION", "ap-southeast-2")
-    bucket_name = os.getenv("AWS_BUCKET_NAME", "mlflow-artifacts-monitor")
 
-    if not all([aws_access_key, aws_secret_key, bucket_name]):
+    if not all([aws_access_key, aws_secret_key]):
         raise ValueError("Missing AWS credentials or bucket name in .env file")
 
-    s3 = boto3.client(
+    return boto3.client(
         "s3",
         aws_access_key_id=aws_access_key,
         aws_secret_access_key=aws_secret_key,
-        region_name=aws_region
+        region_name=aws_region,
+        endpoint_url=os.getenv("S3_ENDPOINT_URL") or None
+    )
+
+
+def _md5(path: str) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(READ_SIZE), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _is_current(local_path: str, obj: dict, manifest: Dict[str, dict]) -> bool:
+    """
+    Local copy matches the object's size and the ETag it was downloaded with. A copy without a
+    manifest entry (downloaded before the manifest existed) is checked against the ETag when it
+    is a single-part MD5, by size alone for multipart ETags, and recorded in the manifest
+    """
+    if not os.path.exists(local_path) or os.path.getsize(local_path) != obj["Size"]:
+        return False
+    entry = manifest.get(obj["Key"])
+    if entry is not None:
+        return entry.get("etag") == obj["ETag"]
+
+    etag = obj["ETag"].strip('"')
+    if "-" not in etag and _md5(local_path) != etag:
+        return False
+    manifest[obj["Key"]] = {"etag": obj["ETag"], "size": obj["Size"]}
+    return True
+
+
+def _download_chunk(s3, bucket_name: str, obj: dict, partial: _PartialFile, index: int, pbar) -> int:
+    start, end = partial.chunk_range(index)
+    response = s3.get_object(
+        Bucket=bucket_name,
+        Key=obj["Key"],
+        Range=f"bytes={start}-{end}",
+        IfMatch=obj["ETag"]
     )
 
+    written = 0
+    fd = os.open(partial.part_path, os.O_WRONLY)
+    try:
+        for data in response["Body"].iter_chunks(READ_SIZE):
+            os.pwrite(fd, data, start + written)
+            written += len(data)
+            pbar.update(len(data))
+    finally:
+        os.close(fd)
+
+    if written != end - start + 1:
+        raise IOError(f"Short read for {obj['Key']} bytes {start}-{end}: got {written}")
+    return written
+
+
+def sync_s3_prefix(
+    s3,
+    bucket_name: str,
+    s3_prefix: str,
+    local_dir: str,
+    max_workers: int = 8,
+    multipart_threshold: int = MULTIPART_THRESHOLD,
+    chunk_size: int = CHUNK_SIZE,
+) -> DownloadStats:
+    """
+    Mirror every object under `s3_prefix` into `local_dir`.
+
+    One listing pass; objects whose local copy already matches size and ETag are skipped;
+    objects above `multipart_threshold` are fetched as concurrent ranged GETs of `chunk_size`;
+    interrupted downloads resume from their `.part` file.
+    """
+    start_time = time.time()
     os.makedirs(local_dir, exist_ok=True)
+    manifest_path = os.path.join(local_dir, MANIFEST_NAME)
+    manifest = _read_json(manifest_path)
 
+    objects = []
     paginator = s3.get_paginator("list_objects_v2")
-    total_files = 0
-
-    # Đếm file trước (để tqdm chạy đẹp)
     for page in paginator.paginate(Bucket=bucket_name, Prefix=s3_prefix):
-        for obj in page.get("Contents", []):
-            total_files += 1
+        objects.extend(obj for obj in page.get("Contents", []) if not obj["Key"].endswith("/"))
+
+    stats = DownloadStats(files_total=len(objects), bytes_total=sum(obj["Size"] for obj in objects))
+
+    jobs = []
+    for obj in objects:
+        local_path = os.path.join(local_dir, os.path.relpath(obj["Key"], s3_prefix))
+        if _is_current(local_path, obj, manifest):
+            stats.files_skipped += 1
+            continue
 
-    with tqdm(total=total_files, desc=f"Downloading model from {s3_prefix}") as pbar:
-        for page in paginator.paginate(Bucket=bucket_name, Prefix=s3_prefix):
-            for obj in page.get("Contents", []):
-                key = obj["Key"]
-                local_path = os.path.join(local_dir, os.path.relpath(key, s3_prefix))
-                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        partial = _PartialFile(
+            local_path,
+            obj["Size"],
+            obj["ETag"],
+            chunk_size if obj["Size"] > multipart_threshold else max(obj["Size"], 1)
+        )
+        stats.bytes_resumed += sum(
+            end - start + 1 for start, end in map(partial.chunk_range, partial.done)
+        )
+        if obj["Size"] == 0:
+            partial.mark_done(0)
+            partial.finalize()
+            manifest[obj["Key"]] = {"etag": obj["ETag"], "size": 0}
+            continue
+        jobs.extend((obj, partial, index) for index in partial.pending_chunks())
 
-                s3.download_file(bucket_name, key, local_path)
-                pbar.update(1)
+    remaining = sum(end - start + 1 for _, partial, index in jobs for start, end in [partial.chunk_range(index)])
+    with tqdm(total=remaining, unit="B", unit_scale=True, desc=f"Downloading model from {s3_prefix}") as pbar:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(_download_chunk, s3, bucket_name, obj, partial, index, pbar): (obj, partial, index)
+                for obj, partial, index in jobs
+            }
+            error: Optional[Exception] = None
+            for future in as_completed(futures):
+                obj, partial, index = futures[future]
+                try:
+                    stats.bytes_downloaded += future.result()
+                except Exception as e:
+                    # Keep recording the chunks that do finish so the next run resumes from them
+                    error = error or e
+                    continue
+                if partial.mark_done(index):
+                    partial.finalize()
+                    manifest[obj["Key"]] = {"etag": obj["ETag"], "size": obj["Size"]}
+                    _write_json(manifest_path, manifest)
 
-    print(f"Model downloaded successfully → {local_dir}")
-    return local_dir
\ No newline at end of file
+    _write_json(manifest_path, manifest)
+    stats.seconds = time.time() - start_time
+    if error is not None:
+        raise error
+    return stats
+
+
+def load_model_from_s3(s3_prefix: str, local_dir: str = "downloaded_model", max_workers: int = 8):
+    """
+    Download an entire model directory (e.g., from MLflow-registered S3 prefix).
+    Example s3_prefix: "models/health-llm/b3f91d2b6f42464aab9b9ff07d22ad89"
+    """
+    load_dotenv()
+
+    bucket_name = os.getenv("AWS_BUCKET_NAME", "mlflow-artifacts-monitor")
+    s3 = _make_client()
+
+    stats = sync_s3_prefix(s3, bucket_name, s3_prefix, local_dir, max_workers=max_workers)
+
+    print(
+        f"Model downloaded successfully → {local_dir}: "
+        f"{stats.files_total - stats.files_skipped}/{stats.files_total} files fetched, "
+        f"{stats.files_skipped} up to date, {stats.bytes_resumed / 1024 / 1024:.1f}MB resumed, "
+        f"{stats.bytes_downloaded / 1024 / 1024:.1f}MB in {stats.seconds:.1f}s "
+        f"({stats.throughput_mb_s:.1f}MB/s)"
+    )
+    return local_dir
@@ -0,0 +1,90 @@
+"""
+Weight precision of the transformers backend (MODEL_PRECISION):
+
+- auto: float16 on CUDA; on CPU bfloat16 when the CPU computes bf16 natively
+  (AVX512-BF16 or AMX), float32 otherwise
+- float32 / float16 / bfloat16: weights loaded in that dtype
+- int8: weights loaded in float32, then every nn.Linear replaced by a dynamically
+  quantized one (int8 weights, activations quantized per call); CPU only
+
+float16 matmuls have no fast CPU kernels, and bf16 without hardware support is emulated
+through float32 conversions, so on CPU those are usually slower than float32.
+"""
+import ctypes
+import ctypes.util
+import gc
+from typing import Optional
+
+import torch
+from loguru import logger
+
+PRECISIONS = ("auto", "float32", "float16", "bfloat16", "int8")
+
+DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    # Dynamic quantization starts from float32 weights
+    "int8": torch.float32,
+}
+
+CPUINFO = "/proc/cpuinfo"
+NATIVE_BF16_FLAGS = {"avx512_bf16", "amx_bf16"}
+
+
+def _cpu_flags() -> Optional[set]:
+    try:
+        with open(CPUINFO) as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.partition(":")[2].split())
+    except OSError:
+        pass
+    return None
+
+
+def cpu_has_native_bf16() -> bool:
+    """Whether bf16 matmuls run on bf16 hardware instructions rather than through float32"""
+    flags = _cpu_flags()
+    return bool(flags and flags & NATIVE_BF16_FLAGS)
+
+
+def resolve_precision(precision: str, device: str) -> str:
+    """Concrete precision for `device`: resolves auto and falls back from int8 on CUDA"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown model precision {precision!r}, expected one of {', '.join(PRECISIONS)}")
+    if precision == "auto":
+        if device == "cuda":
+            return "float16"
+        return "bfloat16" if cpu_has_native_bf16() else "float32"
+    if precision == "int8" and device != "cpu":
+        logger.warning("Dynamic int8 quantization runs on CPU only, using float16 on CUDA")
+        return "float16"
+    return precision
+
+
+def quantize_linear_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """Dynamic int8 quantization of every nn.Linear (the lm_head included); the rest stays float32"""
+    engines = torch.backends.quantized.supported_engines
+    # x86 picks fbgemm or onednn kernels per op; fbgemm alone on older builds
+    torch.backends.quantized.engine = "x86" if "x86" in engines else "fbgemm" if "fbgemm" in engines else engines[0]
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+    # Safetensors checkpoints load as views of one mapping of the file. Quantizing reads every
+    # page of it, and the float32 tensors left (embeddings, norms) keep the whole mapping and its
+    # resident pages alive; copying them lets it close.
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        tensor.data = tensor.data.clone()
+    # The replaced modules sit in reference cycles
+    gc.collect()
+    release_free_memory()
+    return model
+
+
+def release_free_memory():
+    """Hand freed heap pages back to the OS (glibc only; a no-op elsewhere)"""
+    libc_name = ctypes.util.find_library("c")
+    try:
+        ctypes.CDLL(libc_name).malloc_trim(0)
+    except (OSError, AttributeError, TypeError):
+        pass
@@ -0,0 +1,55 @@
+"""
+Prometheus multiprocess mode, for several worker processes serving one port.
+
+With PROMETHEUS_MULTIPROC_DIR set, prometheus_client keeps every metric value in per-process
+mmap files in that directory, and /metrics (prometheus_fastapi_instrumentator) merges the
+files of all workers on each scrape instead of reporting whichever worker accepted it.
+Counters and histograms of exited workers keep counting toward the totals; their live
+gauges are removed with `mark_dead`.
+
+The variable is read when prometheus_client is imported and metric values are bound to
+files when the metrics are created, so `prepare` has to run before monitor.metrics is
+imported. `python -m src.server` does this and reaps its workers. Under `uvicorn --workers`
+set the variable in the environment and empty the directory before starting; workers that
+exit cleanly mark themselves dead on shutdown, crashed ones leave their live gauges behind
+until the next start.
+"""
+import glob
+import os
+import tempfile
+from typing import Optional
+
+from loguru import logger
+
+ENV_VAR = "PROMETHEUS_MULTIPROC_DIR"
+
+
+def enabled() -> bool:
+    return bool(os.environ.get(ENV_VAR))
+
+
+def prepare(workers: int) -> Optional[str]:
+    """
+    Set up the metrics directory for a server about to fork `workers` processes: a fresh
+    temporary one when several workers run and none is configured, emptied of files from
+    earlier runs. Returns the directory, None in single-process mode.
+    """
+    if not enabled():
+        if workers <= 1:
+            return None
+        os.environ[ENV_VAR] = tempfile.mkdtemp(prefix="prometheus-multiproc-")
+    path = os.environ[ENV_VAR]
+    os.makedirs(path, exist_ok=True)
+    stale = glob.glob(os.path.join(path, "*.db"))
+    for name in stale:
+        os.remove(name)
+    logger.info(f"Prometheus multiprocess metrics in {path} (removed {len(stale)} stale files)")
+    return path
+
+
+def mark_dead(pid: int):
+    """Drop the live gauges of a process that has exited (or stopped serving)"""
+    if enabled():
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(pid)
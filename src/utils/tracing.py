@@ -0,0 +1,111 @@
+"""
+Per-request trace IDs and stage timings.
+
+TraceMiddleware gives every HTTP request a trace ID (taken from X-Request-ID when the
+caller sends one), binds it to loguru's context and echoes it in X-Trace-ID. The chat
+service adds stage durations to the current RequestTrace; the endpoint calls `finish`
+to export them as histograms and log one breakdown line under the trace ID.
+"""
+import os
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional
+
+from loguru import logger
+
+from monitor.metrics import record_chat_request, record_stage_timings
+
+TRACE_HEADER = "x-trace-id"
+REQUEST_ID_HEADER = b"x-request-id"
+
+LOG_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+    "<magenta>{extra[trace_id]}</magenta> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+)
+
+_current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("current_trace", default=None)
+
+
+class RequestTrace:
+    """Stage durations (seconds) of one request; written from the inference thread, read after it finishes"""
+
+    __slots__ = ("trace_id", "start", "stages", "tokens")
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.tokens = 0
+
+    def child(self, name) -> "RequestTrace":
+        """Trace of one part of this request (an item of a batch), timed from now"""
+        return RequestTrace(f"{self.trace_id}/{name}")
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def finish(self, endpoint: str):
+        """Export the stage histograms and log the breakdown"""
+        record_stage_timings(endpoint, self.stages, self.tokens)
+        breakdown = " ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in self.stages.items())
+        logger.bind(trace_id=self.trace_id).info(
+            f"{endpoint} done in {(time.perf_counter() - self.start) * 1000:.1f}ms, "
+            f"{self.tokens} tokens: {breakdown or 'no stages (cached)'}"
+        )
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def configure_logging():
+    """Log through one stderr sink whose lines carry the trace ID ("-" outside a request)"""
+    logger.remove()
+    logger.configure(extra={"trace_id": "-"})
+    logger.add(sys.stderr, format=LOG_FORMAT, level=os.getenv("LOG_LEVEL", "INFO"))
+
+
+class TraceMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware task or body buffering, streaming stays streaming).
+    Request count and duration are recorded for `traced_paths` only, to keep label cardinality bounded.
+    """
+
+    def __init__(self, app, traced_paths: Iterable[str] = ()):
+        self.app = app
+        self.traced_paths = frozenset(traced_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = None
+        for name, value in scope.get("headers", ()):
+            if name == REQUEST_ID_HEADER:
+                trace_id = value.decode("latin-1")[:64]
+                break
+        trace = RequestTrace(trace_id or uuid.uuid4().hex[:16])
+        status_code = 500
+
+        async def send_with_trace_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (TRACE_HEADER.encode(), trace.trace_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        token = _current_trace.set(trace)
+        try:
+            with logger.contextualize(trace_id=trace.trace_id):
+                await self.app(scope, receive, send_with_trace_id)
+        finally:
+            _current_trace.reset(token)
+            path = scope["path"]
+            if path in self.traced_paths:
+                record_chat_request(scope["method"], path, status_code, time.perf_counter() - trace.start)
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from src.utils.model_downloader import MANIFEST_NAME, _PartialFile, sync_s3_prefix
+
+BUCKET = "models"
+PREFIX = "models/legal-llm/run-1"
+CHUNK = 1024
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def put(s3, name: str, data: bytes):
+    s3.put_object(Bucket=BUCKET, Key=f"{PREFIX}/{name}", Body=data)
+
+
+def sync(s3, local_dir, **kwargs):
+    return sync_s3_prefix(s3, BUCKET, PREFIX, str(local_dir), max_workers=1, multipart_threshold=CHUNK, chunk_size=CHUNK, **kwargs)
+
+
+class FailingRanges:
+    """S3 client whose ranged GETs fail past `fail_from` bytes, like a download cut off midway"""
+
+    def __init__(self, s3, fail_from: int):
+        self.s3 = s3
+        self.fail_from = fail_from
+
+    def get_object(self, **kwargs):
+        start = int(kwargs["Range"].split("=")[1].split("-")[0])
+        if start >= self.fail_from:
+            raise ConnectionError("connection reset")
+        return self.s3.get_object(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.s3, name)
+
+
+def test_unchanged_objects_are_skipped(s3, tmp_path):
+    put(s3, "config.json", b'{"model_type": "llama"}')
+    put(s3, "model.safetensors", os.urandom(5 * CHUNK + 17))
+
+    first = sync(s3, tmp_path)
+    assert (first.files_total, first.files_skipped) == (2, 0)
+    assert first.bytes_downloaded == first.bytes_total
+
+    second = sync(s3, tmp_path)
+    assert (second.files_total, second.files_skipped) == (2, 2)
+    assert second.bytes_downloaded == 0
+
+
+def test_interrupted_download_resumes_missing_chunks(s3, tmp_path):
+    data = os.urandom(4 * CHUNK + 100)
+    put(s3, "model.safetensors", data)
+
+    with pytest.raises(ConnectionError):
+        sync(FailingRanges(s3, fail_from=2 * CHUNK), tmp_path)
+    assert not (tmp_path / "model.safetensors").exists()
+    assert json.loads((tmp_path / "model.safetensors.part.json").read_text())["done"] == [0, 1]
+
+    stats = sync(s3, tmp_path)
+    assert stats.bytes_resumed == 2 * CHUNK
+    assert stats.bytes_downloaded == len(data) - 2 * CHUNK
+    assert (tmp_path / "model.safetensors").read_bytes() == data
+    assert not (tmp_path / "model.safetensors.part").exists()
+    assert not (tmp_path / "model.safetensors.part.json").exists()
+
+
+def test_changed_etag_restarts_partial_download(s3, tmp_path):
+    put(s3, "model.safetensors", os.urandom(3 * CHUNK))
+    with pytest.raises(ConnectionError):
+        sync(FailingRanges(s3, fail_from=CHUNK), tmp_path)
+
+    # A new version with the same size: chunks of the old one must not be reused
+    data = os.urandom(3 * CHUNK)
+    put(s3, "model.safetensors", data)
+    stats = sync(s3, tmp_path)
+    assert stats.bytes_resumed == 0
+    assert stats.bytes_downloaded == len(data)
+    assert (tmp_path / "model.safetensors").read_bytes() == data
+
+
+def test_changed_object_is_downloaded_again(s3, tmp_path):
+    put(s3, "model.safetensors", os.urandom(2 * CHUNK))
+    sync(s3, tmp_path)
+
+    data = os.urandom(2 * CHUNK)
+    put(s3, "model.safetensors", data)
+    stats = sync(s3, tmp_path)
+    assert stats.files_skipped == 0
+    assert (tmp_path / "model.safetensors").read_bytes() == data
+
+
+def test_pre_manifest_download_is_adopted(s3, tmp_path):
+    data = os.urandom(2 * CHUNK)
+    put(s3, "model.safetensors", data)
+    (tmp_path / "model.safetensors").write_bytes(data)
+
+    stats = sync(s3, tmp_path)
+    assert stats.files_skipped == 1
+    assert stats.bytes_downloaded == 0
+    manifest = json.loads((tmp_path / MANIFEST_NAME).read_text())
+    assert manifest[f"{PREFIX}/model.safetensors"]["etag"].strip('"') == hashlib.md5(data).hexdigest()
+
+
+def test_pre_manifest_copy_with_other_content_is_replaced(s3, tmp_path):
+    data = os.urandom(2 * CHUNK)
+    put(s3, "model.safetensors", data)
+    (tmp_path / "model.safetensors").write_bytes(os.urandom(2 * CHUNK))
+
+    stats = sync(s3, tmp_path)
+    assert stats.files_skipped == 0
+    assert (tmp_path / "model.safetensors").read_bytes() == data
+
+
+def test_partial_file_ignores_progress_of_other_chunking(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    partial = _PartialFile(path, 4 * CHUNK, '"etag"', CHUNK)
+    partial.mark_done(0)
+    assert _PartialFile(path, 4 * CHUNK, '"etag"', CHUNK).pending_chunks() == [1, 2, 3]
+    assert _PartialFile(path, 4 * CHUNK, '"etag"', 2 * CHUNK).pending_chunks() == [0, 1]
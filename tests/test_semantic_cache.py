@@ -0,0 +1,51 @@
+import pytest
+
+from src.semantic_cache import SemanticCache, content_words
+
+PARAPHRASES = [
+    ("Tù chung thân là gì?", "Án tù chung thân là gì vậy?"),
+    ("Án tù chung thân là gì?", "án tù chung thân là gì ạ"),
+    ("Người lao động là ai?", "Xin hỏi người lao động là ai vậy?"),
+]
+
+CONTRASTS = [
+    ("Trách nhiệm hình sự là gì?", "Trách nhiệm dân sự là gì?"),
+    ("Quyền của người lao động là gì?", "Quyền của người sử dụng lao động là gì?"),
+    ("lao động", "sử dụng lao động"),
+    ("Tù chung thân là gì?", "Tù chung thân là bao lâu?"),
+]
+
+
+@pytest.mark.parametrize("cached, asked", PARAPHRASES)
+def test_paraphrase_hits(cached, asked):
+    cache = SemanticCache(capacity=8)
+    cache.put(cached, None, "answer")
+    assert cache.lookup(asked) == "answer"
+
+
+@pytest.mark.parametrize("cached, asked", CONTRASTS)
+def test_contrastive_question_misses(cached, asked):
+    cache = SemanticCache(capacity=8)
+    cache.put(cached, None, "answer")
+    assert cache.lookup(asked) is None
+
+
+def test_hit_skips_closer_row_with_other_content_words():
+    cache = SemanticCache(capacity=8)
+    cache.put("Trách nhiệm dân sự là gì?", None, "dân sự")
+    cache.put("Xin hỏi trách nhiệm hình sự là gì vậy?", None, "hình sự")
+    assert cache.lookup("Trách nhiệm hình sự là gì?") == "hình sự"
+
+
+def test_numbers_and_params_partition_entries():
+    cache = SemanticCache(capacity=8)
+    cache.put("Người dưới 16 tuổi có phải chịu trách nhiệm hình sự không?", None, "16")
+    cache.put("Tù chung thân là gì?", ("legal", 0.7), "answer")
+    assert cache.lookup("Người dưới 18 tuổi có phải chịu trách nhiệm hình sự không?") is None
+    assert cache.lookup("Tù chung thân là gì?", ("legal", 0.2)) is None
+    assert cache.lookup("Tù chung thân là gì?", ("legal", 0.7)) == "answer"
+
+
+def test_content_words_drop_fillers_and_fold_aliases():
+    assert content_words("Án tù chung thân là gì vậy ạ?") == ["tù", "chung", "thân", "gì"]
+    assert content_words("trách nhiệm hình sự") != content_words("trách nhiệm dân sự")